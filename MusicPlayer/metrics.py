@@ -0,0 +1,70 @@
+import threading
+from bisect import bisect_left
+
+# Process-wide histograms shared by the apps, labelled by view and method and
+# served in Prometheus text format at /_debug/perf. Each app registers its
+# metrics under its own name prefix.
+_lock = threading.Lock()
+# name -> (buckets, help)
+_metrics = {}
+# (name, view, method) -> [count per bucket + overflow, sum]
+_histograms = {}
+_collectors = []
+
+def histogram(name, buckets, help):
+    """Register the histogram ``name`` with the given upper bucket bounds."""
+    _metrics[name] = (tuple(buckets), help)
+
+def collector(func):
+    """Register a function returning extra metrics as {name: (type, value)}."""
+    _collectors.append(func)
+    return func
+
+def query_budget(**budgets):
+    """
+    Declare how many SQL queries a view issues, per HTTP method. The query
+    budget tests hold each view to exactly this count on their fixtures, and
+    PerfMiddleware logs requests that go over it.
+    """
+    def decorator(view):
+        view.query_budget = budgets
+        return view
+    return decorator
+
+def observe(name, value, view, method):
+    buckets = _metrics[name][0]
+    with _lock:
+        histogram = _histograms.get((name, view, method))
+        if histogram is None:
+            histogram = _histograms[(name, view, method)] = [[0] * (len(buckets) + 1), 0]
+        histogram[0][bisect_left(buckets, value)] += 1
+        histogram[1] += value
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+def _labels(view, method, **extra):
+    pairs = {'view': view, 'method': method, **extra}
+    return ','.join(f'{name}="{value}"' for name, value in pairs.items())
+
+def prometheus_text():
+    """This process's histograms and collected metrics in Prometheus text format."""
+    with _lock:
+        histograms = {key: ([*counts], total) for key, (counts, total) in _histograms.items()}
+    lines = []
+    for name, (buckets, help) in _metrics.items():
+        lines += [f'# HELP {name} {help}', f'# TYPE {name} histogram']
+        for (key_name, view, method), (counts, total) in sorted(histograms.items()):
+            if key_name != name:
+                continue
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{_labels(view, method, le=bound)}}} {cumulative}')
+            lines.append(f'{name}_sum{{{_labels(view, method)}}} {total}')
+            lines.append(f'{name}_count{{{_labels(view, method)}}} {cumulative}')
+    for collect in _collectors:
+        for name, (kind, value) in collect().items():
+            lines += [f'# TYPE {name} {kind}', f'{name} {value}']
+    return '\n'.join(lines) + '\n'
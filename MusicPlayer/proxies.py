@@ -0,0 +1,18 @@
+from django.conf import settings
+
+def client_ip(request):
+    """
+    The address of the client that sent ``request``.
+
+    Behind TRUSTED_PROXY_COUNT reverse proxies, each of which appends the
+    address it was connected from to X-Forwarded-For, the client is the
+    entry that many places from the right; anything further left was sent by
+    the client and cannot be trusted. With no proxies configured, or a
+    header too short to have passed through all of them, it is REMOTE_ADDR.
+    """
+    count = settings.TRUSTED_PROXY_COUNT
+    if count:
+        forwarded = [ip.strip() for ip in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if ip.strip()]
+        if len(forwarded) >= count:
+            return forwarded[-count]
+    return request.META.get('REMOTE_ADDR', '')
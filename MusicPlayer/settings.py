@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+from datetime import timedelta
 from pathlib import Path
 from dotenv import load_dotenv
 import os
@@ -45,11 +46,13 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'corsheaders',
     'rest_framework',
+    'rest_framework_simplejwt.token_blacklist',
     'auth',
     'Player',
 ]
 
 MIDDLEWARE = [
+    'Player.middleware.PerfMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -86,11 +89,170 @@ WSGI_APPLICATION = 'MusicPlayer.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql switches to PostgreSQL (requires psycopg) configured by
+# the DB_* variables. Both keep connections open for DB_CONN_MAX_AGE seconds.
+
+DB_CONN_MAX_AGE = int(os.getenv("DB_CONN_MAX_AGE", "60"))
+
+if os.getenv("DB_ENGINE", "sqlite") == "postgresql":
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv("DB_NAME", "musicplayer"),
+            'USER': os.getenv("DB_USER", "postgres"),
+            'PASSWORD': os.getenv("DB_PASSWORD", ""),
+            'HOST': os.getenv("DB_HOST", "localhost"),
+            'PORT': os.getenv("DB_PORT", "5432"),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
+    }
+else:
+    # WAL lets readers run alongside the single writer, busy_timeout makes
+    # writers wait for the lock instead of failing with "database is locked",
+    # and IMMEDIATE transactions take that lock up front rather than failing
+    # when a read transaction later tries to write.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'OPTIONS': {
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': (
+                    "PRAGMA journal_mode=WAL;"
+                    f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000'))};"
+                    f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')};"
+                    f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))};"
+                ),
+            },
+            'TEST': {
+                # A file rather than the in-memory default, so tests can start
+                # writer processes against the same database.
+                'NAME': BASE_DIR / 'test_db.sqlite3',
+            },
+        }
     }
+
+
+# Caches
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# "responses" holds serialized /metadata/, /songs/ and /filter/ responses keyed
+# by catalogue version, so song writes invalidate it without waiting for TIMEOUT.
+# "login" holds login rate-limit counters and unknown-identifier lookups; point
+# it at a shared cache so the limits hold across workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'responses': {
+        'BACKEND': os.getenv("RESPONSE_CACHE_BACKEND", "Player.functions.response_cache.CountingLocMemCache"),
+        'LOCATION': os.getenv("RESPONSE_CACHE_LOCATION", "responses"),
+        'TIMEOUT': int(os.getenv("RESPONSE_CACHE_TIMEOUT", "300")),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000")),
+        },
+    },
+    'login': {
+        'BACKEND': os.getenv("LOGIN_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        'LOCATION': os.getenv("LOGIN_CACHE_LOCATION", "login"),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv("LOGIN_CACHE_MAX_ENTRIES", "10000")),
+        },
+    },
+}
+
+
+# "sync" updates the Metadata lists inside each song write; "async" leaves
+# it to a job run by `manage.py run_jobs`, coalescing writes that arrive
+# within METADATA_REFRESH_DEBOUNCE seconds into one refresh.
+METADATA_REFRESH = os.getenv("METADATA_REFRESH", "sync")
+METADATA_REFRESH_DEBOUNCE = float(os.getenv("METADATA_REFRESH_DEBOUNCE", "2"))
+
+# Answer /filter/ from an in-process bitmap index instead of SQL joins.
+# Each worker holds one bit per song per facet value in memory.
+FACET_INDEX = os.getenv("FACET_INDEX", "False").lower() in ("true", "1")
+
+# Largest page_size list endpoints will serve; use export for full result sets.
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "100"))
+
+# Seconds /suggest/ may serve completions built before the latest song write.
+SUGGEST_REFRESH_SECONDS = int(os.getenv("SUGGEST_REFRESH_SECONDS", "30"))
+
+# Route the hot Player read endpoints to async views; only worth it under ASGI.
+ASYNC_VIEWS = os.getenv("ASYNC_VIEWS", "False").lower() in ("true", "1")
+
+# Requests issuing more queries or taking longer than this are logged by
+# Player.middleware.PerfMiddleware. The histograms in MusicPlayer.metrics are
+# served at /_debug/perf to staff users requesting from INTERNAL_IPS, to anyone
+# from INTERNAL_IPS with PERF_REPORT_ALLOW_ANONYMOUS (e.g. for a scraper), and
+# to everyone when DEBUG is on.
+PERF_QUERY_BUDGET = int(os.getenv("PERF_QUERY_BUDGET", "50"))
+PERF_LATENCY_BUDGET_MS = float(os.getenv("PERF_LATENCY_BUDGET_MS", "500"))
+INTERNAL_IPS = [ip.strip() for ip in os.getenv("INTERNAL_IPS", "127.0.0.1").split(",") if ip.strip()]
+PERF_REPORT_ALLOW_ANONYMOUS = os.getenv("PERF_REPORT_ALLOW_ANONYMOUS", "False").lower() in ("true", "1")
+
+# Outgoing mail. Views queue emails; `manage.py send_queued_mail` sends them in
+# batches of EMAIL_BATCH_SIZE over one logged-in SMTP session, closed after
+# EMAIL_IDLE_TIMEOUT idle seconds. Failed sends are retried with exponential
+# backoff up to EMAIL_MAX_ATTEMPTS times. EMAIL_USE_TLS applies STARTTLS when
+# EMAIL_USE_SSL is off.
+EMAIL_HOST = os.getenv("EMAIL_HOST", "localhost")
+EMAIL_PORT = int(os.getenv("EMAIL_PORT", "465"))
+EMAIL_SENDER = os.getenv("EMAIL_SENDER", "")
+EMAIL_PASSWORD = os.getenv("EMAIL_PASSWORD", "")
+EMAIL_USE_SSL = os.getenv("EMAIL_USE_SSL", "True").lower() in ("true", "1")
+EMAIL_USE_TLS = os.getenv("EMAIL_USE_TLS", "True").lower() in ("true", "1")
+EMAIL_TIMEOUT = float(os.getenv("EMAIL_TIMEOUT", "30"))
+EMAIL_BATCH_SIZE = int(os.getenv("EMAIL_BATCH_SIZE", "50"))
+EMAIL_IDLE_TIMEOUT = float(os.getenv("EMAIL_IDLE_TIMEOUT", "30"))
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "5"))
+
+# Login throttling, as "attempts/seconds" over a sliding window: every attempt
+# counts against the client IP, failed ones against the username or email.
+# Attempts over either limit get 429 before any lookup or password hashing.
+# Identifiers matching no user are remembered for LOGIN_NEGATIVE_CACHE_SECONDS.
+LOGIN_RATE_LIMIT_IP = os.getenv("LOGIN_RATE_LIMIT_IP", "30/60")
+LOGIN_RATE_LIMIT_IDENTIFIER = os.getenv("LOGIN_RATE_LIMIT_IDENTIFIER", "5/300")
+LOGIN_NEGATIVE_CACHE_SECONDS = int(os.getenv("LOGIN_NEGATIVE_CACHE_SECONDS", "60"))
+
+# Number of reverse proxies in front of the app that append the address they
+# were connected from to X-Forwarded-For. Client IPs (for the login limits and
+# INTERNAL_IPS) are read that many entries from the right of the header, or
+# from REMOTE_ADDR when 0.
+TRUSTED_PROXY_COUNT = int(os.getenv("TRUSTED_PROXY_COUNT", "0"))
+
+# Users log in with their username or email. The auth app is labelled
+# "accounts", as django.contrib.auth already uses "auth".
+AUTH_USER_MODEL = 'accounts.UserProfile'
+AUTHENTICATION_BACKENDS = ['auth.backends.EmailUsernameBackend']
+
+# Where emailed links (BASE_URL) and the 404 page (APP_URL) send users.
+BASE_URL = os.getenv("BASE_URL", "http://localhost:8000")
+APP_URL = os.getenv("APP_URL", "http://localhost:3000")
+
+# API authentication. Access tokens are accepted on their signature, expiry and
+# the revoked-token set alone; views load the UserProfile row only when they
+# need it. Revoked token IDs are kept in process memory until the token
+# expires; set TOKEN_REVOCATION_CACHE to a shared cache alias so every worker
+# sees them (the cache must not evict entries before they expire). Without one
+# the first revocation in each process logs a warning.
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': ['auth.authentication.StatelessJWTAuthentication'],
+}
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=int(os.getenv("JWT_ACCESS_TOKEN_MINUTES", "5"))),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=int(os.getenv("JWT_REFRESH_TOKEN_DAYS", "1"))),
+}
+TOKEN_REVOCATION_CACHE = os.getenv("TOKEN_REVOCATION_CACHE", "")
+
+# How long emailed links stay valid. `manage.py cleanup_tokens` deletes expired
+# ones, along with expired JWT blacklist rows.
+VERIFICATION_TOKEN_LIFETIMES = {
+    'registration': timedelta(hours=int(os.getenv("REGISTRATION_TOKEN_HOURS", "48"))),
+    'password_reset': timedelta(minutes=int(os.getenv("PASSWORD_RESET_TOKEN_MINUTES", "60"))),
+    'email_update': timedelta(hours=int(os.getenv("EMAIL_UPDATE_TOKEN_HOURS", "24"))),
 }
 
 
@@ -113,6 +275,25 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/5.2/topics/auth/passwords/
+# PASSWORD_HASHER picks the algorithm for new hashes (argon2 and bcrypt need
+# argon2-cffi / bcrypt installed) and PASSWORD_HASH_ITERATIONS the PBKDF2
+# cost. Stored hashes made otherwise are upgraded on the user's next login.
+
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", "1000000"))
+_PASSWORD_HASHERS = {
+    'pbkdf2': 'auth.hashers.PBKDF2PasswordHasher',
+    'argon2': 'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'bcrypt': 'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'scrypt': 'django.contrib.auth.hashers.ScryptPasswordHasher',
+}
+PASSWORD_HASHER = os.getenv("PASSWORD_HASHER", "pbkdf2")
+PASSWORD_HASHERS = [_PASSWORD_HASHERS[PASSWORD_HASHER]] + [
+    hasher for name, hasher in _PASSWORD_HASHERS.items() if name != PASSWORD_HASHER
+] + ['django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher']
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
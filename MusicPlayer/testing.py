@@ -0,0 +1,43 @@
+import os
+import sys
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# Test helpers shared by the apps' test modules.
+
+def budget_table(report):
+    rows = [('endpoint', 'case', 'rows', 'queries', 'budget')] + report
+    widths = [max(len(str(row[i])) for row in rows) for i in range(5)]
+    return '\n'.join('  '.join(str(value).ljust(width) for value, width in zip(row, widths)) for row in rows)
+
+def print_budget_report(title, report):
+    """Write ``report`` as a table to stderr when QUERY_BUDGET_REPORT is set."""
+    if report and os.environ.get('QUERY_BUDGET_REPORT', '').lower() in ('true', '1'):
+        sys.stderr.write(f'\n{title}\n' + budget_table(report) + '\n')
+
+class QueryBudgetAssertions:
+    """
+    assertQueryBudget() holds a view to exactly the query_budget declared on
+    it, with the caches empty, and records the result in ``budget_report``
+    for the summary table. ``fixture_size`` is the number of rows seeded.
+    """
+    fixture_size = 0
+    budget_report = []
+
+    def assertQueryBudget(self, view, method, case, send):
+        caches['responses'].clear()
+        cache.clear()
+        budget = view.query_budget[method.upper()]
+        name = f'{method.upper()} {view.cls.__name__}'
+        with CaptureQueriesContext(connection) as queries:
+            response = send()
+            body = b''.join(response.streaming_content) if response.streaming else response.content
+        self.budget_report.append((name, case, self.fixture_size, len(queries), budget))
+        self.assertLess(response.status_code, 400, body)
+        self.assertEqual(
+            len(queries), budget,
+            f"{name} ({case}) issued {len(queries)} queries, budget {budget}:\n"
+            + '\n'.join(query['sql'] for query in queries.captured_queries),
+        )
+        return response
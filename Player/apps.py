@@ -1,6 +1,51 @@
 from django.apps import AppConfig
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+
+def create_search_index(sender, using, **kwargs):
+    from .functions.search import get_search_backend
+    get_search_backend().create()
+
+
+def create_json_indexes(sender, using, **kwargs):
+    # GIN indexes serving the jsonb @> lookups /filter/ uses on PostgreSQL.
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    from .models import JSON_CONTAINS_FIELDS, Song
+    table = connection.ops.quote_name(Song._meta.db_table)
+    with connection.cursor() as cursor:
+        for field in JSON_CONTAINS_FIELDS:
+            cursor.execute(
+                f"CREATE INDEX IF NOT EXISTS player_song_{field}_gin "
+                f"ON {table} USING gin ({connection.ops.quote_name(field)} jsonb_path_ops)"
+            )
+
+
+def bootstrap_facet_counts(sender, using, verbosity=1, **kwargs):
+    # A database upgraded from before FacetCount existed has songs but no
+    # counts, and incremental Metadata updates would then drop values older
+    # songs still use. Recount everything once before serving writes.
+    from .models import FacetCount, Song
+    if Song.objects.using(using).exists() and not FacetCount.objects.using(using).exists():
+        call_command('rebuild_metadata', verbosity=verbosity)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    from .functions.perf import record_query
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
 
 
 class PlayerConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Player'
+
+    def ready(self):
+        post_migrate.connect(create_search_index, sender=self)
+        post_migrate.connect(create_json_indexes, sender=self)
+        post_migrate.connect(bootstrap_facet_counts, sender=self)
+        connection_created.connect(install_query_recorder)
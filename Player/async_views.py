@@ -0,0 +1,153 @@
+"""
+Async counterparts of the hot read endpoints for ASGI deployments.
+
+They parse requests and build payloads, cache keys and validators with the
+helpers in views.py and only await the ORM and cache instead of holding a
+worker thread. Writes, exports and the in-memory facet index path are handed to
+the sync views.
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.views.decorators.http import condition
+from rest_framework import status
+from . import views
+from .models import CatalogueVersion, Metadata, Song
+from .renderers import FastJSONRenderer
+from .serializers import SONG_ROW_FIELDS, MetadataSerializer, serialize_song_rows
+from .functions.facet_index import songs_in_order
+from .functions.pagination import (
+    InvalidCursor, InvalidParameter, acached_count, akeyset_page, parse_filter_params, parse_search_params,
+    parse_song_list_params,
+)
+from .functions.response_cache import aget_cached, aset_cached
+from .functions.search import search_songs
+
+renderer = FastJSONRenderer()
+
+def json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(renderer.render(data), status=status, content_type='application/json')
+
+def bad_request(exc):
+    return json_response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+def not_allowed(request, allowed):
+    response = json_response({'detail': f'Method "{request.method}" not allowed.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
+    response.headers['Allow'] = ', '.join(allowed)
+    return response
+
+# condition() calls the sync views' validator functions without awaiting
+# them; each view loads the state they read onto the request first.
+
+async def song_list_create(request):
+    if request.method not in ('GET', 'HEAD'):
+        return await sync_to_async(views.song_list_create)(request)
+    request._catalogue_state = await CatalogueVersion.objects.astate()
+    return await song_list(request)
+
+@condition(etag_func=views.catalogue_etag, last_modified_func=views.catalogue_last_modified)
+async def song_list(request):
+    version, _ = request._catalogue_state
+    key = views.song_list_key(request.GET, version)
+    data = await aget_cached(key)
+    if data is None:
+        try:
+            cursor, page_size, fields = parse_song_list_params(request.GET)
+            page = await akeyset_page(Song.objects.values(*SONG_ROW_FIELDS), cursor, page_size)
+        except (InvalidCursor, InvalidParameter) as exc:
+            return bad_request(exc)
+        count = await acached_count(Song.objects.all(), 'songs', version)
+        data = views.song_list_payload(page, count, page_size, fields)
+        await aset_cached(key, data)
+    return json_response(data)
+
+async def song_detail(request, pk):
+    if request.method not in ('GET', 'HEAD'):
+        return await sync_to_async(views.song_detail)(request, pk=pk)
+    request._song_state = await Song.objects.filter(pk=pk).values_list('version', 'updated_at').afirst()
+    return await song_row(request, pk)
+
+@condition(etag_func=views.song_etag, last_modified_func=views.song_last_modified)
+async def song_row(request, pk):
+    if request._song_state is None:
+        return json_response(views.SONG_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+    key = views.song_key(pk, await CatalogueVersion.objects.acurrent())
+    data = await aget_cached(key)
+    if data is None:
+        row = await Song.objects.filter(pk=pk).values(*SONG_ROW_FIELDS).afirst()
+        if row is None:
+            return json_response(views.SONG_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+        data = serialize_song_rows([row])[0]
+        await aset_cached(key, data)
+    return json_response(data)
+
+async def song_filter(request):
+    if request.method != 'POST':
+        return not_allowed(request, ['POST'])
+    if settings.FACET_INDEX or request.content_type != 'application/json':
+        return await sync_to_async(views.song_filter)(request)
+    try:
+        body = json.loads(request.body or b'{}')
+    except ValueError as exc:
+        return bad_request(f'JSON parse error - {exc}')
+    if not isinstance(body, dict) or body.get('export'):
+        return await sync_to_async(views.song_filter)(request)
+
+    try:
+        filters, match, cursor, page_size, fields = parse_filter_params(body)
+    except InvalidParameter as exc:
+        return bad_request(exc)
+    key = views.filter_key(filters, match, cursor, page_size, fields, await CatalogueVersion.objects.acurrent())
+    data = await aget_cached(key)
+    if data is None:
+        queryset = Song.objects.filter(views.filter_query(filters, match)).values(*SONG_ROW_FIELDS)
+        try:
+            data = views.filter_payload(await akeyset_page(queryset, cursor, page_size), fields)
+        except InvalidCursor as exc:
+            return bad_request(exc)
+        await aset_cached(key, data)
+    return json_response(data)
+
+@sync_to_async
+def search_page(keyword, offset, limit, prefix):
+    ids, total = search_songs(keyword, offset=offset, limit=limit, prefix=prefix)
+    return songs_in_order(ids), total
+
+async def song_search(request):
+    if request.method not in ('GET', 'HEAD'):
+        return not_allowed(request, ['GET', 'HEAD'])
+    if request.GET.get('export', '').lower() in ('true', '1'):
+        return await sync_to_async(views.song_search)(request)
+    request._catalogue_state = await CatalogueVersion.objects.astate()
+    return await search(request)
+
+@condition(etag_func=views.catalogue_etag, last_modified_func=views.catalogue_last_modified)
+async def search(request):
+    try:
+        keyword, page, page_size, fields, prefix = parse_search_params(request.GET)
+    except InvalidParameter as exc:
+        return bad_request(exc)
+    rows, total = await search_page(keyword, (page - 1) * page_size, page_size, prefix)
+    return json_response(views.search_payload(keyword, page, page_size, fields, rows, total))
+
+async def metadata_list(request):
+    if request.method not in ('GET', 'HEAD'):
+        return not_allowed(request, ['GET', 'HEAD'])
+    request._metadata_state = await Metadata.objects.values_list('id', 'version', 'updated_at').afirst()
+    return await metadata(request)
+
+@condition(etag_func=views.metadata_etag, last_modified_func=views.metadata_last_modified)
+async def metadata(request):
+    state = request._metadata_state
+    if not state:
+        return json_response(views.NO_METADATA, status=status.HTTP_404_NOT_FOUND)
+    key = views.metadata_key(state)
+    data = await aget_cached(key)
+    if data is None:
+        meta = await Metadata.objects.afirst()
+        if not meta:
+            return json_response(views.NO_METADATA, status=status.HTTP_404_NOT_FOUND)
+        data = MetadataSerializer(meta).data
+        await aset_cached(key, data)
+    return json_response(data)
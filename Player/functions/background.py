@@ -0,0 +1,29 @@
+import logging
+import threading
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+class BackgroundReload:
+    """
+    Mixin for the in-process indexes: reload_in_background() runs load() in a
+    daemon thread, at most one at a time per index, while requests keep
+    reading the copy that load() swaps out under ``self.lock`` when done.
+    """
+    reloading = False
+
+    def reload_in_background(self):
+        with self.lock:
+            if self.reloading:
+                return
+            self.reloading = True
+        threading.Thread(target=self._reload, name=f'{type(self).__name__}-reload', daemon=True).start()
+
+    def _reload(self):
+        try:
+            self.load()
+        except Exception:
+            logger.exception("Reloading %s failed", type(self).__name__)
+        finally:
+            self.reloading = False
+            connections.close_all()
@@ -0,0 +1,118 @@
+import json
+import platform
+import random
+import statistics
+import time
+from itertools import accumulate
+import django
+from django.db import connection
+
+WORDS = (
+    'love night dream fire rain blue heart road gold echo light shadow river storm summer '
+    'winter city wild sweet broken paper silver morning midnight ocean dance home lost run'
+).split()
+GENRES = ('pop', 'rock', 'hip-hop', 'jazz', 'electronic', 'folk', 'k-pop', 'classical', 'metal', 'r&b', 'country', 'latin')
+LANGUAGES = ('english', 'spanish', 'korean', 'hindi', 'french', 'japanese', 'portuguese', 'german')
+
+def zipf_cum_weights(size, skew):
+    """Cumulative weights for random.choices() giving rank r a share of 1 / r**skew."""
+    return list(accumulate(1 / rank ** skew for rank in range(1, size + 1)))
+
+def synthetic_songs(count, artists=5000, tags=300, skew=1.1, seed=0):
+    """
+    Yield ``count`` reproducible song dicts. Artists, tags, genres and
+    languages are drawn with Zipf-like popularity (a few very common values,
+    a long tail), so facet and search selectivity resemble a real catalogue.
+    """
+    rnd = random.Random(seed)
+    artist_names = [f"{rnd.choice(WORDS)} {rnd.choice(WORDS)} {n}" for n in range(artists)]
+    tag_names = [f"{rnd.choice(WORDS)}-{n}" for n in range(tags)]
+    artist_weights = zipf_cum_weights(artists, skew)
+    tag_weights = zipf_cum_weights(tags, skew)
+    genre_weights = zipf_cum_weights(len(GENRES), skew)
+    language_weights = zipf_cum_weights(len(LANGUAGES), 2)
+    for n in range(count):
+        yield {
+            'title': f"{' '.join(rnd.sample(WORDS, rnd.randint(1, 4)))} {n}",
+            'album': f"{rnd.choice(WORDS)} {rnd.choice(WORDS)} {rnd.randint(1, max(1, count // 10))}",
+            'year': rnd.randint(1960, 2025),
+            'artists': list(dict.fromkeys(rnd.choices(artist_names, cum_weights=artist_weights, k=rnd.choice((1, 1, 1, 2, 3))))),
+            'genre': list(dict.fromkeys(rnd.choices(GENRES, cum_weights=genre_weights, k=rnd.randint(1, 2)))),
+            'language': rnd.choices(LANGUAGES, cum_weights=language_weights),
+            'tags': list(dict.fromkeys(rnd.choices(tag_names, cum_weights=tag_weights, k=rnd.randint(0, 4)))),
+            'link': f"https://example.com/songs/{n}",
+        }
+
+def misspell(text):
+    """``text`` with two adjacent letters swapped past the first few, as in "midnigth"."""
+    i = min(len(text) - 2, 4)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+def time_runs(func, runs, warmup=1, setup=None):
+    """Call ``func`` ``warmup`` + ``runs`` times and return the timed runs in seconds."""
+    samples = []
+    for run in range(warmup + runs):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if run >= warmup:
+            samples.append(elapsed)
+    return samples
+
+def summarize(samples):
+    """Latency percentiles in milliseconds for a list of durations in seconds."""
+    ordered = sorted(samples)
+    if len(ordered) > 1:
+        cuts = statistics.quantiles(ordered, n=100, method='inclusive')
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = ordered[0]
+    return {
+        'runs': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': round(p50 * 1000, 3),
+        'p95_ms': round(p95 * 1000, 3),
+        'p99_ms': round(p99 * 1000, 3),
+    }
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+def write_results(path, results):
+    with open(path, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+        file.write('\n')
+
+def load_results(path):
+    with open(path, encoding='utf-8') as file:
+        return json.load(file)
+
+def compare(results, baseline, metric='p50_ms', threshold=0.2):
+    """
+    Return (name, baseline, current, change) for every benchmark present in
+    both runs, and the names whose ``metric`` grew by more than ``threshold``.
+    """
+    rows, regressions = [], []
+    for name, current in results['benchmarks'].items():
+        previous = baseline.get('benchmarks', {}).get(name)
+        if not previous or metric not in previous or metric not in current:
+            continue
+        change = (current[metric] - previous[metric]) / previous[metric] if previous[metric] else 0.0
+        rows.append((name, previous[metric], current[metric], change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+def comparison_table(rows, metric='p50_ms'):
+    lines = [f"{'benchmark':<32} {'baseline ' + metric:>16} {'current':>10} {'change':>8}"]
+    for name, previous, current, change in rows:
+        lines.append(f"{name:<32} {previous:>16.3f} {current:>10.3f} {change:>+8.1%}")
+    return '\n'.join(lines)
@@ -0,0 +1,135 @@
+import csv
+import json
+from django.db import IntegrityError, transaction
+from ..models import (
+    FacetCount, Song, SongKey, catalogue_changed, dedup_key, facet_counts, link_song_facets, song_keys,
+)
+from ..serializers import SongSerializer
+from .search import get_search_backend
+
+def _validate(index, item):
+    serializer = SongSerializer(data=item, partial=True)
+    if not serializer.is_valid():
+        return None, {'index': index, 'status': 'invalid', 'errors': serializer.errors}
+    fields = {k: v for k, v in serializer.validated_data.items() if v is not None}
+    song = Song(**fields)
+    return song, None
+
+def import_songs(items, chunk_size=500):
+    """
+    Validate, deduplicate and insert a batch of song dicts.
+
+    Duplicates are resolved with one set query per ``chunk_size`` keys against
+    SongKey, plus a check against earlier items of the same batch. Returns one
+    result per item, in order, with status 'created', 'skipped' or 'invalid'.
+    """
+    results = [None] * len(items)
+    candidates = []
+    for index, item in enumerate(items):
+        song, error = _validate(index, item)
+        if error:
+            results[index] = error
+        else:
+            candidates.append((index, song, song_keys(song.title, song.album, song.artists)))
+
+    existing = SongKey.objects.existing({key for _, _, keys in candidates for key in keys})
+    seen = set()
+    to_create = []
+    for index, song, keys in candidates:
+        if keys & existing or keys & seen:
+            results[index] = {'index': index, 'status': 'skipped'}
+            continue
+        seen |= keys
+        to_create.append((index, song, keys))
+
+    for start in range(0, len(to_create), chunk_size):
+        chunk = to_create[start:start + chunk_size]
+        try:
+            _create(chunk)
+        except IntegrityError:
+            # A concurrent writer stored some of these songs after the check above.
+            taken = SongKey.objects.existing({key for _, _, keys in chunk for key in keys})
+            for index, _, keys in chunk:
+                if keys & taken:
+                    results[index] = {'index': index, 'status': 'skipped'}
+            chunk = [entry for entry in chunk if not entry[2] & taken]
+            if chunk:
+                _create(chunk)
+        for index, song, _ in chunk:
+            results[index] = {'index': index, 'status': 'created', 'id': str(song.id)}
+    return results
+
+def _create(chunk):
+    songs = [song for _, song, _ in chunk]
+    for song in songs:
+        song.dedup_key = dedup_key(song.title, song.album, song.artists)
+    with transaction.atomic():
+        Song.objects.bulk_create(songs)
+        SongKey.objects.bulk_create(SongKey(song=song, key=key) for _, song, keys in chunk for key in keys)
+        link_song_facets(songs)
+        get_search_backend().index(songs)
+        FacetCount.objects.apply_delta(removed={}, added=facet_counts(songs))
+        catalogue_changed(added=[song.snapshot() for song in songs])
+
+LIST_FIELDS = ('artists', 'genre', 'language', 'tags')
+
+def _decode(lines):
+    for line in lines:
+        yield line.decode('utf-8') if isinstance(line, bytes) else line
+
+def iter_ndjson(lines):
+    """Yield (line number, song dict, parse errors) for each non-blank NDJSON line."""
+    for number, line in enumerate(_decode(lines), start=1):
+        if not line.strip():
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError as exc:
+            yield number, None, [f"Invalid JSON: {exc}"]
+            continue
+        if not isinstance(item, dict):
+            yield number, None, ['Expected a song object.']
+            continue
+        yield number, item, None
+
+def iter_csv(lines, separator='|'):
+    """
+    Yield (line number, song dict, None) for each CSV row after the header.
+    List columns hold values joined by ``separator``.
+    """
+    reader = csv.DictReader(_decode(lines))
+    for row in reader:
+        item = {}
+        for field, value in row.items():
+            if field is None or value in (None, ''):
+                continue
+            field = field.strip()
+            if field in LIST_FIELDS:
+                value = [v.strip() for v in value.split(separator) if v.strip()]
+            item[field] = value
+        yield reader.line_num, item, None
+
+def ingest(records, chunk_size=500):
+    """
+    Import (line number, item, parse errors) records chunk by chunk, committing
+    each chunk, and yield one result per line. Memory is bounded by ``chunk_size``.
+    """
+    def flush(chunk):
+        items = [item for _, item, errors in chunk if not errors]
+        results = iter(import_songs(items, chunk_size=chunk_size))
+        for number, item, errors in chunk:
+            if errors:
+                yield {'line': number, 'status': 'invalid', 'errors': {'non_field_errors': errors}}
+                continue
+            result = {'line': number, **next(results)}
+            del result['index']
+            yield result
+
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            yield from flush(chunk)
+            chunk = []
+    if chunk:
+        yield from flush(chunk)
@@ -0,0 +1,261 @@
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from ..models import FACETS, CatalogueVersion, Song, song_facets
+from ..serializers import SONG_ROW_FIELDS
+from .background import BackgroundReload
+from .pagination import InvalidCursor, decode_cursor, page_cursors
+
+# Positions of the set bits of every byte value, for decoding bitmaps.
+_BYTE_BITS = [tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)]
+# A value's rows are kept as a bitmap once they take fewer bytes that way
+# than as 4-byte row numbers, i.e. when more than 1 row in 32 carries it.
+DENSE_RATIO = 32
+
+def bitmap_rows(bitmap, limit=None, last=False):
+    """
+    Return the positions of the set bits of ``bitmap`` in ascending order,
+    only the first (or with ``last``, the last) ``limit`` of them if given.
+    """
+    rows = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    offsets = range(len(data) - 1, -1, -1) if last else range(len(data))
+    for offset in offsets:
+        byte = data[offset]
+        if byte:
+            base = offset * 8
+            bits = [base + bit for bit in _BYTE_BITS[byte]]
+            rows.extend(reversed(bits) if last else bits)
+            if limit is not None and len(rows) >= limit:
+                break
+    if limit is not None:
+        rows = rows[:limit]
+    return rows[::-1] if last else rows
+
+def rows_bitmap(rows, size):
+    """Return the bitmap of the row numbers ``rows`` (all below ``size``)."""
+    data = bytearray((size + 7) // 8)
+    for row in rows:
+        data[row >> 3] |= 1 << (row & 7)
+    return int.from_bytes(data, 'little')
+
+def _union(sets, size):
+    """Union of row sets given as bitmaps or sorted row arrays."""
+    if len(sets) == 1:
+        return sets[0]
+    if all(isinstance(rows, int) for rows in sets):
+        result = 0
+        for bitmap in sets:
+            result |= bitmap
+        return result
+    if any(isinstance(rows, int) for rows in sets):
+        result = rows_bitmap((row for rows in sets if not isinstance(rows, int) for row in rows), size)
+        for bitmap in sets:
+            if isinstance(bitmap, int):
+                result |= bitmap
+        return result
+    return sorted(set().union(*sets))
+
+def _intersection(a, b):
+    """Intersection of two row sets given as bitmaps or sorted row arrays."""
+    if isinstance(a, int) and isinstance(b, int):
+        return a & b
+    if isinstance(a, int) or isinstance(b, int):
+        bitmap, rows = (a, b) if isinstance(a, int) else (b, a)
+        data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+        return [row for row in rows if row >> 3 < len(data) and data[row >> 3] >> (row & 7) & 1]
+    if len(a) > len(b):
+        a, b = b, a
+    b = set(b)
+    return [row for row in a if row in b]
+
+def _normalize(value):
+    return str(value).strip().lower()
+
+class FacetIndex(BackgroundReload):
+    """
+    In-process inverted index answering /filter/ queries.
+
+    Every song gets a dense row number. Each facet value maps to the rows
+    that carry it: a sorted array of row numbers for rare values, or a Python
+    int used as a bitmap for common ones, so memory stays proportional to
+    the number of (song, value) pairs and common values still combine with
+    single big-integer OR/AND operations. The index remembers the catalogue
+    version it reflects: writes made in this process are applied
+    incrementally, and any other version change reloads it in the
+    background while requests fall back to SQL.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.ids = []
+        self.rows = {}
+        self.live = 0
+        self.postings = {facet: {} for facet in FACETS}
+
+    def load(self):
+        version = CatalogueVersion.objects.current()
+        songs = Song.objects.order_by('created_at', 'id').values('id', *FACETS).iterator(chunk_size=5000)
+        ids, rows, postings = self.build(songs)
+        with self.lock:
+            self.version, self.ids, self.rows, self.postings = version, ids, rows, postings
+            self.live = (1 << len(ids)) - 1
+
+    @staticmethod
+    def build(songs):
+        """Return (ids, {id: row}, postings) for ``songs`` in row order."""
+        ids, rows = [], {}
+        postings = {facet: {} for facet in FACETS}
+        for song in songs:
+            row = len(ids)
+            ids.append(song['id'])
+            rows[song['id']] = row
+            for facet, values in song_facets(song).items():
+                for value in values:
+                    value_rows = postings[facet].get(value)
+                    if value_rows is None:
+                        value_rows = postings[facet][value] = array('I')
+                    value_rows.append(row)
+        for values in postings.values():
+            for value, value_rows in values.items():
+                if len(value_rows) * DENSE_RATIO > len(ids):
+                    values[value] = rows_bitmap(value_rows, len(ids))
+        return ids, rows, postings
+
+    def refresh(self, version=None):
+        """
+        Return whether the index reflects the catalogue (at ``version``, if
+        known). If another process has written since it was built, start
+        reloading it in the background and return False.
+        """
+        if version is None:
+            version = CatalogueVersion.objects.current()
+        if self.version != version:
+            self.reload_in_background()
+        return self.version == version
+
+    def apply(self, version, removed, added):
+        with self.lock:
+            if self.version is None or version != self.version + 1:
+                self.version = None
+                return
+            for song in removed:
+                row = self.rows.get(song['id'])
+                if row is None:
+                    continue
+                mask = ~(1 << row)
+                self.live &= mask
+                for facet, values in song_facets(song).items():
+                    postings = self.postings[facet]
+                    for value in values:
+                        value_rows = postings.get(value)
+                        if isinstance(value_rows, int):
+                            value_rows &= mask
+                            postings[value] = value_rows
+                        elif value_rows is not None:
+                            i = bisect_left(value_rows, row)
+                            if i < len(value_rows) and value_rows[i] == row:
+                                del value_rows[i]
+                        if not value_rows:
+                            postings.pop(value, None)
+            for song in added:
+                row = self.rows.get(song['id'])
+                if row is None:
+                    row = len(self.ids)
+                    self.ids.append(song['id'])
+                    self.rows[song['id']] = row
+                bit = 1 << row
+                self.live |= bit
+                for facet, values in song_facets(song).items():
+                    postings = self.postings[facet]
+                    for value in values:
+                        value_rows = postings.get(value)
+                        if value_rows is None:
+                            postings[value] = array('I', [row])
+                        elif isinstance(value_rows, int):
+                            postings[value] = value_rows | bit
+                        else:
+                            i = bisect_left(value_rows, row)
+                            if i == len(value_rows) or value_rows[i] != row:
+                                value_rows.insert(i, row)
+            self.version = version
+
+    def match(self, filters, match_all=False, after=None, before=None, limit=None):
+        """
+        Return the ids of songs matching ``filters`` ({facet: [values]}) in
+        (created_at, id) order, optionally only those after or before the
+        song with id ``after``/``before`` and at most ``limit`` of them
+        (the last ``limit`` when paging backwards).
+
+        Values of one facet are always OR-ed; facets are OR-ed too unless
+        ``match_all``, in which case a song must match every given facet.
+        """
+        with self.lock:
+            size = len(self.ids)
+            result = None
+            for facet in FACETS:
+                if not filters.get(facet):
+                    continue
+                found = [self.postings[facet].get(_normalize(value)) for value in filters[facet]]
+                rows = _union([value_rows for value_rows in found if value_rows is not None] or [[]], size)
+                if result is None:
+                    result = rows
+                else:
+                    result = _intersection(result, rows) if match_all else _union([result, rows], size)
+            if result is None:
+                result = self.live
+            bounds = []
+            for pk in (after, before):
+                row = None
+                if pk is not None:
+                    row = self.rows.get(pk)
+                    if row is None:
+                        raise KeyError(pk)
+                bounds.append(row)
+            after_row, before_row = bounds
+            last = before is not None
+            if isinstance(result, int):
+                if after_row is not None:
+                    result &= ~((2 << after_row) - 1)
+                if before_row is not None:
+                    result &= (1 << before_row) - 1
+                rows = bitmap_rows(result & self.live, limit=limit, last=last)
+            else:
+                start = 0 if after_row is None else bisect_right(result, after_row)
+                end = len(result) if before_row is None else bisect_left(result, before_row)
+                if limit is not None:
+                    start, end = (max(start, end - limit), end) if last else (start, min(end, start + limit))
+                rows = result[start:end]
+            return [self.ids[row] for row in rows]
+
+def songs_in_order(ids, chunk_size=500):
+    """Fetch the Song values() rows for ``ids``, preserving their order."""
+    songs = []
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        found = {row['id']: row for row in Song.objects.filter(pk__in=chunk).values(*SONG_ROW_FIELDS)}
+        songs.extend(found[pk] for pk in chunk if pk in found)
+    return songs
+
+def index_page(filters, match_all, cursor, page_size):
+    """Like pagination.keyset_page, answered from the facet index."""
+    after = before = None
+    forward = True
+    if cursor:
+        _, pk, direction = decode_cursor(cursor)
+        forward = direction == 'next'
+        if forward:
+            after = pk
+        else:
+            before = pk
+    try:
+        ids = facet_index.match(filters, match_all=match_all, after=after, before=before, limit=page_size + 1)
+    except KeyError:
+        raise InvalidCursor(f"Cursor no longer valid: {cursor}")
+    has_more = len(ids) > page_size
+    ids = ids[:page_size] if forward else ids[-page_size:]
+    songs = songs_in_order(ids)
+    return (songs, *page_cursors(songs, cursor, forward, has_more))
+
+facet_index = FacetIndex()
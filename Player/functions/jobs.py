@@ -0,0 +1,55 @@
+import logging
+from datetime import timedelta
+from django.db import IntegrityError
+from django.utils import timezone
+from ..models import FACETS, REFRESH_METADATA, Job, Metadata
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 5
+
+def refresh_metadata_job():
+    # Saving the row moves Metadata.version, which keys the cached /metadata/
+    # response and its ETag; no song changed, so the catalogue version stays.
+    Metadata.objects.sync(FACETS)
+
+HANDLERS = {
+    REFRESH_METADATA: refresh_metadata_job,
+}
+
+def run_job(job):
+    """Run a claimed job, then mark it done, or pending again with backoff after a failure."""
+    try:
+        HANDLERS[job.kind]()
+    except Exception as exc:
+        logger.exception("Job %s failed", job.pk)
+        job.error = f"{type(exc).__name__}: {exc}"
+        job.status = Job.FAILED
+        if job.attempts < MAX_ATTEMPTS:
+            job.status = Job.PENDING
+            job.run_after = timezone.now() + timedelta(seconds=2 ** job.attempts)
+        try:
+            job.save(update_fields=['status', 'run_after', 'error', 'updated_at'])
+        except IntegrityError:
+            # A newer pending job of this kind already covers the retry.
+            job.status = Job.FAILED
+            job.save(update_fields=['status', 'error', 'updated_at'])
+        return False
+    job.status = Job.DONE
+    job.error = ''
+    job.save(update_fields=['status', 'error', 'updated_at'])
+    return True
+
+def run_pending(limit=None):
+    """Claim and run due jobs until none are left (or ``limit`` ran); return how many ran."""
+    ran = 0
+    while limit is None or ran < limit:
+        job = Job.objects.claim()
+        if job is None:
+            break
+        run_job(job)
+        ran += 1
+    return ran
+
+def prune(older_than=timedelta(days=1)):
+    return Job.objects.filter(status=Job.DONE, updated_at__lt=timezone.now() - older_than).delete()[0]
@@ -0,0 +1,188 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from ..serializers import SongSerializer, serialize_song_rows
+
+class InvalidCursor(ValueError):
+    pass
+
+class InvalidParameter(ValueError):
+    pass
+
+def parse_page_size(value, default=10, maximum=None, name='page_size'):
+    """Parse a page_size/limit parameter, capped at ``maximum`` (default settings.MAX_PAGE_SIZE)."""
+    if value in (None, ''):
+        return default
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        raise InvalidParameter(f'{name} must be an integer.')
+    if page_size < 1:
+        raise InvalidParameter(f'{name} must be positive.')
+    return min(page_size, maximum or settings.MAX_PAGE_SIZE)
+
+def parse_page(value):
+    """Parse a 1-based page number parameter."""
+    if value in (None, ''):
+        return 1
+    try:
+        page = int(value)
+    except (TypeError, ValueError):
+        raise InvalidParameter('page must be an integer.')
+    if page < 1:
+        raise InvalidParameter('page must be positive.')
+    return page
+
+def parse_song_list_params(params):
+    """
+    Return (cursor, page_size, fields) for a /songs/ query. ``page`` is
+    refused rather than ignored: the list is paged by cursor now, and a
+    client still sending page numbers would get page 1 every time.
+    """
+    if 'page' in params:
+        raise InvalidParameter('page is not supported; follow the next/previous links or pass their cursor.')
+    return (
+        params.get('cursor'),
+        parse_page_size(params.get('page_size')),
+        parse_fields(params.get('fields')),
+    )
+
+def parse_filter_params(data):
+    """Return (filters, match, cursor, page_size, fields) for a /filter/ request body."""
+    match = data.get('match', 'any')
+    if match not in ('any', 'all'):
+        raise InvalidParameter('match must be "any" or "all".')
+    return (
+        data.get('filter', {}),
+        match,
+        data.get('cursor'),
+        parse_page_size(data.get('page_size')),
+        parse_fields(data.get('fields')),
+    )
+
+def parse_search_params(params):
+    """Return (keyword, page, page_size, fields, prefix) for a /search/ query."""
+    keyword = params.get('q', '')
+    if not keyword:
+        raise InvalidParameter('Query param "q" required.')
+    page_size = parse_page_size(params.get('page_size'))
+    return (
+        keyword,
+        parse_page(params.get('page')),
+        page_size,
+        parse_fields(params.get('fields')),
+        params.get('prefix', 'true').lower() in ('true', '1'),
+    )
+
+def parse_fields(value):
+    """Parse a field projection given as "a,b" or ["a", "b"]; None means all fields."""
+    if not value:
+        return None
+    fields = value.split(',') if isinstance(value, str) else value
+    unknown = set(fields) - set(SongSerializer.Meta.fields)
+    if unknown:
+        raise InvalidParameter(f"Unknown fields: {', '.join(sorted(map(str, unknown)))}")
+    return fields
+
+def stream_json_array(batches, fields=None):
+    """Serialize batches of song values() rows as one JSON array, a batch at a time."""
+    yield '['
+    first = True
+    for batch in batches:
+        for item in serialize_song_rows(batch, fields=fields):
+            yield ('' if first else ',') + json.dumps(item)
+            first = False
+    yield ']'
+
+def batched(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def encode_cursor(song, direction):
+    payload = json.dumps([song['created_at'].isoformat(), str(song['id']), direction])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk, direction = json.loads(base64.urlsafe_b64decode(padded))
+        if direction not in ('next', 'previous'):
+            raise ValueError(direction)
+        return datetime.fromisoformat(created_at), uuid.UUID(pk), direction
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from exc
+
+def keyset_slice(queryset, cursor, page_size):
+    """
+    Narrow ``queryset`` (a values() queryset including created_at and id) to
+    the page after or before ``cursor`` in (created_at, id) order, plus one
+    row to detect more results. Returns (queryset, forward).
+    """
+    forward = True
+    if cursor:
+        created_at, pk, direction = decode_cursor(cursor)
+        forward = direction == 'next'
+        if forward:
+            queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        else:
+            queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    ordering = ('created_at', 'id') if forward else ('-created_at', '-id')
+    return queryset.order_by(*ordering)[:page_size + 1], forward
+
+def keyset_result(songs, cursor, forward, page_size):
+    has_more = len(songs) > page_size
+    songs = songs[:page_size]
+    if not forward:
+        songs.reverse()
+    return (songs, *page_cursors(songs, cursor, forward, has_more))
+
+def keyset_page(queryset, cursor, page_size):
+    """
+    Return (songs, next cursor, previous cursor) for one page of ``queryset``
+    in (created_at, id) order. Each page is a range scan of that index
+    starting after the cursor position, so its cost does not grow with depth.
+    """
+    page, forward = keyset_slice(queryset, cursor, page_size)
+    return keyset_result(list(page), cursor, forward, page_size)
+
+async def akeyset_page(queryset, cursor, page_size):
+    """keyset_page() for async views."""
+    page, forward = keyset_slice(queryset, cursor, page_size)
+    return keyset_result([song async for song in page], cursor, forward, page_size)
+
+def page_cursors(songs, cursor, forward, has_more):
+    """Next and previous cursors for a page fetched with one extra row to detect ``has_more``."""
+    if not songs:
+        return None, None
+    has_next = has_more if forward else True
+    has_previous = bool(cursor) if forward else has_more
+    return (
+        encode_cursor(songs[-1], 'next') if has_next else None,
+        encode_cursor(songs[0], 'previous') if has_previous else None,
+    )
+
+def cached_count(queryset, key, version):
+    """
+    Count ``queryset`` once per catalogue ``version``, so repeated list
+    requests between writes do not rescan the table.
+    """
+    cache_key = f"player:count:{key}:{version}"
+    return cache.get_or_set(cache_key, queryset.count, timeout=None)
+
+async def acached_count(queryset, key, version):
+    cache_key = f"player:count:{key}:{version}"
+    count = await cache.aget(cache_key)
+    if count is None:
+        count = await queryset.acount()
+        await cache.aset(cache_key, count, timeout=None)
+    return count
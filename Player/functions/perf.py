@@ -0,0 +1,70 @@
+import contextvars
+import time
+from contextlib import contextmanager
+from MusicPlayer import metrics
+from . import response_cache
+
+# Per-request counters, set by PerfMiddleware. Context variables follow the
+# request into sync_to_async threads, so async views are counted too.
+_current = contextvars.ContextVar('player_perf_request', default=None)
+
+BUCKETS = {
+    'request_seconds': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'db_queries': (0, 1, 2, 3, 5, 10, 20, 50, 100, 500, 1000),
+    'db_seconds': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+    'serialize_seconds': (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+    'response_bytes': (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+}
+
+HELP = {
+    'request_seconds': "Time spent handling the request.",
+    'db_queries': "SQL queries issued while handling the request.",
+    'db_seconds': "Time spent executing SQL.",
+    'serialize_seconds': "Time spent serializing and rendering response data.",
+    'response_bytes': "Size of the response body (streamed responses excluded).",
+}
+
+for _metric, _buckets in BUCKETS.items():
+    metrics.histogram(f'player_{_metric}', _buckets, HELP[_metric])
+
+@metrics.collector
+def response_cache_counters():
+    return {f'player_response_cache_{counter}_total': ('counter', value)
+            for counter, value in response_cache.stats().items()}
+
+def start_request():
+    """Begin counting for the current request; pass the token to finish_request()."""
+    return _current.set({'queries': 0, 'db_seconds': 0.0, 'serialize_seconds': 0.0})
+
+def finish_request(token):
+    stats = _current.get()
+    _current.reset(token)
+    return stats
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper adding each query's time to the current request."""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats['queries'] += 1
+        stats['db_seconds'] += time.perf_counter() - start
+
+@contextmanager
+def timed(counter):
+    """Add the time spent in the block to ``counter`` of the current request."""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats[counter] += time.perf_counter() - start
+
+def observe(metric, value, view, method):
+    metrics.observe(f'player_{metric}', value, view, method)
@@ -0,0 +1,60 @@
+import hashlib
+import json
+import threading
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from ..models import FACETS, CatalogueVersion
+
+_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+def _record(counter, n=1):
+    with _lock:
+        _stats[counter] += n
+
+def stats():
+    """Hit/miss/eviction counts of this process's response cache."""
+    with _lock:
+        return dict(_stats)
+
+class CountingLocMemCache(LocMemCache):
+    """LocMemCache (LRU with TTL and MAX_ENTRIES) that counts evicted entries."""
+
+    def _cull(self):
+        size = len(self._cache)
+        super()._cull()
+        _record('evictions', size - len(self._cache))
+
+def cache_key(endpoint, params, version=None):
+    """
+    Key for ``endpoint`` called with ``params`` at the current catalogue
+    version, so any song write makes every older entry unreachable, or at
+    the given ``version`` of whatever else the response depends on.
+    """
+    if version is None:
+        version = CatalogueVersion.objects.current()
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{endpoint}:{version}:{digest}"
+
+def get_cached(key):
+    data = caches['responses'].get(key)
+    _record('misses' if data is None else 'hits')
+    return data
+
+def set_cached(key, data):
+    caches['responses'].set(key, data)
+
+async def aget_cached(key):
+    data = await caches['responses'].aget(key)
+    _record('misses' if data is None else 'hits')
+    return data
+
+async def aset_cached(key, data):
+    await caches['responses'].aset(key, data)
+
+def normalize_filter(filters):
+    """Order-, case- and duplicate-insensitive form of a /filter/ ``filter`` object."""
+    return {
+        facet: sorted({str(v).strip().lower() for v in filters[facet]})
+        for facet in FACETS if filters.get(facet)
+    }
@@ -0,0 +1,176 @@
+import re
+import sqlite3
+import unicodedata
+import uuid
+from itertools import islice
+from django.db import connection
+from django.db.models import Q, Sum
+from ..models import SearchToken, Song
+
+FTS_TABLE = 'player_song_fts'
+# Relevance weight of a match in each indexed field.
+WEIGHTS = {'title': 3, 'artists': 2, 'album': 1}
+_TOKEN = re.compile(r'\w+')
+
+def fold(text):
+    """Lowercase and strip diacritics, matching FTS5's unicode61 tokenizer."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+def tokenize(text):
+    return _TOKEN.findall(fold(text or ''))
+
+def _song_fields(song):
+    return {
+        'title': song.title or '',
+        'album': song.album or '',
+        'artists': ' '.join(a for a in song.artists or [] if isinstance(a, str)),
+    }
+
+def _rowid(pk):
+    # FTS5 rows are keyed by a 63-bit integer derived from the song UUID.
+    return pk.int & (2 ** 63 - 1)
+
+class FTS5Backend:
+    """Search through an SQLite FTS5 virtual table ranked with bm25."""
+
+    def create(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                "song_id UNINDEXED, title, album, artists, tokenize='unicode61 remove_diacritics 2')"
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+
+    def remove(self, pks):
+        with connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(_rowid(pk),) for pk in pks])
+
+    def index(self, songs):
+        self.remove([song.pk for song in songs])
+        rows = []
+        for song in songs:
+            fields = _song_fields(song)
+            rows.append((_rowid(song.pk), song.pk.hex, fields['title'], fields['album'], fields['artists']))
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, song_id, title, album, artists) VALUES (%s, %s, %s, %s, %s)", rows
+            )
+
+    def _ranked_sql(self, terms, prefix):
+        query = ' '.join(f'"{term}"' for term in terms)
+        if prefix:
+            query += '*'
+        weights = ', '.join(str(WEIGHTS[field]) for field in ('title', 'album', 'artists'))
+        sql = (
+            f"SELECT song_id FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s "
+            f"ORDER BY bm25({FTS_TABLE}, 0, {weights}), rowid"
+        )
+        return query, sql
+
+    def search(self, terms, prefix, offset, limit, count=True):
+        query, sql = self._ranked_sql(terms, prefix)
+        with connection.cursor() as cursor:
+            total = None
+            if count:
+                cursor.execute(f"SELECT count(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [query])
+                total = cursor.fetchone()[0]
+            cursor.execute(f"{sql} LIMIT %s OFFSET %s", [query, limit, offset])
+            ids = [uuid.UUID(row[0]) for row in cursor.fetchall()]
+        return ids, total
+
+    def iter_ids(self, terms, prefix, chunk_size):
+        query, sql = self._ranked_sql(terms, prefix)
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [query])
+            while rows := cursor.fetchmany(chunk_size):
+                yield [uuid.UUID(row[0]) for row in rows]
+
+class TokenBackend:
+    """Search through the portable SearchToken table, one indexed row per song token."""
+
+    def create(self):
+        pass
+
+    def clear(self):
+        SearchToken.objects.all().delete()
+
+    def remove(self, pks):
+        SearchToken.objects.filter(song__in=pks).delete()
+
+    def index(self, songs):
+        self.remove([song.pk for song in songs])
+        tokens = []
+        for song in songs:
+            for field, text in _song_fields(song).items():
+                for token in set(tokenize(text)):
+                    tokens.append(SearchToken(song=song, token=token[:64], weight=WEIGHTS[field]))
+        SearchToken.objects.bulk_create(tokens)
+
+    def _matches(self, terms, prefix):
+        """Return (matching songs, the same ranked by relevance)."""
+        lookups = []
+        for i, term in enumerate(terms):
+            if prefix and i == len(terms) - 1:
+                lookups.append({'token__gte': term, 'token__lt': term + '\uffff'})
+            else:
+                lookups.append({'token': term})
+        songs = Song.objects.all()
+        any_match = Q()
+        for lookup in lookups:
+            songs = songs.filter(pk__in=SearchToken.objects.filter(**lookup).values('song_id'))
+            any_match |= Q(**{f'search_tokens__{key}': value for key, value in lookup.items()})
+        ranked = songs.annotate(score=Sum('search_tokens__weight', filter=any_match)).order_by('-score', 'title', 'id')
+        return songs, ranked
+
+    def search(self, terms, prefix, offset, limit, count=True):
+        songs, ranked = self._matches(terms, prefix)
+        total = songs.count() if count else None
+        return list(ranked.values_list('id', flat=True)[offset:offset + limit]), total
+
+    def iter_ids(self, terms, prefix, chunk_size):
+        _, ranked = self._matches(terms, prefix)
+        ids = ranked.values_list('id', flat=True).iterator(chunk_size=chunk_size)
+        while chunk := list(islice(ids, chunk_size)):
+            yield chunk
+
+_fts5_supported = None
+
+def fts5_supported():
+    global _fts5_supported
+    if _fts5_supported is None:
+        try:
+            sqlite3.connect(':memory:').execute('CREATE VIRTUAL TABLE probe USING fts5(x)')
+            _fts5_supported = True
+        except sqlite3.OperationalError:
+            _fts5_supported = False
+    return _fts5_supported
+
+def get_search_backend():
+    if connection.vendor == 'sqlite' and fts5_supported():
+        return FTS5Backend()
+    return TokenBackend()
+
+def search_songs(query, offset=0, limit=10, prefix=True, count=True):
+    """
+    Return (song ids in relevance order, total matches) for songs whose title,
+    album or artists contain every term of ``query``; with ``prefix`` the last
+    term also matches longer words, for type-ahead. Without ``count`` the
+    total is None.
+    """
+    terms = tokenize(query)
+    if not terms:
+        return [], 0
+    return get_search_backend().search(terms, prefix, offset, limit, count=count)
+
+def search_id_batches(query, prefix=True, chunk_size=500):
+    """
+    Yield the ids search_songs() would return for every match, in relevance
+    order, ``chunk_size`` at a time from a single query, for exports.
+    """
+    terms = tokenize(query)
+    if terms:
+        yield from get_search_backend().iter_ids(terms, prefix, chunk_size)
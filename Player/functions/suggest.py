@@ -0,0 +1,166 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from django.conf import settings
+from ..models import CatalogueVersion, FacetCount, Song
+from .background import BackgroundReload
+from .search import fold
+
+# FacetCount facets offered as completions, and the kind they are reported as.
+FACET_KINDS = {'album': 'album', 'artists': 'artist', 'tags': 'tag'}
+# Prefixes up to this length get their top completions precomputed, since
+# their ranges in the sorted entry list are too wide to rank per request.
+SHORT_PREFIX = 2
+TOP_K = 20
+# Fuzzy lookups read at most this many of the most popular entries from
+# each trigram's postings and verify the best few of those with an edit
+# distance, so their cost does not grow with the catalogue.
+FUZZY_POSTINGS = 256
+FUZZY_CANDIDATES = 32
+
+def _trigrams(text):
+    padded = f"  {text}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def prefix_distance(query, text, limit):
+    """
+    Edit distance between ``query`` and the closest prefix of ``text``, or
+    ``limit + 1`` as soon as it is known to exceed ``limit``.
+    """
+    text = text[:len(query) + limit]
+    previous = list(range(len(text) + 1))
+    for i, qc in enumerate(query, start=1):
+        current = [i]
+        for j, tc in enumerate(text, start=1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (qc != tc)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return min(previous)
+
+def max_typos(query):
+    return 0 if len(query) < 5 else 1 if len(query) < 8 else 2
+
+class SuggestIndex(BackgroundReload):
+    """
+    Completion index over song titles and album/artist/tag values.
+
+    Entries are kept as one sorted list of folded strings, so a prefix is a
+    bisected range; the best completions of every short prefix are
+    precomputed. Typo tolerance uses trigram postings (compact arrays of entry
+    numbers, most popular first, per first character) to find candidates,
+    which are verified with a bounded prefix edit distance.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.version = None
+        self.loaded_at = 0
+        self.keys = []
+        self.entries = []
+        self.weights = array('I')
+        self.short = {}
+        self.trigrams = {}
+
+    def load(self):
+        version = CatalogueVersion.objects.current()
+        weights = Counter()
+        for title in Song.objects.exclude(title=None).values_list('title', flat=True).iterator(chunk_size=5000):
+            weights[(title, 'title')] += 1
+        for facet, value, count in FacetCount.objects.filter(facet__in=FACET_KINDS).values_list('facet', 'value', 'count'):
+            weights[(value, FACET_KINDS[facet])] += count
+
+        rows = sorted((fold(text), text, kind, weight) for (text, kind), weight in weights.items())
+        keys = [key for key, _, _, _ in rows]
+        entries = [(text, kind) for _, text, kind, _ in rows]
+        entry_weights = array('I', (weight for _, _, _, weight in rows))
+
+        short, postings = {}, {}
+        for n, key in enumerate(keys):
+            for length in range(1, min(SHORT_PREFIX, len(key)) + 1):
+                heap = short.setdefault(key[:length], [])
+                item = (entry_weights[n], -n)
+                if len(heap) < TOP_K:
+                    heapq.heappush(heap, item)
+                elif item > heap[0]:
+                    heapq.heapreplace(heap, item)
+        short = {prefix: [-n for _, n in sorted(heap, reverse=True)] for prefix, heap in short.items()}
+        for n in sorted(range(len(keys)), key=lambda n: -entry_weights[n]):
+            key = keys[n]
+            for gram in _trigrams(key) if key else ():
+                postings.setdefault(key[0] + gram, array('I')).append(n)
+
+        with self.lock:
+            self.version, self.loaded_at = version, time.monotonic()
+            self.keys, self.entries, self.weights = keys, entries, entry_weights
+            self.short, self.trigrams = short, postings
+
+    def refresh(self):
+        """
+        Build the index on first use. After catalogue writes, rebuild it in
+        the background at most once per SUGGEST_REFRESH_SECONDS while
+        requests keep using the current one.
+        """
+        if self.version is None:
+            # Concurrent first requests wait for one build.
+            with self.load_lock:
+                if self.version is None:
+                    self.load()
+            return
+        if time.monotonic() - self.loaded_at < settings.SUGGEST_REFRESH_SECONDS:
+            return
+        if self.version != CatalogueVersion.objects.current():
+            self.reload_in_background()
+        self.loaded_at = time.monotonic()
+
+    def _prefix_matches(self, query, kinds, limit):
+        if len(query) <= SHORT_PREFIX:
+            candidates = self.short.get(query, [])
+        else:
+            start = bisect_left(self.keys, query)
+            end = bisect_left(self.keys, query + '\uffff')
+            candidates = heapq.nlargest(limit * 4 if kinds else limit, range(start, end), key=self.weights.__getitem__)
+        return [n for n in candidates if not kinds or self.entries[n][1] in kinds]
+
+    def _fuzzy_matches(self, query, typos, exclude):
+        # Like most autocompleters, assume the first character is typed
+        # correctly: postings are kept per first character.
+        grams = _trigrams(query) - {f"  {query[0]}"}
+        hits = Counter()
+        for gram in grams:
+            hits.update(self.trigrams.get(query[0] + gram, ())[:FUZZY_POSTINGS])
+        # An entry within ``typos`` edits shares all but 3 * typos of the
+        # query's trigrams; verify those sharing the most, popular first.
+        shared = len(grams) - 3 * typos
+        candidates = heapq.nlargest(
+            FUZZY_CANDIDATES,
+            (n for n, count in hits.items() if count >= shared and n not in exclude),
+            key=lambda n: (hits[n], self.weights[n]),
+        )
+        matches = []
+        for n in candidates:
+            distance = prefix_distance(query, self.keys[n], typos)
+            if distance <= typos:
+                matches.append((distance, -self.weights[n], n))
+        return [n for _, _, n in sorted(matches)]
+
+    def suggest(self, query, limit=10, kinds=None):
+        query = fold(query).strip()
+        if not query:
+            return []
+        with self.lock:
+            found = self._prefix_matches(query, kinds, limit)[:limit]
+            typos = max_typos(query)
+            if len(found) < limit and typos:
+                fuzzy = self._fuzzy_matches(query, typos, set(found))
+                found += [n for n in fuzzy if not kinds or self.entries[n][1] in kinds][:limit - len(found)]
+            return [
+                {'text': self.entries[n][0], 'kind': self.entries[n][1], 'count': self.weights[n]}
+                for n in found
+            ]
+
+suggest_index = SuggestIndex()
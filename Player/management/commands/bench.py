@@ -0,0 +1,137 @@
+import json
+from itertools import cycle
+from io import StringIO
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.urls import reverse
+from Player.functions.benchmark import (
+    WORDS, compare, comparison_table, environment, load_results, misspell, summarize, synthetic_songs, time_runs,
+    write_results,
+)
+from Player.functions.bulk_import import import_songs, ingest
+from Player.functions.suggest import suggest_index
+from Player.models import FacetCount, Song
+from Player.renderers import FastJSONRenderer
+from Player.serializers import SONG_ROW_FIELDS, serialize_song_rows
+
+BENCHMARKS = (
+    'rebuild_metadata', 'songs_page', 'filter_any', 'filter_all', 'search', 'search_prefix', 'suggest_typo',
+    'bulk_import_dedup', 'serialize_page',
+)
+
+class Command(BaseCommand):
+    help = (
+        "Time rebuild_metadata, /songs/, /filter/, /search/, /suggest/, bulk import deduplication and serialization, "
+        "write the percentiles as JSON and flag regressions against a baseline. Nothing is committed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=0,
+                            help="Generate this many synthetic songs first (rolled back afterwards); 0 uses the current catalogue.")
+        parser.add_argument('--runs', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--only', choices=BENCHMARKS, action='append')
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--baseline', help="Results file to compare against.")
+        parser.add_argument('--metric', default='p50_ms', choices=['mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+        parser.add_argument('--threshold', type=float, default=0.2, help="Allowed slowdown before a benchmark counts as a regression.")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['songs']:
+                records = ((n, song, None) for n, song in enumerate(synthetic_songs(options['songs'], seed=options['seed']), start=1))
+                for _ in ingest(records, chunk_size=2000):
+                    pass
+            songs = Song.objects.count()
+            if not songs:
+                raise CommandError("The catalogue is empty; pass --songs or run generate_catalogue first.")
+            self.client = Client()
+            self.runs = options['runs']
+            self.seed = options['seed']
+            benchmarks = {}
+            for name in options['only'] or BENCHMARKS:
+                benchmarks[name] = summarize(getattr(self, f'bench_{name}')())
+            transaction.set_rollback(True)
+
+        results = {'environment': environment(), 'songs': songs, 'benchmarks': benchmarks}
+        if options['output']:
+            write_results(options['output'], results)
+        self.stdout.write(json.dumps(results, indent=2))
+        if options['baseline']:
+            rows, regressions = compare(results, load_results(options['baseline']), options['metric'], options['threshold'])
+            self.stderr.write(comparison_table(rows, options['metric']))
+            if regressions:
+                raise CommandError(f"Slower than the baseline by more than {options['threshold']:.0%}: {', '.join(regressions)}")
+
+    def _request(self, method, path, data=None):
+        def send():
+            if method == 'get':
+                response = self.client.get(path, data)
+            else:
+                response = self.client.post(path, data, content_type='application/json')
+            if response.status_code != 200:
+                raise CommandError(f"{method.upper()} {path} returned {response.status_code}")
+        # Time the uncached path: every run starts from an empty response cache.
+        return time_runs(send, self.runs, setup=caches['responses'].clear)
+
+    def _values(self, facet):
+        return list(FacetCount.objects.filter(facet=facet).order_by('-count', 'value').values_list('value', flat=True))
+
+    def bench_rebuild_metadata(self):
+        return time_runs(lambda: call_command('rebuild_metadata', stdout=StringIO()), max(1, self.runs // 4))
+
+    def bench_songs_page(self):
+        return self._request('get', reverse('song-list-create'), {'page_size': 100})
+
+    def bench_filter_any(self):
+        artists, tags = self._values('artists'), self._values('tags')
+        filters = {'artists': artists[:1] + artists[len(artists) // 2:][:1], 'tags': tags[-1:]}
+        return self._request('post', reverse('song-filter'), {'filter': filters, 'page_size': 100})
+
+    def bench_filter_all(self):
+        filters = {'genre': self._values('genre')[:1], 'language': self._values('language')[:1]}
+        return self._request('post', reverse('song-filter'), {'filter': filters, 'match': 'all', 'page_size': 100})
+
+    def bench_search(self):
+        return self._request('get', reverse('song-search'), {'q': f"{WORDS[0]} {WORDS[1]}", 'page_size': 20})
+
+    def bench_search_prefix(self):
+        return self._request('get', reverse('song-search'), {'q': WORDS[2][:3], 'page_size': 20})
+
+    def bench_suggest_typo(self):
+        # Misspelled common title words and popular artists, so every query
+        # takes the fuzzy path.
+        suggest_index.load()
+        queries = cycle(
+            [misspell(word) for word in WORDS if len(word) >= 5]
+            + [misspell(artist[:9]) for artist in self._values('artists')[:10]]
+        )
+
+        def send():
+            response = self.client.get(reverse('song-suggest'), {'q': next(queries)})
+            if response.status_code != 200:
+                raise CommandError(f"GET /suggest/ returned {response.status_code}")
+        return time_runs(send, self.runs)
+
+    def bench_bulk_import_dedup(self):
+        # Half of each batch duplicates stored songs, half is new.
+        existing = list(Song.objects.order_by('created_at', 'id').values('title', 'album', 'artists')[:250])
+        fresh = [
+            {**song, 'title': f"bench {song['title']}"}
+            for song in synthetic_songs(250, seed=self.seed + 1)
+        ]
+        batch = existing + fresh
+
+        def run():
+            with transaction.atomic():
+                import_songs(batch)
+                transaction.set_rollback(True)
+        return time_runs(run, self.runs)
+
+    def bench_serialize_page(self):
+        rows = list(Song.objects.order_by('created_at', 'id').values(*SONG_ROW_FIELDS)[:1000])
+        renderer = FastJSONRenderer()
+        return time_runs(lambda: renderer.render(serialize_song_rows(rows)), self.runs)
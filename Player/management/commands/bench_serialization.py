@@ -0,0 +1,60 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from Player.functions.benchmark import synthetic_songs
+from Player.models import Song
+from Player.renderers import FastJSONRenderer
+from Player.serializers import SONG_ROW_FIELDS, SongSerializer, serialize_song_rows
+
+class Command(BaseCommand):
+    help = "Check serialize_song_rows() matches SongSerializer and time both on synthetic songs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self._create_songs(options['songs'], options['seed'])
+            results = self._run(options['repeat'])
+            transaction.set_rollback(True)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _create_songs(self, count, seed):
+        Song.objects.bulk_create(Song(**song) for song in synthetic_songs(count, seed=seed))
+
+    def _time(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return result, best
+
+    def _run(self, repeat):
+        ordered = Song.objects.order_by('created_at', 'id')
+        drf, drf_time = self._time(lambda: SongSerializer(ordered.all(), many=True).data, repeat)
+        fast, fast_time = self._time(lambda: serialize_song_rows(ordered.values(*SONG_ROW_FIELDS)), repeat)
+        if json.loads(json.dumps(drf)) != fast:
+            raise CommandError("serialize_song_rows() output differs from SongSerializer")
+        instances, rows = list(ordered.all()), list(ordered.values(*SONG_ROW_FIELDS))
+        _, drf_only = self._time(lambda: SongSerializer(instances, many=True).data, repeat)
+        _, fast_only = self._time(lambda: serialize_song_rows(rows), repeat)
+        _, drf_render = self._time(lambda: JSONRenderer().render(drf), repeat)
+        _, fast_render = self._time(lambda: FastJSONRenderer().render(fast), repeat)
+        return {
+            'songs': len(fast),
+            'serializer_seconds': round(drf_time, 4),
+            'fast_serializer_seconds': round(fast_time, 4),
+            'serializer_speedup': round(drf_time / fast_time, 1),
+            'serialize_only_seconds': round(drf_only, 4),
+            'fast_serialize_only_seconds': round(fast_only, 4),
+            'serialize_only_speedup': round(drf_only / fast_only, 1),
+            'render_seconds': round(drf_render, 4),
+            'fast_render_seconds': round(fast_render, 4),
+            'identical_output': True,
+        }
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from Player.functions.benchmark import synthetic_songs
+from Player.functions.bulk_import import ingest
+
+class Command(BaseCommand):
+    help = "Import a reproducible synthetic catalogue with Zipf-distributed artists, tags and genres."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--songs', type=int, default=10000)
+        parser.add_argument('--artists', type=int, default=5000)
+        parser.add_argument('--tags', type=int, default=300)
+        parser.add_argument('--skew', type=float, default=1.1, help="Zipf exponent of value popularity.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        songs = synthetic_songs(
+            options['songs'], artists=options['artists'], tags=options['tags'],
+            skew=options['skew'], seed=options['seed'],
+        )
+        records = ((number, song, None) for number, song in enumerate(songs, start=1))
+        totals = {'created': 0, 'skipped': 0, 'invalid': 0}
+        for result in ingest(records, chunk_size=options['chunk_size']):
+            totals[result['status']] += 1
+            if result['line'] % 100000 == 0:
+                self.stderr.write(f"{result['line']} songs processed")
+        self.stdout.write(self.style.SUCCESS(
+            f"{totals['created']} created, {totals['skipped']} skipped, {totals['invalid']} invalid"
+        ))
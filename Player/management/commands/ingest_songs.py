@@ -0,0 +1,29 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from Player.functions.bulk_import import ingest, iter_csv, iter_ndjson
+
+class Command(BaseCommand):
+    help = "Stream songs from an NDJSON or CSV file into the catalogue, one chunk per transaction."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help="Defaults to the file extension.")
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--results', action='store_true', help="Print one JSON result per input line.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        totals = {'created': 0, 'skipped': 0, 'invalid': 0}
+        try:
+            with open(path, encoding='utf-8', newline='') as file:
+                records = iter_csv(file) if fmt == 'csv' else iter_ndjson(file)
+                for result in ingest(records, chunk_size=options['chunk_size']):
+                    totals[result['status']] += 1
+                    if options['results']:
+                        self.stdout.write(json.dumps(result))
+        except OSError as exc:
+            raise CommandError(str(exc))
+        self.stderr.write(self.style.SUCCESS(
+            f"{totals['created']} created, {totals['skipped']} skipped, {totals['invalid']} invalid"
+        ))
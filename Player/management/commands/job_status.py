@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Min
+from Player.models import Job
+
+class Command(BaseCommand):
+    help = "Show queued background jobs by kind and status, and recent failures."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--failures', type=int, default=5, help="Number of recent failures to show.")
+
+    def handle(self, *args, **options):
+        rows = Job.objects.values('kind', 'status').annotate(jobs=Count('id'), oldest=Min('run_after')).order_by('kind', 'status')
+        if not rows:
+            self.stdout.write("No jobs")
+        for row in rows:
+            self.stdout.write(f"{row['kind']:<20} {row['status']:<8} {row['jobs']:>6}  oldest due {row['oldest']:%Y-%m-%d %H:%M:%S}")
+        for job in Job.objects.filter(status=Job.FAILED).order_by('-updated_at')[:options['failures']]:
+            self.stdout.write(self.style.ERROR(f"{job.kind} #{job.pk} failed after {job.attempts} attempts: {job.error}"))
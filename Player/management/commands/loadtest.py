@@ -0,0 +1,73 @@
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+from Player.functions.benchmark import compare, comparison_table, load_results, summarize, write_results
+
+class Command(BaseCommand):
+    help = "Send concurrent GET requests to a running server and report throughput and latency percentiles."
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='+')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=1000)
+        parser.add_argument('--name', default='http_get', help="Benchmark name in the results file.")
+        parser.add_argument('--output', help="Write the results to this JSON file.")
+        parser.add_argument('--baseline', help="Results file to compare against.")
+        parser.add_argument('--metric', default='p95_ms', choices=['mean_ms', 'p50_ms', 'p95_ms', 'p99_ms'])
+        parser.add_argument('--threshold', type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        urls = [urlsplit(url) for url in options['url']]
+        if any(url.scheme != 'http' for url in urls):
+            raise CommandError("Only http:// URLs are supported.")
+        total = options['requests']
+        latencies, errors, lock = [], [], threading.Lock()
+        counter = iter(range(total))
+
+        def worker():
+            connection = None
+            for n in counter:
+                url = urls[n % len(urls)]
+                if connection is None:
+                    connection = http.client.HTTPConnection(url.netloc, timeout=30)
+                start = time.perf_counter()
+                try:
+                    connection.request('GET', url.path + (f"?{url.query}" if url.query else ''))
+                    response = connection.getresponse()
+                    response.read()
+                    ok = response.status < 400
+                except (OSError, http.client.HTTPException):
+                    connection.close()
+                    connection, ok = None, False
+                elapsed = time.perf_counter() - start
+                with lock:
+                    (latencies if ok else errors).append(elapsed)
+            if connection is not None:
+                connection.close()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+
+        if not latencies:
+            raise CommandError(f"All {total} requests failed.")
+        result = {
+            'requests': total, 'errors': len(errors), 'seconds': round(wall, 3), 'rps': round(total / wall, 1),
+            'concurrency': options['concurrency'], 'urls': options['url'], **summarize(latencies),
+        }
+        results = {'benchmarks': {options['name']: result}}
+        if options['output']:
+            write_results(options['output'], results)
+        self.stdout.write(json.dumps(results, indent=2))
+        if options['baseline']:
+            rows, regressions = compare(results, load_results(options['baseline']), options['metric'], options['threshold'])
+            self.stderr.write(comparison_table(rows, options['metric']))
+            if regressions:
+                raise CommandError(f"Slower than the baseline by more than {options['threshold']:.0%}: {', '.join(regressions)}")
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Player.functions.search import get_search_backend
+from Player.models import FACET_TABLES, Song, SongKey, dedup_key, link_song_facets, song_keys
+
+INDEXES = ('keys', 'facets', 'search')
+
+class Command(BaseCommand):
+    help = "Regenerate the duplicate-detection keys, facet join tables and search index from the Song table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--only', choices=INDEXES, action='append', help="Rebuild just this index (repeatable).")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        only = options['only'] or INDEXES
+        chunk_size = options['chunk_size']
+        with transaction.atomic():
+            if 'keys' in only:
+                SongKey.objects.all().delete()
+                Song.objects.update(dedup_key=None)
+                self.dedup_keys = set()
+            if 'facets' in only:
+                for _, link, _ in FACET_TABLES.values():
+                    link.objects.all().delete()
+            if 'search' in only:
+                get_search_backend().create()
+                get_search_backend().clear()
+            chunk = []
+            for song in Song.objects.only('id', 'title', 'album', *FACET_TABLES).order_by('created_at', 'id').iterator(chunk_size=chunk_size):
+                chunk.append(song)
+                if len(chunk) >= chunk_size:
+                    self._rebuild(chunk, only)
+                    chunk = []
+            self._rebuild(chunk, only)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {', '.join(only)} for {Song.objects.count()} songs"))
+
+    def _rebuild(self, songs, only):
+        if 'keys' in only:
+            for song in songs:
+                # Songs stored before keys were normalized may collide; the oldest keeps the key.
+                song.dedup_key = dedup_key(song.title, song.album, song.artists)
+                if song.dedup_key in self.dedup_keys:
+                    song.dedup_key = None
+                self.dedup_keys.add(song.dedup_key)
+            Song.objects.bulk_update(songs, ['dedup_key'])
+            SongKey.objects.bulk_create(
+                SongKey(song=song, key=key) for song in songs for key in song_keys(song.title, song.album, song.artists)
+            )
+        if 'facets' in only:
+            link_song_facets(songs)
+        if 'search' in only:
+            get_search_backend().index(songs)
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from Player.models import FACETS, CatalogueVersion, FacetCount, Metadata, Song
+
+class Command(BaseCommand):
+    help = "Recount every facet value from the Song table and rewrite Metadata."
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            meta = FacetCount.objects.rebuild(Song.objects.values(*FACETS).iterator(chunk_size=2000))
+            Metadata.objects.exclude(pk=meta.pk).delete()
+            CatalogueVersion.objects.bump()
+        if options['verbosity']:
+            total = FacetCount.objects.count()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} facet values into {meta}"))
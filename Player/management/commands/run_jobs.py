@@ -0,0 +1,22 @@
+import time
+from django.core.management.base import BaseCommand
+from Player.functions.jobs import prune, run_pending
+
+class Command(BaseCommand):
+    help = "Run queued background jobs (e.g. deferred metadata refreshes), polling for new ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Run the jobs due now and exit.")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds between polls when idle.")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write(f"Ran {run_pending()} jobs")
+            return
+        pruned_at = 0
+        while True:
+            if time.monotonic() - pruned_at > 3600:
+                prune()
+                pruned_at = time.monotonic()
+            if not run_pending():
+                time.sleep(options['poll'])
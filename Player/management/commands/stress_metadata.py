@@ -0,0 +1,109 @@
+import multiprocessing
+import random
+import time
+from collections import Counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, OperationalError, connections
+from Player.models import FACETS, FacetCount, Metadata, Song, facet_counts
+
+WORDS = ['red', 'blue', 'green', 'gold', 'black', 'white']
+
+def _random_song(rnd, song=None):
+    song = song or Song()
+    song.title = f"stress {rnd.randrange(10 ** 9)}"
+    song.album = rnd.choice(WORDS)
+    song.year = rnd.choice([None, 1990, 2000, 2010])
+    song.artists = rnd.sample(WORDS, rnd.randint(0, 3))
+    song.genre = rnd.sample(WORDS, rnd.randint(0, 2))
+    song.language = rnd.sample(['en', 'fr', 'hi'], rnd.randint(0, 2))
+    song.tags = rnd.sample(WORDS, rnd.randint(0, 3))
+    return song
+
+def _worker(seed, operations, shared):
+    """
+    Create, update and delete songs, mostly ones every worker shares, through
+    instances loaded once and reused however stale they get.
+    """
+    connections.close_all()
+    rnd = random.Random(seed)
+    pks, instances = list(shared), {}
+    for _ in range(operations):
+        op = rnd.choice(['create', 'update', 'update', 'delete'])
+        pk = rnd.choice(pks)
+        for attempt in range(100):
+            try:
+                if op == 'create':
+                    song = _random_song(rnd)
+                    song.save()
+                    pks.append(song.pk)
+                    break
+                song = instances.get(pk) or Song.objects.filter(pk=pk).first()
+                if song is None:
+                    break
+                instances[pk] = song
+                if op == 'update':
+                    _random_song(rnd, song).save()
+                elif song.delete()[0]:
+                    # Django clears the pk of a deleted instance.
+                    del instances[pk]
+                break
+            except IntegrityError:
+                # Another worker re-created the deleted song from its own
+                # stale instance first.
+                instances.pop(pk, None)
+                break
+            except OperationalError:
+                # Lock timeouts and deadlocks roll the whole write back; retry it.
+                time.sleep(rnd.uniform(0, 0.05 * (attempt + 1)))
+    connections.close_all()
+
+class Command(BaseCommand):
+    help = (
+        "Run concurrent song writers in separate processes, then check that "
+        "FacetCount and the single Metadata row exactly match a full recount."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=8)
+        parser.add_argument('--operations', type=int, default=100, help="Writes per process.")
+        parser.add_argument('--songs', type=int, default=10, help="Songs every process writes to.")
+
+    def handle(self, *args, **options):
+        rnd = random.Random('shared')
+        shared = []
+        for _ in range(options['songs']):
+            song = _random_song(rnd)
+            song.save()
+            shared.append(song.pk)
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=_worker, args=(seed, options['operations'], shared))
+            for seed in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if any(worker.exitcode for worker in workers):
+            raise CommandError("A writer process failed")
+
+        expected = facet_counts(Song.objects.values(*FACETS).iterator())
+        actual = {facet: Counter() for facet in FACETS}
+        for facet, value, count in FacetCount.objects.values_list('facet', 'value', 'count'):
+            actual[facet][value] = count
+        if actual != expected:
+            raise CommandError(f"FacetCount drifted from the songs: {actual} != {expected}")
+
+        rows = list(Metadata.objects.all())
+        if len(rows) != 1:
+            raise CommandError(f"Expected one Metadata row, found {len(rows)}")
+        for facet in FACETS:
+            values = sorted(int(v) for v in expected[facet]) if facet == 'year' else sorted(expected[facet])
+            if getattr(rows[0], facet) != values:
+                raise CommandError(f"Metadata.{facet} is {getattr(rows[0], facet)}, expected {values}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{Song.objects.count()} songs after {options['processes'] * options['operations']} "
+            f"concurrent writes; aggregates exact"
+        ))
@@ -0,0 +1,62 @@
+import logging
+import time
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from .functions import perf
+
+logger = logging.getLogger('Player.perf')
+
+class PerfMiddleware:
+    """
+    Record latency, SQL query count and time, serialization time and response
+    size per view into the histograms served at /_debug/perf, and log requests
+    over PERF_QUERY_BUDGET queries or PERF_LATENCY_BUDGET_MS milliseconds.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        start, token = time.perf_counter(), perf.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            stats = perf.finish_request(token)
+        self.record(request, response, time.perf_counter() - start, stats)
+        return response
+
+    async def __acall__(self, request):
+        start, token = time.perf_counter(), perf.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            stats = perf.finish_request(token)
+        self.record(request, response, time.perf_counter() - start, stats)
+        return response
+
+    def record(self, request, response, elapsed, stats):
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        if view == 'perf-report':
+            return
+        perf.observe('request_seconds', elapsed, view, request.method)
+        perf.observe('db_queries', stats['queries'], view, request.method)
+        perf.observe('db_seconds', stats['db_seconds'], view, request.method)
+        perf.observe('serialize_seconds', stats['serialize_seconds'], view, request.method)
+        if not response.streaming:
+            perf.observe('response_bytes', len(response.content), view, request.method)
+
+        budgets = getattr(match.func, 'query_budget', {}) if match else {}
+        query_budget = budgets.get(request.method, settings.PERF_QUERY_BUDGET)
+        if stats['queries'] > query_budget or elapsed * 1000 > settings.PERF_LATENCY_BUDGET_MS:
+            logger.warning(
+                "%s %s (%s) over budget: %.1f ms, %d queries in %.1f ms",
+                request.method, request.path, view, elapsed * 1000, stats['queries'], stats['db_seconds'] * 1000,
+            )
@@ -1,10 +1,58 @@
+from bisect import bisect_left
+import unicodedata
 import uuid
-from django.db import models
-from django.db.models import JSONField
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, JSONField
+from django.utils import timezone
+
+FACETS = ('album', 'artists', 'genre', 'language', 'tags', 'year')
 
 def _lower_list(values):
     return [v.lower() if isinstance(v, str) else v for v in values]
 
+def _list_value(facet, value):
+    """A FacetCount value as it appears in the Metadata lists."""
+    return int(value) if facet == 'year' else value.lower()
+
+def song_facets(song):
+    """Return {facet: set of values} for a Song instance or a values() dict."""
+    get = song.get if isinstance(song, dict) else lambda name: getattr(song, name)
+    facets = {}
+    for facet in FACETS:
+        value = get(facet)
+        if facet in ('album', 'year'):
+            value = [value]
+        facets[facet] = {str(v) for v in (value or []) if v not in (None, '')}
+    return facets
+
+def normalize_key(value):
+    """Case-, accent- and whitespace-insensitive form of one part of a dedup key."""
+    decomposed = unicodedata.normalize('NFKD', (value or '').casefold())
+    return ' '.join(''.join(c for c in decomposed if not unicodedata.combining(c)).split())
+
+def song_keys(title, album, artists):
+    """Duplicate-detection keys: one normalized title/album/artist key per artist."""
+    prefix = f"{normalize_key(title)}\x1f{normalize_key(album)}\x1f"
+    return {prefix + normalize_key(artist) for artist in artists or [] if isinstance(artist, str)}
+
+def dedup_key(title, album, artists):
+    """The song_keys() key for the primary (first) artist, or None without one."""
+    primary = next((artist for artist in artists or [] if isinstance(artist, str)), None)
+    if primary is None:
+        return None
+    return f"{normalize_key(title)}\x1f{normalize_key(album)}\x1f{normalize_key(primary)}"
+
+def facet_counts(songs):
+    """Sum song_facets() over an iterable of songs into {facet: Counter}."""
+    counts = {facet: Counter() for facet in FACETS}
+    for song in songs:
+        for facet, values in song_facets(song).items():
+            counts[facet].update(values)
+    return counts
+
 class Song(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     title = models.CharField(max_length=255, null=True, blank=True)
@@ -15,6 +63,18 @@ class Song(models.Model):
     language = JSONField(default=list, blank=True)
     tags = JSONField(default=list, blank=True)
     link = models.CharField(max_length=255, blank=True, null=True)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+    # Unique title/album/primary artist key; SongKey covers the other artists.
+    dedup_key = models.CharField(max_length=800, null=True, blank=True, unique=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='song_created_id_idx'),
+            models.Index(fields=['title', 'album'], name='song_title_album_idx'),
+            models.Index(fields=['year'], name='song_year_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if self.title:
@@ -25,11 +85,371 @@ class Song(models.Model):
         self.genre = _lower_list(self.genre)
         self.language = _lower_list(self.language)
         self.tags = _lower_list(self.tags)
-        super().save(*args, **kwargs)
+        self.dedup_key = dedup_key(self.title, self.album, self.artists)
+        with transaction.atomic():
+            # The deltas come from the stored row, locked until commit, not
+            # from this instance, which may predate other writes.
+            previous = None
+            if not self._state.adding:
+                previous = self._locked_row()
+                if previous is not None:
+                    self.version = previous['version'] + 1
+            super().save(*args, **kwargs)
+            SongKey.objects.sync(self)
+            link_song_facets([self], replace=previous is not None)
+            FacetCount.objects.apply_delta(
+                removed=facet_counts([previous] if previous else []),
+                added=facet_counts([self]),
+            )
+            search_backend().index([self])
+            catalogue_changed(removed=[previous] if previous else [], added=[self.snapshot()])
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            previous = self._locked_row()
+            if previous is None:
+                # Already deleted, e.g. through another instance of the song.
+                return 0, {}
+            result = super().delete(*args, **kwargs)
+            FacetCount.objects.apply_delta(removed=facet_counts([previous]), added={})
+            search_backend().remove([previous['id']])
+            catalogue_changed(removed=[previous])
+        return result
+
+    def _locked_row(self):
+        return Song.objects.select_for_update().filter(pk=self.pk).values('id', 'version', *FACETS).first()
+
+    def snapshot(self):
+        """The id and facet fields as a values() style dict."""
+        return {'id': self.pk, **{facet: getattr(self, facet) for facet in FACETS}}
 
     def __str__(self):
         return self.title
 
+class SongKeyManager(models.Manager):
+    def sync(self, song):
+        self.filter(song=song).delete()
+        self.bulk_create(SongKey(song=song, key=key) for key in song_keys(song.title, song.album, song.artists))
+
+    def existing(self, keys, chunk_size=500, exclude_song=None):
+        """Return the subset of ``keys`` already used by a stored song other than ``exclude_song``."""
+        keys = list(keys)
+        queryset = self.exclude(song_id=exclude_song) if exclude_song is not None else self.all()
+        found = set()
+        for start in range(0, len(keys), chunk_size):
+            found.update(queryset.filter(key__in=keys[start:start + chunk_size]).values_list('key', flat=True))
+        return found
+
+class SongKey(models.Model):
+    """Indexed title/album/artist key used to detect duplicate songs."""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='keys')
+    key = models.CharField(max_length=800, db_index=True)
+
+    objects = SongKeyManager()
+
+    def __str__(self):
+        return self.key
+
+class FacetNameManager(models.Manager):
+    def ids_for(self, names):
+        """Return {name: id} for ``names``, creating the missing rows."""
+        names = set(names)
+        if not names:
+            return {}
+        self.bulk_create([self.model(name=name) for name in names], ignore_conflicts=True)
+        return dict(self.filter(name__in=names).values_list('name', 'id'))
+
+class FacetName(models.Model):
+    name = models.CharField(max_length=255, unique=True)
+
+    objects = FacetNameManager()
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return self.name
+
+class Artist(FacetName):
+    pass
+
+class Genre(FacetName):
+    pass
+
+class Language(FacetName):
+    pass
+
+class Tag(FacetName):
+    pass
+
+class SongArtist(models.Model):
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='artist_links')
+    artist = models.ForeignKey(Artist, on_delete=models.CASCADE, related_name='song_links')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['song', 'artist'], name='unique_song_artist')]
+        indexes = [models.Index(fields=['artist', 'song'])]
+
+class SongGenre(models.Model):
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='genre_links')
+    genre = models.ForeignKey(Genre, on_delete=models.CASCADE, related_name='song_links')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['song', 'genre'], name='unique_song_genre')]
+        indexes = [models.Index(fields=['genre', 'song'])]
+
+class SongLanguage(models.Model):
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='language_links')
+    language = models.ForeignKey(Language, on_delete=models.CASCADE, related_name='song_links')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['song', 'language'], name='unique_song_language')]
+        indexes = [models.Index(fields=['language', 'song'])]
+
+class SongTag(models.Model):
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='tag_links')
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='song_links')
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['song', 'tag'], name='unique_song_tag')]
+        indexes = [models.Index(fields=['tag', 'song'])]
+
+# Song list field -> (name table, join table, join table foreign key to the name table)
+FACET_TABLES = {
+    'artists': (Artist, SongArtist, 'artist'),
+    'genre': (Genre, SongGenre, 'genre'),
+    'language': (Language, SongLanguage, 'language'),
+    'tags': (Tag, SongTag, 'tag'),
+}
+
+def normalize_name(value):
+    return value.strip().lower()
+
+def link_song_facets(songs, replace=False):
+    """
+    Mirror the artists/genre/language/tags lists of ``songs`` into the join
+    tables. With ``replace`` the songs' existing links are dropped first.
+    """
+    for field, (model, link, fk) in FACET_TABLES.items():
+        names = {
+            song.pk: {normalize_name(v) for v in getattr(song, field) or [] if isinstance(v, str) and v.strip()}
+            for song in songs
+        }
+        ids = model.objects.ids_for(set().union(*names.values()))
+        if replace:
+            link.objects.filter(song__in=[song.pk for song in songs]).delete()
+        link.objects.bulk_create(
+            [link(song_id=pk, **{f'{fk}_id': ids[name]}) for pk, song_names in names.items() for name in song_names],
+            ignore_conflicts=True,
+        )
+
+def facet_filter(field, values):
+    """Q matching songs linked to any of ``values`` in the ``field`` join table."""
+    _, link, fk = FACET_TABLES[field]
+    names = {normalize_name(v) for v in values if isinstance(v, str)}
+    return models.Q(pk__in=link.objects.filter(**{f'{fk}__name__in': names}).values('song_id'))
+
+# Song list fields /filter/ can match with jsonb containment on PostgreSQL.
+JSON_CONTAINS_FIELDS = ('artists', 'genre', 'language', 'tags')
+
+def facet_contains(field, values):
+    """
+    Q matching songs whose ``field`` list contains any of ``values``, as one
+    @> test per value against the song row's GIN index, without the join table.
+    """
+    names = sorted({normalize_name(v) for v in values if isinstance(v, str)})
+    if not names:
+        return models.Q(pk__in=[])
+    query = models.Q(**{f'{field}__contains': [names[0]]})
+    for name in names[1:]:
+        query |= models.Q(**{f'{field}__contains': [name]})
+    return query
+
+class CatalogueVersionManager(models.Manager):
+    def current(self):
+        return self.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    async def acurrent(self):
+        return await self.filter(pk=1).values_list('version', flat=True).afirst() or 0
+
+    def state(self):
+        """(version, time of the last write) of the catalogue."""
+        return self.filter(pk=1).values_list('version', 'updated_at').first() or (0, None)
+
+    async def astate(self):
+        return await self.filter(pk=1).values_list('version', 'updated_at').afirst() or (0, None)
+
+    def bump(self):
+        if not self.filter(pk=1).update(version=F('version') + 1, updated_at=timezone.now()):
+            self.get_or_create(pk=1, defaults={'version': 0})
+            self.filter(pk=1).update(version=F('version') + 1, updated_at=timezone.now())
+        return self.current()
+
+class CatalogueVersion(models.Model):
+    """Single row counting Song writes, so in-process caches can detect staleness."""
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    objects = CatalogueVersionManager()
+
+    def __str__(self):
+        return f"Catalogue v{self.version}"
+
+def search_backend():
+    from .functions.search import get_search_backend
+    return get_search_backend()
+
+def catalogue_changed(removed=(), added=()):
+    """
+    Bump the catalogue version for a write and, once it commits, hand the
+    removed/added song snapshots to this process's facet index.
+    """
+    from .functions.facet_index import facet_index
+    version = CatalogueVersion.objects.bump()
+    transaction.on_commit(lambda: facet_index.apply(version, removed, added))
+    return version
+
+class SearchToken(models.Model):
+    """Title/album/artist token of a song, used by search when FTS5 is unavailable."""
+    song = models.ForeignKey(Song, on_delete=models.CASCADE, related_name='search_tokens')
+    token = models.CharField(max_length=64)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [models.Index(fields=['token', 'song'])]
+
+    def __str__(self):
+        return self.token
+
+class FacetCountManager(models.Manager):
+    def apply_delta(self, removed, added):
+        """
+        Apply {facet: Counter} deltas to the reference counts and add the
+        values that appeared to, and drop those that disappeared from, the
+        Metadata lists.
+        """
+        changes = {}
+        for facet in FACETS:
+            plus = Counter(added.get(facet, {}))
+            plus.subtract(removed.get(facet, {}))
+            deltas = {value: n for value, n in plus.items() if n}
+            if not deltas:
+                continue
+            # Lock the existing rows in (facet, value) order so concurrent
+            # writers cannot deadlock on each other.
+            existing = dict(
+                self.select_for_update().filter(facet=facet, value__in=deltas)
+                .order_by('value').values_list('value', 'count')
+            )
+            new = sorted(value for value, n in deltas.items() if n > 0 and value not in existing)
+            if new:
+                # Another writer may insert the same value concurrently;
+                # let the unique constraint pick one row and add to it.
+                self.bulk_create([FacetCount(facet=facet, value=value, count=0) for value in new], ignore_conflicts=True)
+            # One UPDATE per distinct delta rather than per value: a batch of
+            # songs mostly moves each value by the same small amount.
+            by_delta = {}
+            for value, n in deltas.items():
+                by_delta.setdefault(n, []).append(value)
+            for n, values in sorted(by_delta.items()):
+                self.filter(facet=facet, value__in=values).update(count=F('count') + n)
+            # The locked rows' counts cannot have moved since they were read.
+            gone = [value for value, count in existing.items() if count + deltas[value] <= 0]
+            if gone:
+                self.filter(facet=facet, value__in=gone).delete()
+            if new or gone:
+                changes[facet] = (new, gone)
+        if changes:
+            refresh_metadata(changes)
+
+    def rebuild(self, songs):
+        """Replace every count with a full recount of ``songs``."""
+        counts = facet_counts(songs)
+        self.all().delete()
+        self.bulk_create(
+            FacetCount(facet=facet, value=value, count=n)
+            for facet, values in counts.items()
+            for value, n in values.items()
+        )
+        return Metadata.objects.sync(FACETS)
+
+class FacetCount(models.Model):
+    """Number of songs referencing one album/artist/genre/language/tag/year value."""
+    facet = models.CharField(max_length=16, choices=[(f, f) for f in FACETS])
+    value = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = FacetCountManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['facet', 'value'], name='unique_facet_value'),
+        ]
+
+    def __str__(self):
+        return f"{self.facet}={self.value} ({self.count})"
+
+def refresh_metadata(changes):
+    """
+    Apply {facet: (added values, removed values)} to the Metadata lists now
+    or, with METADATA_REFRESH = 'async', through a coalesced background job.
+    """
+    if settings.METADATA_REFRESH == 'async':
+        Job.objects.enqueue(REFRESH_METADATA, delay=settings.METADATA_REFRESH_DEBOUNCE)
+    else:
+        Metadata.objects.apply_changes(changes)
+
+# Primary key of the Metadata row created on a fresh database; using a fixed
+# key lets the primary key constraint stop concurrent writers creating two.
+METADATA_ID = uuid.UUID(int=1)
+
+class MetadataManager(models.Manager):
+    def singleton(self):
+        """
+        Return the Metadata row locked until the end of the transaction,
+        creating it if needed. Readers are never blocked by the lock.
+        """
+        meta = self.select_for_update().order_by('pk').first()
+        if meta is None:
+            self.get_or_create(pk=METADATA_ID)
+            meta = self.select_for_update().order_by('pk').first()
+        return meta
+
+    def sync(self, facets):
+        """Copy every current FacetCount value of ``facets`` into the Metadata row."""
+        with transaction.atomic():
+            meta = self.singleton()
+            for facet in facets:
+                values = FacetCount.objects.filter(facet=facet).values_list('value', flat=True)
+                setattr(meta, facet, sorted(_list_value(facet, value) for value in values))
+            meta.save()
+        return meta
+
+    def apply_changes(self, changes):
+        """
+        Insert and remove values in the sorted Metadata lists, given as
+        {facet: (added, removed)}. This reads the one Metadata row whatever the
+        number of distinct values. Writers serialize on the row lock, and the
+        FacetCount rows they changed stay locked until they commit, so each
+        value's insert and removal reach the lists in commit order.
+        """
+        with transaction.atomic():
+            meta = self.singleton()
+            for facet, (added, removed) in changes.items():
+                values = getattr(meta, facet)
+                for value in removed:
+                    value = _list_value(facet, value)
+                    i = bisect_left(values, value)
+                    if i < len(values) and values[i] == value:
+                        del values[i]
+                for value in added:
+                    value = _list_value(facet, value)
+                    i = bisect_left(values, value)
+                    if i == len(values) or values[i] != value:
+                        values.insert(i, value)
+            meta.save()
+        return meta
+
 class Metadata(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     album = JSONField(default=list, blank=True)
@@ -38,8 +458,14 @@ class Metadata(models.Model):
     genre = JSONField(default=list, blank=True)
     language = JSONField(default=list, blank=True)
     tags = JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveIntegerField(default=1, editable=False)
+
+    objects = MetadataManager()
 
     def save(self, *args, **kwargs):
+        if not self._state.adding:
+            self.version += 1
         self.album = _lower_list(self.album)
         self.artists = _lower_list(self.artists)
         self.genre = _lower_list(self.genre)
@@ -49,3 +475,61 @@ class Metadata(models.Model):
 
     def __str__(self):
         return f"Metadata {self.id}"
+
+
+REFRESH_METADATA = 'refresh_metadata'
+
+class JobManager(models.Manager):
+    def enqueue(self, kind, delay=0):
+        """
+        Ensure a pending ``kind`` job exists. Every enqueue until a worker
+        claims it joins the same job, due ``delay`` seconds after the first.
+        """
+        self.bulk_create(
+            [Job(kind=kind, run_after=timezone.now() + timedelta(seconds=delay))],
+            ignore_conflicts=True,
+        )
+
+    def claim(self):
+        """Mark the oldest due pending job as running and return it, or None."""
+        with transaction.atomic():
+            job = (
+                self.select_for_update(skip_locked=True)
+                .filter(status=Job.PENDING, run_after__lte=timezone.now())
+                .order_by('run_after')
+                .first()
+            )
+            if job:
+                job.status = Job.RUNNING
+                job.attempts += 1
+                job.save(update_fields=['status', 'attempts', 'updated_at'])
+            return job
+
+class Job(models.Model):
+    """Deferred background work, run by the run_jobs management command."""
+    PENDING, RUNNING, DONE, FAILED = 'pending', 'running', 'done', 'failed'
+
+    kind = models.CharField(max_length=64)
+    status = models.CharField(
+        max_length=16,
+        choices=[(s, s) for s in (PENDING, RUNNING, DONE, FAILED)],
+        default=PENDING,
+    )
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = JobManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind'], condition=models.Q(status='pending'), name='unique_pending_job_kind'
+            ),
+        ]
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.kind} ({self.status})"
@@ -0,0 +1,26 @@
+import json
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+from .functions.perf import timed
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    Compact JSON renderer for large song lists: uses orjson when it is
+    installed, and otherwise the C json encoder, falling back to DRF's
+    encoder only for non-JSON types.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        with timed('serialize_seconds'):
+            if orjson is not None:
+                return orjson.dumps(data, default=_encoder.default)
+            return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=_encoder.default).encode()
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from .models import Song, Metadata, _lower_list
+from .functions.perf import timed
 
 class SongSerializer(serializers.ModelSerializer):
     title = serializers.CharField(required=False, allow_null=True, default=None)
@@ -11,6 +12,12 @@ class SongSerializer(serializers.ModelSerializer):
     tags = serializers.ListField(child=serializers.CharField(), allow_empty=True, required=False, allow_null=True, default=None)
     link = serializers.CharField(required=False, allow_blank=True, allow_null=True, default=None)
 
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
     def validate_title(self, value):
         return value.lower()
 
@@ -33,6 +40,39 @@ class SongSerializer(serializers.ModelSerializer):
         model = Song
         fields = ['id', 'title', 'album', 'year', 'artists', 'genre', 'language', 'tags', 'link']
 
+SONG_ROW_FIELDS = SongSerializer.Meta.fields + ['created_at']
+
+def _text(value):
+    return None if value is None else str(value)
+
+def _integer(value):
+    return None if value is None else int(value)
+
+def _text_list(value):
+    return None if value is None else [None if v is None else str(v) for v in value]
+
+SONG_FIELD_REPRESENTATIONS = {
+    'id': _text,
+    'title': _text,
+    'album': _text,
+    'year': _integer,
+    'artists': _text_list,
+    'genre': _text_list,
+    'language': _text_list,
+    'tags': _text_list,
+    'link': _text,
+}
+
+def serialize_song_rows(rows, fields=None):
+    """
+    Read-only fast path producing the same output as
+    SongSerializer(many=True, fields=fields).data, from Song.objects.values()
+    rows and without instantiating models or DRF fields.
+    """
+    represent = [(field, SONG_FIELD_REPRESENTATIONS[field]) for field in fields or SongSerializer.Meta.fields]
+    with timed('serialize_seconds'):
+        return [{field: convert(row[field]) for field, convert in represent} for row in rows]
+
 class MetadataSerializer(serializers.ModelSerializer):
     album    = serializers.ListField(child=serializers.CharField(), allow_empty=True)
     artists  = serializers.ListField(child=serializers.CharField(), allow_empty=True)
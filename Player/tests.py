@@ -1,3 +1,663 @@
-from django.test import TestCase
+import base64
+import json
+from array import array
+from functools import partial
+from io import StringIO
+from unittest import mock, skipIf
+from urllib.parse import parse_qs, urlencode, urlsplit
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import path, reverse
+from rest_framework_simplejwt.tokens import RefreshToken
+from MusicPlayer.testing import QueryBudgetAssertions, print_budget_report
+from . import async_views, views
+from .apps import bootstrap_facet_counts
+from .functions.bulk_import import import_songs
+from .functions.facet_index import facet_index
+from .functions.jobs import run_pending
+from .functions.response_cache import stats
+from .functions.search import FTS5Backend, TokenBackend, fts5_supported, search_id_batches
+from .functions.suggest import prefix_distance, suggest_index
+from .models import CatalogueVersion, FacetCount, Metadata, Song
 
-# Create your tests here.
+class MetadataConcurrencyTests(TransactionTestCase):
+    @skipIf(
+        connection.vendor == 'sqlite' and connection.is_in_memory_db(),
+        "writer processes need a database file or server they can share",
+    )
+    def test_concurrent_writers_keep_aggregates_exact(self):
+        out = StringIO()
+        call_command('stress_metadata', processes=6, operations=40, stdout=out)
+        self.assertIn('aggregates exact', out.getvalue())
+
+
+def catalogue_song(n):
+    return {
+        'title': f'song {n}', 'album': f'album {n % 5}', 'year': 2000 + n % 3,
+        'artists': [f'artist {n % 7}'], 'genre': ['pop' if n % 2 else 'rock'],
+        'language': ['en'], 'tags': [f'tag {n % 4}'], 'link': f'https://example.com/{n}',
+    }
+
+def new_song(n):
+    # Every new song moves the shared values by the same amount and adds one
+    # new artist, so the queries a batch needs do not depend on its size.
+    return {
+        'title': f'new song {n}', 'album': 'album 0', 'year': 2000, 'artists': [f'new artist {n}'],
+        'genre': ['pop'], 'language': ['en'], 'tags': ['tag 0'], 'link': f'https://example.com/new/{n}',
+    }
+
+BUDGET_REPORT = []
+
+def tearDownModule():
+    print_budget_report('Player query budgets', BUDGET_REPORT)
+
+class QueryBudgetMixin(QueryBudgetAssertions):
+    """Player endpoints against a catalogue of ``fixture_size`` songs."""
+    budget_report = BUDGET_REPORT
+
+    @classmethod
+    def setUpTestData(cls):
+        import_songs([catalogue_song(n) for n in range(cls.fixture_size)])
+
+    def post_json(self, path, data):
+        return self.client.post(path, data, content_type='application/json')
+
+    def test_song_list(self):
+        response = self.assertQueryBudget(views.song_list_create, 'get', 'first page',
+                                          lambda: self.client.get(reverse('song-list-create'), {'page_size': 5}))
+        cursor = parse_qs(urlsplit(response.json()['next']).query)['cursor'][0]
+        self.assertQueryBudget(views.song_list_create, 'get', 'next page',
+                               lambda: self.client.get(reverse('song-list-create'), {'page_size': 5, 'cursor': cursor}))
+
+    def test_song_create(self):
+        self.assertQueryBudget(views.song_list_create, 'post', 'new song',
+                               lambda: self.post_json(reverse('song-list-create'), new_song(0)))
+
+    def test_song_detail(self):
+        pk = Song.objects.order_by('created_at', 'id').values_list('pk', flat=True).first()
+        url = reverse('song-detail', args=[pk])
+        changed = {**catalogue_song(0), 'title': 'renamed', 'tags': ['tag 1']}
+        self.assertQueryBudget(views.song_detail, 'get', 'song', lambda: self.client.get(url))
+        self.assertQueryBudget(views.song_detail, 'put', 'new title and tag',
+                               lambda: self.client.put(url, changed, content_type='application/json'))
+        self.assertQueryBudget(views.song_detail, 'delete', 'song', lambda: self.client.delete(url))
+
+    def test_filter(self):
+        for case, body in [
+            ('1 facet', {'filter': {'artists': ['artist 1']}}),
+            ('3 facets', {'filter': {'artists': ['artist 1', 'artist 2'], 'genre': ['pop'], 'year': [2001]}}),
+            ('3 facets, all', {'filter': {'artists': ['artist 1'], 'genre': ['pop'], 'tags': ['tag 1']}, 'match': 'all'}),
+        ]:
+            self.assertQueryBudget(views.song_filter, 'post', case, lambda: self.post_json(reverse('song-filter'), body))
+
+    def test_search(self):
+        self.assertQueryBudget(views.song_search, 'get', 'two terms',
+                               lambda: self.client.get(reverse('song-search'), {'q': 'song 1'}))
+
+    def test_suggest(self):
+        suggest_index.version = None
+        self.assertQueryBudget(views.song_suggest, 'get', 'first build',
+                               lambda: self.client.get(reverse('song-suggest'), {'q': 'so'}))
+
+    def test_metadata(self):
+        self.assertQueryBudget(views.metadata_list, 'get', 'lists', lambda: self.client.get(reverse('metadata-list')))
+
+    def test_bulk_create(self):
+        # Batches stay within one SQLite insert batch (999 parameters).
+        for size in (1, 10, 50):
+            items = [new_song(size * 1000 + n) for n in range(size)] + [catalogue_song(0)]
+            self.assertQueryBudget(views.song_bulk_create, 'post', f'{size} new + 1 duplicate',
+                                   lambda: self.post_json(reverse('song-bulk-create'), items))
+
+    def test_ingest(self):
+        for size in (1, 50):
+            body = '\n'.join(json.dumps(new_song(size * 1000 + n)) for n in range(size))
+            self.assertQueryBudget(views.song_ingest, 'post', f'{size} lines',
+                                   lambda: self.client.post(reverse('song-ingest'), body, content_type='application/x-ndjson'))
+
+class SmallCatalogueQueryBudgetTests(QueryBudgetMixin, TestCase):
+    fixture_size = 10
+
+class LargeCatalogueQueryBudgetTests(QueryBudgetMixin, TestCase):
+    fixture_size = 200
+
+class CursorPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        import_songs([catalogue_song(n) for n in range(11)])
+        # Half the songs share a created_at, so only the id orders them.
+        tied = Song.objects.order_by('created_at', 'id').values_list('created_at', flat=True)[3]
+        Song.objects.filter(pk__in=Song.objects.order_by('created_at', 'id').values('pk')[3:9]).update(created_at=tied)
+        cls.expected = [str(pk) for pk in Song.objects.order_by('created_at', 'id').values_list('pk', flat=True)]
+
+    def page(self, link=None):
+        url = reverse('song-list-create') + (link or '?page_size=3')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        return [song['id'] for song in data['results']], data['next'], data['previous']
+
+    def test_follow_next_then_previous(self):
+        pages = []
+        ids, next_link, previous_link = self.page()
+        self.assertIsNone(previous_link)
+        pages.append(ids)
+        while next_link:
+            ids, next_link, previous_link = self.page(next_link)
+            pages.append(ids)
+        self.assertEqual([pk for ids in pages for pk in ids], self.expected)
+        self.assertEqual([len(ids) for ids in pages], [3, 3, 3, 2])
+
+        back = []
+        while previous_link:
+            ids, next_link, previous_link = self.page(previous_link)
+            back.append(ids)
+            self.assertIsNotNone(next_link)
+        self.assertEqual(back, pages[-2::-1])
+
+    def test_tampered_cursor(self):
+        _, next_link, _ = self.page()
+        cursor = parse_qs(urlsplit(next_link).query)['cursor'][0]
+        created_at, pk, _ = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        forged = [
+            cursor[:-4] + '!!!!',
+            cursor[1:],
+            base64.urlsafe_b64encode(json.dumps([created_at, pk, 'sideways']).encode()).decode(),
+            base64.urlsafe_b64encode(json.dumps([created_at, 'not-a-uuid', 'next']).encode()).decode(),
+            base64.urlsafe_b64encode(json.dumps(['yesterday', pk, 'next']).encode()).decode(),
+            base64.urlsafe_b64encode(b'{"created_at": 1}').decode(),
+        ]
+        for cursor in forged:
+            with self.subTest(cursor=cursor):
+                caches['responses'].clear()
+                response = self.client.get(reverse('song-list-create'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 400)
+
+    def test_page_number_is_refused(self):
+        for urlconf in (settings.ROOT_URLCONF, AsyncURLConf):
+            with self.subTest(urlconf=urlconf), override_settings(ROOT_URLCONF=urlconf):
+                response = self.client.get(reverse('song-list-create'), {'page': 2, 'page_size': 3})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('cursor', response.json()['detail'])
+
+class IngestTests(TestCase):
+    def ingest(self, body, content_type, **params):
+        response = self.client.post(f"{reverse('song-ingest')}?{urlencode(params)}", body, content_type=content_type)
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_input_format_parameter(self):
+        csv_body = 'title,album,artists,tags\nfirst,one,a|b,x\nsecond,two,c,\n'
+        results = self.ingest(csv_body, 'text/plain', input_format='csv')
+        self.assertEqual([(r['line'], r['status']) for r in results], [(2, 'created'), (3, 'created')])
+        self.assertEqual(Song.objects.get(title='first').artists, ['a', 'b'])
+
+        # The parameter wins over the Content-Type.
+        ndjson_body = '\n'.join(json.dumps(new_song(n)) for n in range(2))
+        results = self.ingest(ndjson_body, 'text/csv', input_format='ndjson')
+        self.assertEqual([r['status'] for r in results], ['created', 'created'])
+        self.assertEqual(Song.objects.count(), 4)
+
+    def test_content_type_detection(self):
+        results = self.ingest('title,album,artists\nthird,three,d\n', 'text/csv')
+        self.assertEqual([r['status'] for r in results], ['created'])
+        results = self.ingest(json.dumps(new_song(0)), 'application/x-ndjson')
+        self.assertEqual([r['status'] for r in results], ['created'])
+
+    def test_unknown_input_format(self):
+        response = self.client.post(f"{reverse('song-ingest')}?input_format=xml", '', content_type='text/plain')
+        self.assertEqual(response.status_code, 400)
+
+class DuplicateSongTests(TestCase):
+    def setUp(self):
+        import_songs([
+            {'title': 'Shared', 'album': 'Album', 'artists': ['lead', 'guest']},
+            {'title': 'Other', 'album': 'Album', 'artists': ['someone']},
+        ])
+        self.shared = Song.objects.get(title__iexact='shared')
+        self.other = Song.objects.get(title__iexact='other')
+
+    def test_secondary_artist_duplicate(self):
+        body = {'title': 'shared ', 'album': 'ALBUM', 'artists': ['another lead', 'guest'],
+                'genre': [], 'language': [], 'tags': []}
+        response = self.client.post(reverse('song-list-create'), body, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        response = self.client.put(reverse('song-detail', args=[self.other.pk]), body, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        self.other.refresh_from_db()
+        self.assertEqual(self.other.title.lower(), 'other')
+
+    def test_song_keeps_its_own_keys(self):
+        body = {'title': 'Shared', 'album': 'Album', 'artists': ['guest', 'lead'], 'genre': ['pop'],
+                'language': [], 'tags': []}
+        response = self.client.put(reverse('song-detail', args=[self.shared.pk]), body, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+
+class SuggestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        import_songs([
+            {'title': f'song {n}', 'album': f'album {n % 3}', 'artists': [f'artist {n}', 'artist 0'],
+             'tags': ['arty'] if n < 20 else []}
+            for n in range(30)
+        ])
+
+    def setUp(self):
+        suggest_index.version = None
+
+    def suggest(self, **params):
+        response = self.client.get(reverse('song-suggest'), params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_prefix_matches_most_popular_first(self):
+        results = self.suggest(q='art', limit=5)
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(r['text'].lower().startswith('art') for r in results))
+        self.assertEqual(results[0], {'text': 'artist 0', 'kind': 'artist', 'count': 30})
+        self.assertEqual(results[1], {'text': 'arty', 'kind': 'tag', 'count': 20})
+
+    def test_typo_matches(self):
+        results = self.suggest(q='artiat')
+        self.assertTrue(results)
+        self.assertTrue(all(r['text'].startswith('artist') for r in results))
+
+    def test_fuzzy_candidates_are_capped(self):
+        with mock.patch('Player.functions.suggest.FUZZY_CANDIDATES', 3), \
+                mock.patch('Player.functions.suggest.prefix_distance', wraps=prefix_distance) as distance:
+            results = self.suggest(q='artiat')
+        self.assertTrue(results)
+        self.assertLessEqual(distance.call_count, 3)
+
+    @override_settings(SUGGEST_REFRESH_SECONDS=0)
+    def test_rebuilds_in_the_background_after_writes(self):
+        self.suggest(q='song')
+        import_songs([{'title': 'midnight', 'artists': ['artist 0']}])
+        with mock.patch.object(suggest_index, 'reload_in_background') as reload, \
+                CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.suggest(q='midn'), [])
+        reload.assert_called_once()
+        self.assertEqual(len(queries), 1)
+        suggest_index.load()
+        self.assertEqual(self.suggest(q='midnigth')[0], {'text': 'midnight', 'kind': 'title', 'count': 1})
+
+    def test_kinds_filter(self):
+        results = self.suggest(q='a', kinds='album')
+        self.assertEqual(sorted(r['text'] for r in results), ['album 0', 'album 1', 'album 2'])
+        self.assertEqual({r['kind'] for r in self.suggest(q='s', kinds='title,tag')}, {'title'})
+
+    def test_limit(self):
+        self.assertEqual(len(self.suggest(q='artist', limit=100)), 20)
+        self.assertEqual(len(self.suggest(q='artist')), 10)
+        for limit in ('abc', '0'):
+            response = self.client.get(reverse('song-suggest'), {'q': 'artist', 'limit': limit})
+            self.assertEqual(response.status_code, 400)
+
+class AsyncURLConf:
+    """Player's read endpoints routed to the async views, as with ASYNC_VIEWS=true."""
+    urlpatterns = [
+        path('songs/', async_views.song_list_create, name='song-list-create'),
+        path('songs/<uuid:pk>/', async_views.song_detail, name='song-detail'),
+        path('filter/', async_views.song_filter, name='song-filter'),
+        path('metadata/', async_views.metadata_list, name='metadata-list'),
+        path('search/', async_views.song_search, name='song-search'),
+    ]
+
+class SearchPageTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        import_songs([catalogue_song(n) for n in range(5)])
+
+    def test_page_must_be_positive(self):
+        for urlconf in (settings.ROOT_URLCONF, AsyncURLConf):
+            with self.subTest(urlconf=urlconf), override_settings(ROOT_URLCONF=urlconf):
+                for page in ('0', '-2', 'x'):
+                    response = self.client.get(reverse('song-search'), {'q': 'song', 'page': page})
+                    self.assertEqual(response.status_code, 400, page)
+                response = self.client.get(reverse('song-search'), {'q': 'song', 'page': 2, 'page_size': 2})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.json()['results']), 2)
+                self.assertIn('page=1', response.json()['previous'])
+
+class SearchExportTests(TestCase):
+    def export_ids(self):
+        response = self.client.get(reverse('song-search'), {'q': 'song', 'export': 'true'})
+        self.assertEqual(response.status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            ids = [song['id'] for song in json.loads(b''.join(response.streaming_content))]
+        searches = [q for q in queries if 'fts' in q['sql'].lower() or 'searchtoken' in q['sql'].lower()]
+        return ids, len(searches)
+
+    def test_export_streams_every_match_from_one_query(self):
+        backends = [TokenBackend] + ([FTS5Backend] if connection.vendor == 'sqlite' and fts5_supported() else [])
+        for backend in backends:
+            with self.subTest(backend=backend.__name__), \
+                    mock.patch('Player.functions.search.get_search_backend', return_value=backend()), \
+                    mock.patch('Player.functions.bulk_import.get_search_backend', return_value=backend()), \
+                    mock.patch('Player.views.search_id_batches', partial(search_id_batches, chunk_size=3)):
+                Song.objects.all().delete()
+                import_songs([catalogue_song(n) for n in range(10)])
+                response = self.client.get(reverse('song-search'), {'q': 'song', 'page_size': 100})
+                expected = [song['id'] for song in response.json()['results']]
+                self.assertEqual(len(expected), 10)
+                self.assertEqual(self.export_ids(), (expected, 1))
+
+@override_settings(METADATA_REFRESH='async', METADATA_REFRESH_DEBOUNCE=0)
+class MetadataRefreshJobTests(TestCase):
+    def test_refresh_updates_metadata_without_bumping_catalogue(self):
+        import_songs([catalogue_song(0)])
+        run_pending()
+        self.assertEqual(self.client.get(reverse('metadata-list')).json()['artists'], ['artist 0'])
+
+        import_songs([catalogue_song(1)])
+        version = CatalogueVersion.objects.current()
+        self.assertEqual(self.client.get(reverse('metadata-list')).json()['artists'], ['artist 0'])
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(CatalogueVersion.objects.current(), version)
+        self.assertEqual(self.client.get(reverse('metadata-list')).json()['artists'], ['artist 0', 'artist 1'])
+
+class MetadataWriteCostTests(TestCase):
+    def write_queries(self, n):
+        """Queries to add, then delete, a song with values no other song has."""
+        with CaptureQueriesContext(connection) as added:
+            song = Song.objects.create(**{**catalogue_song(n), 'artists': [f'solo {n}'], 'tags': [f'only {n}']})
+        with CaptureQueriesContext(connection) as removed:
+            song.delete()
+        for query in added.captured_queries + removed.captured_queries:
+            if query['sql'].startswith('SELECT') and 'facetcount' in query['sql'].lower():
+                # Only the rows of the values being written are read.
+                self.assertIn(' IN (', query['sql'])
+        return len(added), len(removed)
+
+    def test_cost_does_not_grow_with_distinct_values(self):
+        import_songs([{**catalogue_song(n), 'artists': [f'artist {n}']} for n in range(10)])
+        small = self.write_queries(1000)
+        self.assertNotIn('solo 1000', Metadata.objects.get().artists)
+        import_songs([{**catalogue_song(n), 'artists': [f'artist {n}']} for n in range(10, 500)])
+        self.assertEqual(self.write_queries(1001), small)
+
+        Song.objects.create(**{**catalogue_song(1002), 'artists': ['aaa'], 'tags': ['zzz']})
+        meta = Metadata.objects.get()
+        self.assertEqual(meta.artists, ['aaa'] + sorted(f'artist {n}' for n in range(500)))
+        self.assertEqual(meta.tags[-1], 'zzz')
+        call_command('rebuild_metadata', stdout=StringIO())
+        self.assertEqual(Metadata.objects.get().artists, meta.artists)
+
+class StaleInstanceTests(TestCase):
+    def counts(self):
+        return sorted(FacetCount.objects.filter(facet__in=['artists', 'tags']).values_list('facet', 'value', 'count'))
+
+    def test_deleting_a_song_twice_counts_it_once(self):
+        Song.objects.create(**catalogue_song(0))
+        song = Song.objects.create(**{**catalogue_song(1), 'artists': ['artist 0']})
+        stale = Song.objects.get(pk=song.pk)
+        song.delete()
+        self.assertEqual(stale.delete(), (0, {}))
+        self.assertEqual(self.counts(), [('artists', 'artist 0', 1), ('tags', 'tag 0', 1)])
+        self.assertEqual(Metadata.objects.get().artists, ['artist 0'])
+
+    def test_writes_through_stale_instances_use_the_stored_row(self):
+        song = Song.objects.create(**catalogue_song(0))
+        stale = Song.objects.get(pk=song.pk)
+        song.tags = ['t2']
+        song.save()
+        stale.artists = ['artist 9']
+        stale.save()
+        self.assertEqual(self.counts(), [('artists', 'artist 9', 1), ('tags', 'tag 0', 1)])
+        self.assertEqual(Song.objects.get(pk=song.pk).version, 3)
+        Song.objects.get(pk=song.pk).delete()
+        stale.delete()
+        self.assertEqual(self.counts(), [])
+        self.assertEqual(Metadata.objects.get().tags, [])
+
+class MetadataBootstrapTests(TestCase):
+    def test_migrate_recounts_songs_stored_before_facet_counts(self):
+        Song.objects.bulk_create([Song(**catalogue_song(n)) for n in range(3)])
+        Metadata.objects.create(artists=['artist 2', None, 'artist 0'], year=[2002, None, 2000])
+        bootstrap_facet_counts(apps.get_app_config('Player'), using='default', verbosity=0)
+        meta = Metadata.objects.get()
+        self.assertEqual(meta.artists, ['artist 0', 'artist 1', 'artist 2'])
+        self.assertEqual(meta.year, [2000, 2001, 2002])
+
+        Song.objects.create(**{**catalogue_song(3), 'artists': ['artist 0']}).delete()
+        self.assertEqual(Metadata.objects.get().artists, ['artist 0', 'artist 1', 'artist 2'])
+
+class FacetIndexTests(TestCase):
+    FILTERS = [
+        {'filter': {'artists': ['artist 1']}},
+        {'filter': {'artists': ['Artist 1', 'artist 2'], 'genre': ['pop']}},
+        {'filter': {'artists': ['artist 1', 'artist 2'], 'genre': ['pop'], 'year': [2001]}, 'match': 'all'},
+        {'filter': {'album': ['ALBUM 3'], 'tags': ['tag 0', 'tag 2']}},
+        {'filter': {'album': ['album 3'], 'tags': ['tag 0', 'tag 2']}, 'match': 'all'},
+        {'filter': {'language': ['en'], 'year': [2000, 2002]}, 'match': 'all'},
+        {'filter': {'artists': ['nobody']}},
+        {'filter': {}},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        import_songs([catalogue_song(n) for n in range(40)])
+
+    def setUp(self):
+        facet_index.load()
+
+    def filter_page(self, body, cursor):
+        response = self.client.post(reverse('song-filter'), {**body, 'page_size': 7, 'cursor': cursor},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def filter_ids(self, body):
+        """
+        Ids of every match, following the next cursors 7 at a time, after
+        checking the previous cursors lead back through the same pages.
+        """
+        caches['responses'].clear()
+        pages, cursor = [], None
+        while True:
+            data = self.filter_page(body, cursor)
+            pages.append([song['id'] for song in data['results']])
+            if not data['next']:
+                break
+            cursor = data['next']
+        back, cursor = [], data['previous']
+        while cursor:
+            data = self.filter_page(body, cursor)
+            back.insert(0, [song['id'] for song in data['results']])
+            cursor = data['previous']
+        self.assertEqual(back, pages[:-1])
+        return [pk for page in pages for pk in page]
+
+    def index_filter_ids(self, body):
+        with override_settings(FACET_INDEX=True), \
+                mock.patch.object(facet_index, 'match', wraps=facet_index.match) as match:
+            ids = self.filter_ids(body)
+        self.assertTrue(match.called)
+        return ids
+
+    def test_index_matches_sql(self):
+        # All values as row arrays, a mix of arrays and bitmaps, all bitmaps.
+        for ratio in (1, 4, 10 ** 6):
+            with mock.patch('Player.functions.facet_index.DENSE_RATIO', ratio):
+                facet_index.load()
+            for body in self.FILTERS:
+                with self.subTest(ratio=ratio, body=body):
+                    with override_settings(FACET_INDEX=False):
+                        expected = self.filter_ids(body)
+                    self.assertEqual(self.index_filter_ids(body), expected)
+        self.assertEqual(len(self.index_filter_ids({'filter': {}})), 40)
+
+    def test_index_follows_song_writes(self):
+        # artist 1 is kept as a row array, pop as a bitmap.
+        with mock.patch('Player.functions.facet_index.DENSE_RATIO', 4):
+            facet_index.load()
+        self.assertIsInstance(facet_index.postings['artists']['artist 1'], array)
+        self.assertIsInstance(facet_index.postings['genre']['pop'], int)
+        bodies = [{'filter': {'artists': ['artist 1']}}, {'filter': {'genre': ['pop']}}]
+        before = [self.index_filter_ids(body) for body in bodies]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('song-list-create'), {**new_song(0), 'artists': ['artist 1']},
+                                        content_type='application/json')
+        pk = response.json()['id']
+        for body, ids in zip(bodies, before):
+            self.assertEqual(self.index_filter_ids(body), ids + [pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('song-detail', args=[before[0][0]]))
+        self.assertEqual(self.index_filter_ids(bodies[0]), before[0][1:] + [pk])
+
+        # A write made by another process only moves the catalogue version:
+        # SQL answers while the index reloads in the background.
+        version = facet_index.version
+        with mock.patch.object(facet_index, 'apply'):
+            response = self.client.post(reverse('song-list-create'), {**new_song(1), 'artists': ['artist 1']},
+                                        content_type='application/json')
+        with override_settings(FACET_INDEX=True), \
+                mock.patch.object(facet_index, 'reload_in_background') as reload, \
+                mock.patch.object(facet_index, 'match') as match:
+            self.assertEqual(self.filter_ids(bodies[0])[-1], response.json()['id'])
+        reload.assert_called()
+        match.assert_not_called()
+        facet_index.load()
+        self.assertEqual(facet_index.version, version + 1)
+        self.assertEqual(self.index_filter_ids(bodies[0])[-1], response.json()['id'])
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        caches['responses'].clear()
+        cache.clear()
+        import_songs([catalogue_song(n) for n in range(3)])
+        self.song = Song.objects.order_by('created_at', 'id').first()
+
+    def read(self):
+        detail = self.client.get(reverse('song-detail', args=[self.song.pk]))
+        return {
+            'list': self.client.get(reverse('song-list-create')).json(),
+            'detail': detail.json() if detail.status_code == 200 else detail.status_code,
+            'metadata': self.client.get(reverse('metadata-list')).json(),
+            'filter': self.client.post(reverse('song-filter'), {'filter': {'genre': ['rock']}},
+                                       content_type='application/json').json(),
+        }
+
+    def test_song_writes_invalidate_cached_responses(self):
+        before = self.read()
+        hits = stats()['hits']
+        self.assertEqual(self.read(), before)
+        self.assertEqual(stats()['hits'], hits + 4)
+
+        self.client.put(reverse('song-detail', args=[self.song.pk]), {**catalogue_song(0), 'title': 'renamed'},
+                        content_type='application/json')
+        self.client.post(reverse('song-list-create'), {**new_song(0), 'genre': ['rock']}, content_type='application/json')
+        after = self.read()
+        self.assertEqual(after['list']['count'], 4)
+        self.assertEqual(after['detail']['title'], 'renamed')
+        self.assertIn('renamed', [song['title'] for song in after['filter']['results']])
+        self.assertIn('new artist 0', after['metadata']['artists'])
+        self.assertEqual(len(after['filter']['results']), len(before['filter']['results']) + 1)
+
+        self.client.delete(reverse('song-detail', args=[self.song.pk]))
+        final = self.read()
+        self.assertEqual(final['list']['count'], 3)
+        self.assertEqual(final['detail'], 404)
+        self.assertNotIn('artist 0', final['metadata']['artists'])
+        self.assertEqual(len(final['filter']['results']), len(before['filter']['results']))
+
+@override_settings(DEBUG=False, INTERNAL_IPS=['127.0.0.1'], PERF_REPORT_ALLOW_ANONYMOUS=False)
+class PerfReportTests(TestCase):
+    def get(self, user=None, **extra):
+        if user is not None:
+            extra['HTTP_AUTHORIZATION'] = f'Bearer {RefreshToken.for_user(user).access_token}'
+        return self.client.get(reverse('perf-report'), **extra)
+
+    def test_requires_staff_on_internal_ips(self):
+        User = get_user_model()
+        staff = User.objects.create_user(username='ops', email='ops@example.com', name='Ops', is_staff=True)
+        listener = User.objects.create_user(username='listener', email='listener@example.com', name='Listener')
+        self.assertEqual(self.get().status_code, 404)
+        self.assertEqual(self.get(listener).status_code, 404)
+        self.assertEqual(self.get(staff, REMOTE_ADDR='10.0.0.2').status_code, 404)
+        response = self.get(staff)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+
+    def test_anonymous_access_is_opt_in(self):
+        with override_settings(PERF_REPORT_ALLOW_ANONYMOUS=True):
+            self.assertEqual(self.get().status_code, 200)
+            self.assertEqual(self.get(REMOTE_ADDR='10.0.0.2').status_code, 404)
+
+class ConditionalRequestTests(TestCase):
+    def setUp(self):
+        caches['responses'].clear()
+        import_songs([catalogue_song(n) for n in range(3)])
+        self.song = Song.objects.order_by('created_at', 'id').first()
+        self.url = reverse('song-detail', args=[self.song.pk])
+
+    def test_if_none_match(self):
+        for url in (self.url, reverse('metadata-list'), reverse('song-list-create'), f"{reverse('song-search')}?q=song"):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertTrue(response.has_header('Last-Modified'))
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+                self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+        etag = self.client.get(self.url)['ETag']
+        self.client.put(self.url, {**catalogue_song(0), 'title': 'renamed'}, content_type='application/json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_match(self):
+        etag = self.client.get(self.url)['ETag']
+        body = {**catalogue_song(0), 'title': 'renamed'}
+        self.assertEqual(self.client.put(self.url, body, content_type='application/json', HTTP_IF_MATCH=etag).status_code, 200)
+        # The song changed since ``etag`` was read.
+        body['title'] = 'renamed again'
+        response = self.client.put(self.url, body, content_type='application/json', HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, 412)
+        self.assertEqual(self.client.delete(self.url, HTTP_IF_MATCH=etag).status_code, 412)
+        self.assertEqual(Song.objects.get(pk=self.song.pk).title, 'renamed')
+
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.delete(self.url, HTTP_IF_MATCH=etag).status_code, 204)
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        import_songs([catalogue_song(n) for n in range(7)])
+        cls.pk = Song.objects.order_by('created_at', 'id').values_list('pk', flat=True).first()
+
+    async def fetch(self, send, method, url, data):
+        caches['responses'].clear()
+        if method == 'post':
+            response = await send(url, data, content_type='application/json')
+        else:
+            response = await send(url, data)
+        validators = (response.get('ETag'), response.get('Last-Modified'))
+        return response.status_code, json.loads(response.content), validators
+
+    async def test_same_payloads_as_sync_views(self):
+        first_page = await sync_to_async(self.client.get)(reverse('song-list-create'), {'page_size': 3})
+        cursor = parse_qs(urlsplit(first_page.json()['next']).query)['cursor'][0]
+        requests = [
+            ('get', reverse('song-list-create'), {'page_size': 3}),
+            ('get', reverse('song-list-create'), {'page_size': 3, 'cursor': cursor}),
+            ('get', reverse('song-list-create'), {'cursor': 'bad'}),
+            ('get', reverse('song-detail', args=[self.pk]), {}),
+            ('get', reverse('song-search'), {'q': 'song', 'page_size': 2, 'page': 2}),
+            ('get', reverse('metadata-list'), {}),
+            ('post', reverse('song-filter'), {'filter': {'artists': ['artist 1', 'artist 2']}, 'page_size': 1}),
+            ('post', reverse('song-filter'), {'filter': {'year': [2001], 'genre': ['pop']}, 'match': 'all'}),
+        ]
+        for method, url, data in requests:
+            with self.subTest(method=method, url=url, data=data):
+                expected = await self.fetch(sync_to_async(getattr(self.client, method)), method, url, data)
+                with override_settings(ROOT_URLCONF=AsyncURLConf):
+                    actual = await self.fetch(getattr(self.async_client, method), method, url, data)
+                self.assertEqual(actual, expected)
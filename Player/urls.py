@@ -1,11 +1,20 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.ASYNC_VIEWS:
+    from . import async_views as read_views
+else:
+    read_views = views
+
 urlpatterns = [
-    path('songs/', views.song_list_create, name='song-list-create'),
-    path('songs/<uuid:pk>/', views.song_detail, name='song-detail'),
-    path('filter/', views.song_filter, name='song-filter'),
-    path('metadata/', views.metadata_list, name='metadata-list'),
+    path('songs/', read_views.song_list_create, name='song-list-create'),
+    path('songs/<uuid:pk>/', read_views.song_detail, name='song-detail'),
+    path('filter/', read_views.song_filter, name='song-filter'),
+    path('metadata/', read_views.metadata_list, name='metadata-list'),
     path('bulk_create/', views.song_bulk_create, name='song-bulk-create'),
-    path('search/', views.song_search, name='song-search'),
-]
\ No newline at end of file
+    path('ingest/', views.song_ingest, name='song-ingest'),
+    path('search/', read_views.song_search, name='song-search'),
+    path('suggest/', views.song_suggest, name='song-suggest'),
+    path('_debug/perf', views.perf_report, name='perf-report'),
+]
@@ -1,49 +1,99 @@
-from rest_framework.decorators import api_view
+import hashlib
+import json
+from urllib.parse import urlencode
+from django.conf import settings
+from django.db import IntegrityError, connection
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import condition
+from rest_framework.decorators import api_view, renderer_classes
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
 from rest_framework import status
 from django.db.models import Q
-from .models import Song, Metadata
-from .serializers import SongSerializer, MetadataSerializer
-
-def rebuild_metadata():
-    albums = list(Song.objects.values_list('album', flat=True).distinct())
-    years = list(Song.objects.values_list('year', flat=True).distinct())
-    artists = list({artist for s in Song.objects.values_list('artists', flat=True) for artist in s})
-    genres = list({g for s in Song.objects.values_list('genre', flat=True) for g in s})
-    languages = list({l for s in Song.objects.values_list('language', flat=True) for l in s})
-    tags = list({l for s in Song.objects.values_list('tags', flat=True) for l in s})
-    meta, _ = Metadata.objects.get_or_create(id=Metadata.objects.first().id if Metadata.objects.exists() else None)
-    meta.album = albums
-    meta.artists = artists
-    meta.genre = genres
-    meta.language = languages
-    meta.tags = tags
-    meta.year = years
-    meta.save()
-    return meta
+from MusicPlayer.metrics import prometheus_text, query_budget
+from MusicPlayer.proxies import client_ip
+from auth.authentication import get_full_user
+from .models import FACET_TABLES, CatalogueVersion, Song, SongKey, Metadata, facet_contains, facet_filter, song_keys
+from .serializers import SONG_ROW_FIELDS, SongSerializer, MetadataSerializer, serialize_song_rows
+from .renderers import FastJSONRenderer
+from .functions.bulk_import import import_songs, ingest, iter_csv, iter_ndjson
+from .functions.facet_index import facet_index, index_page, songs_in_order
+from .functions.pagination import (
+    InvalidCursor, InvalidParameter, batched, cached_count, keyset_page, parse_filter_params, parse_page_size,
+    parse_search_params, parse_song_list_params, stream_json_array,
+)
+from .functions.response_cache import cache_key, get_cached, normalize_filter, set_cached
+from .functions.search import search_id_batches, search_songs
+from .functions.suggest import suggest_index
 
+DUPLICATE_SONG = {"detail": "A song with that title, album and artist combination already exists."}
+SONG_NOT_FOUND = {'error': 'Song not found'}
+NO_METADATA = {'error': 'No metadata found'}
+
+def _catalogue_state(request):
+    # condition() asks for the ETag and Last-Modified separately; look them up once.
+    if not hasattr(request, '_catalogue_state'):
+        request._catalogue_state = CatalogueVersion.objects.state()
+    return request._catalogue_state
+
+def catalogue_etag(request, *args, **kwargs):
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    version, _ = _catalogue_state(request)
+    query = hashlib.sha1(request.META.get('QUERY_STRING', '').encode()).hexdigest()[:16]
+    return f"catalogue-{version}-{query}"
+
+def catalogue_last_modified(request, *args, **kwargs):
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    return _catalogue_state(request)[1]
+
+def _song_state(request, pk):
+    if not hasattr(request, '_song_state'):
+        request._song_state = Song.objects.filter(pk=pk).values_list('version', 'updated_at').first()
+    return request._song_state
+
+def song_etag(request, pk):
+    state = _song_state(request, pk)
+    return state and f"song-{pk}-{state[0]}"
+
+def song_last_modified(request, pk):
+    state = _song_state(request, pk)
+    return state and state[1]
+
+def _metadata_state(request):
+    if not hasattr(request, '_metadata_state'):
+        request._metadata_state = Metadata.objects.values_list('id', 'version', 'updated_at').first()
+    return request._metadata_state
+
+def metadata_etag(request):
+    state = _metadata_state(request)
+    return state and f"metadata-{state[0]}-{state[1]}"
+
+def metadata_last_modified(request):
+    state = _metadata_state(request)
+    return state and state[2]
+
+@query_budget(GET=3, POST=39)
+@condition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified)
 @api_view(['GET', 'POST'])
+@renderer_classes([FastJSONRenderer, BrowsableAPIRenderer])
 def song_list_create(request):
     if request.method == 'GET':
-        page_size = int(request.query_params.get('page_size', 10))
-        page = int(request.query_params.get('page', 1))
-        
-        songs = Song.objects.all()
-        total_songs = songs.count()
-        
-        start_index = (page - 1) * page_size
-        end_index = start_index + page_size
-        
-        songs_page = songs[start_index:end_index]
-        serializer = SongSerializer(songs_page, many=True)
-        
-        response_data = {
-            'count': total_songs,
-            'next': None if end_index >= total_songs else f"?page={page+1}&page_size={page_size}",
-            'previous': None if page <= 1 else f"?page={page-1}&page_size={page_size}",
-            'results': serializer.data
-        }
-        
+        version, _ = _catalogue_state(request)
+        key = song_list_key(request.query_params, version)
+        data = get_cached(key)
+        if data is not None:
+            return Response(data)
+
+        try:
+            cursor, page_size, fields = parse_song_list_params(request.query_params)
+            page = keyset_page(Song.objects.values(*SONG_ROW_FIELDS), cursor, page_size)
+        except (InvalidCursor, InvalidParameter) as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response_data = song_list_payload(page, cached_count(Song.objects.all(), 'songs', version), page_size, fields)
+        set_cached(key, response_data)
         return Response(response_data)
 
     serializer = SongSerializer(data=request.data)
@@ -51,127 +101,258 @@ def song_list_create(request):
         title = serializer.validated_data['title']
         album = serializer.validated_data['album']
         artists = serializer.validated_data.get('artists', [])
-        conditions = [Q(title__iexact=title, album__iexact=album, artists__icontains=artist)
-                      for artist in artists]
-        if any(Song.objects.filter(cond).exists() for cond in conditions):
-            return Response(
-                {"detail": "A song with that title, album and artist combination already exists."},
-                status=status.HTTP_409_CONFLICT
-            )
-        serializer.save()
-        rebuild_metadata()
+        if SongKey.objects.existing(song_keys(title, album, artists)):
+            return Response(DUPLICATE_SONG, status=status.HTTP_409_CONFLICT)
+        try:
+            serializer.save()
+        except IntegrityError:
+            # Another request stored the same song since the check above.
+            return Response(DUPLICATE_SONG, status=status.HTTP_409_CONFLICT)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@query_budget(GET=3, PUT=32, DELETE=27)
+@condition(etag_func=song_etag, last_modified_func=song_last_modified)
 @api_view(['GET', 'PUT', 'DELETE'])
 def song_detail(request, pk):
+    if request.method == 'GET':
+        key = song_key(pk, CatalogueVersion.objects.current())
+        data = get_cached(key)
+        if data is not None:
+            return Response(data)
+
     try:
         song = Song.objects.get(pk=pk)
     except Song.DoesNotExist:
-        return Response({'error': 'Song not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(SONG_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
 
     if request.method == 'GET':
         serializer = SongSerializer(song)
+        set_cached(key, serializer.data)
         return Response(serializer.data)
 
     serializer = SongSerializer(song, data=request.data)
     if request.method == 'PUT':
         if serializer.is_valid():
-            serializer.save()
-            rebuild_metadata()
+            title = serializer.validated_data['title']
+            album = serializer.validated_data['album']
+            artists = serializer.validated_data.get('artists', [])
+            if SongKey.objects.existing(song_keys(title, album, artists), exclude_song=song.pk):
+                return Response(DUPLICATE_SONG, status=status.HTTP_409_CONFLICT)
+            try:
+                serializer.save()
+            except IntegrityError:
+                return Response(DUPLICATE_SONG, status=status.HTTP_409_CONFLICT)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     if request.method == 'DELETE':
         song.delete()
-        rebuild_metadata()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-@api_view(['POST'])
-def song_filter(request):
-    filters = request.data.get('filter', {})
+def page_fields(fields):
+    return {'fields': ','.join(fields)} if fields else {}
+
+# Cache keys and response bodies shared with the async views.
+
+def song_list_key(params, version):
+    return cache_key('songs', dict(params.items()), version=version)
+
+def song_key(pk, version):
+    return cache_key('song', str(pk), version=version)
+
+def song_list_payload(page, count, page_size, fields):
+    """The /songs/ response body for a keyset_page() result."""
+    songs, next_cursor, previous_cursor = page
+    def link(cursor):
+        return cursor and f"?{urlencode({'cursor': cursor, 'page_size': page_size, **page_fields(fields)})}"
+    return {
+        'count': count,
+        'next': link(next_cursor),
+        'previous': link(previous_cursor),
+        'results': serialize_song_rows(songs, fields)
+    }
+
+def filter_key(filters, match, cursor, page_size, fields, version):
+    return cache_key('filter', {
+        'filter': normalize_filter(filters), 'match': match, 'cursor': cursor,
+        'page_size': page_size, 'fields': fields,
+    }, version=version)
+
+def filter_payload(page, fields):
+    songs, next_cursor, previous_cursor = page
+    return {
+        'next': next_cursor,
+        'previous': previous_cursor,
+        'results': serialize_song_rows(songs, fields)
+    }
+
+def search_payload(keyword, page, page_size, fields, songs, total):
+    def link(number):
+        return f"?{urlencode({'q': keyword, 'page': number, 'page_size': page_size, **page_fields(fields)})}"
+    return {
+        'count': total,
+        'next': None if page * page_size >= total else link(page + 1),
+        'previous': None if page <= 1 else link(page - 1),
+        'results': serialize_song_rows(songs, fields)
+    }
+
+def metadata_key(state):
+    # Keyed like the ETag: the lists only change when the Metadata row does.
+    return cache_key('metadata', {}, version=f"{state[0]}-{state[1]}")
+
+def export_response(batches, fields):
+    return StreamingHttpResponse(stream_json_array(batches, fields=fields), content_type='application/json')
+
+def filter_query(filters, match):
     conditions = []
     if filters.get('album'):
-        for a in filters['album']:
-            conditions.append(Q(album__iexact=a))
-    if filters.get('artists'):
-        for artist in filters['artists']:
-            conditions.append(Q(artists__icontains=artist))
-    if filters.get('genre'):
-        for g in filters['genre']:
-            conditions.append(Q(genre__icontains=g))
-    if filters.get('language'):
-        for l in filters['language']:
-            conditions.append(Q(language__icontains=l))
-    if filters.get('tags'):
-        for t in filters['tags']:
-            conditions.append(Q(tags__icontains=t))
+        conditions.append(Q(album__in=[a.lower() for a in filters['album'] if isinstance(a, str)]))
+    # PostgreSQL answers list membership straight from the JSONB columns' GIN indexes.
+    match_facet = facet_contains if connection.vendor == 'postgresql' else facet_filter
+    for field in FACET_TABLES:
+        if filters.get(field):
+            conditions.append(match_facet(field, filters[field]))
     if filters.get('year'):
-        for y in filters['year']:
-            conditions.append(Q(year__icontains=y))
+        conditions.append(Q(year__in=[int(y) for y in filters['year'] if str(y).isdigit()]))
+    query = Q()
     if conditions:
         query = conditions.pop()
         for cond in conditions:
-            query |= cond
-        queryset = Song.objects.filter(query)
+            query = query & cond if match == 'all' else query | cond
+    return query
+
+@query_budget(POST=2)
+@api_view(['POST'])
+@renderer_classes([FastJSONRenderer, BrowsableAPIRenderer])
+def song_filter(request):
+    try:
+        filters, match, cursor, page_size, fields = parse_filter_params(request.data)
+    except InvalidParameter as exc:
+        return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    export = request.data.get('export')
+    version = CatalogueVersion.objects.current()
+    if not export:
+        key = filter_key(filters, match, cursor, page_size, fields, version)
+        data = get_cached(key)
+        if data is not None:
+            return Response(data)
+
+    # While the index reloads after another process's write, SQL answers.
+    if settings.FACET_INDEX and facet_index.refresh(version):
+        if export:
+            ids = facet_index.match(filters, match_all=match == 'all')
+            return export_response((songs_in_order(batch) for batch in batched(ids, 500)), fields)
+        page = lambda: index_page(filters, match == 'all', cursor, page_size)
     else:
-        queryset = Song.objects.all()
-    serializer = SongSerializer(queryset, many=True)
-    return Response(serializer.data)
+        queryset = Song.objects.filter(filter_query(filters, match)).values(*SONG_ROW_FIELDS)
+        if export:
+            songs = queryset.order_by('created_at', 'id').iterator(chunk_size=500)
+            return export_response(batched(songs, 500), fields)
+        page = lambda: keyset_page(queryset, cursor, page_size)
+
+    try:
+        response_data = filter_payload(page(), fields)
+    except InvalidCursor as exc:
+        return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    set_cached(key, response_data)
+    return Response(response_data)
 
+@query_budget(POST=38)
 @api_view(['POST'])
 def song_bulk_create(request):
     data = request.data
     if not isinstance(data, list):
         return Response({'detail': 'Expected a list of song objects.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    to_create = []
-    for item in data:
-        serializer = SongSerializer(data=item, partial=True)
-        if not serializer.is_valid():
-            continue
-        vd = serializer.validated_data
-        title = vd.get('title')
-        album = vd.get('album')
-        artists = vd.get('artists', []) or []
-        duplicate = any(
-            Song.objects.filter(
-                Q(title__iexact=title),
-                Q(album__iexact=album),
-                artists__icontains=artist
-            ).exists()
-            for artist in artists
-        )
-        if not duplicate:
-            to_create.append(item)
-
-    if not to_create:
-        return Response({'detail': 'No new songs to add.'}, status=status.HTTP_200_OK)
-
-    serializer = SongSerializer(data=to_create, many=True, partial=True)
-    if serializer.is_valid():
-        songs = serializer.save()
-        rebuild_metadata()
-        output = SongSerializer(songs, many=True).data
-        return Response(output, status=status.HTTP_201_CREATED)
+    results = import_songs(data)
+    summary = {state: sum(1 for r in results if r['status'] == state) for state in ('created', 'skipped', 'invalid')}
+    response_data = {**summary, 'results': results}
+    if not summary['created']:
+        return Response(response_data, status=status.HTTP_200_OK)
+    return Response(response_data, status=status.HTTP_201_CREATED)
 
-    return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+@query_budget(POST=38)
+@api_view(['POST'])
+def song_ingest(request):
+    # Not ?format=, which DRF reserves for choosing the response renderer.
+    fmt = request.query_params.get('input_format')
+    if not fmt:
+        fmt = 'csv' if 'csv' in request.content_type else 'ndjson'
+    if fmt not in ('csv', 'ndjson'):
+        return Response({'detail': 'Format must be "ndjson" or "csv".'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        chunk_size = max(1, min(int(request.query_params.get('chunk_size', 500)), 5000))
+    except ValueError:
+        return Response({'detail': 'chunk_size must be an integer.'}, status=status.HTTP_400_BAD_REQUEST)
 
+    lines = iter(request.readline, b'')
+    records = iter_csv(lines) if fmt == 'csv' else iter_ndjson(lines)
+    results = (json.dumps(result) + '\n' for result in ingest(records, chunk_size=chunk_size))
+    return StreamingHttpResponse(results, content_type='application/x-ndjson')
+
+@query_budget(GET=4)
+@condition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified)
 @api_view(['GET'])
+@renderer_classes([FastJSONRenderer, BrowsableAPIRenderer])
 def song_search(request):
+    try:
+        keyword, page, page_size, fields, prefix = parse_search_params(request.query_params)
+    except InvalidParameter as exc:
+        return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+    if request.query_params.get('export', '').lower() in ('true', '1'):
+        batches = (songs_in_order(ids) for ids in search_id_batches(keyword, prefix=prefix))
+        return export_response(batches, fields)
+
+    ids, total = search_songs(keyword, offset=(page - 1) * page_size, limit=page_size, prefix=prefix)
+    return Response(search_payload(keyword, page, page_size, fields, songs_in_order(ids), total))
+
+@query_budget(GET=3)
+@api_view(['GET'])
+def song_suggest(request):
     keyword = request.query_params.get('q', '')
     if not keyword:
         return Response({'detail': 'Query param "q" required.'}, status=status.HTTP_400_BAD_REQUEST)
 
-    qs = Song.objects.filter(title__icontains=keyword.lower())
-    serializer = SongSerializer(qs, many=True)
-    return Response(serializer.data)
+    try:
+        limit = parse_page_size(request.query_params.get('limit'), maximum=20, name='limit')
+    except InvalidParameter as exc:
+        return Response({'detail': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    kinds = request.query_params.get('kinds')
+    kinds = set(kinds.split(',')) if kinds else None
+
+    suggest_index.refresh()
+    return Response(suggest_index.suggest(keyword, limit=limit, kinds=kinds))
 
+@query_budget(GET=2)
+@condition(etag_func=metadata_etag, last_modified_func=metadata_last_modified)
 @api_view(['GET'])
 def metadata_list(request):
+    state = _metadata_state(request)
+    if not state:
+        return Response(NO_METADATA, status=status.HTTP_404_NOT_FOUND)
+    key = metadata_key(state)
+    data = get_cached(key)
+    if data is not None:
+        return Response(data)
+
     meta = Metadata.objects.first()
     if not meta:
-        return Response({'error': 'No metadata found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(NO_METADATA, status=status.HTTP_404_NOT_FOUND)
     serializer = MetadataSerializer(meta)
-    return Response(serializer.data)
\ No newline at end of file
+    set_cached(key, serializer.data)
+    return Response(serializer.data)
+
+@api_view(['GET'])
+def perf_report(request):
+    # Only for INTERNAL_IPS, and there only to staff unless PERF_REPORT_ALLOW_ANONYMOUS.
+    if not settings.DEBUG:
+        if client_ip(request) not in settings.INTERNAL_IPS:
+            raise Http404
+        if not settings.PERF_REPORT_ALLOW_ANONYMOUS and not (
+                request.user.is_authenticated and get_full_user(request).is_staff):
+            raise Http404
+    return HttpResponse(prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
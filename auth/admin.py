@@ -8,7 +8,7 @@ class UserProfileAdmin(UserAdmin):
     list_filter = ('is_verified', 'is_active', 'is_staff')
     fieldsets = (
         (None, {'fields': ('username', 'name', 'email', 'password')}),
-        ('Verification', {'fields': ('is_verified', 'verification_token')}),
+        ('Verification', {'fields': ('is_verified',)}),
         ('Permissions', {'fields': ('is_staff', 'is_active', 'is_superuser', 'groups', 'user_permissions')}),
         ('Important dates', {'fields': ('last_login', 'date_created')}),
     )
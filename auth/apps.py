@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save
+
+
+def forget_missing_user(sender, instance, **kwargs):
+    from .backends import forget_missing
+    forget_missing(instance.username, instance.email)
 
 
 class AuthConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'auth'
+    # "auth" is django.contrib.auth's label, which UserProfile's groups and
+    # permissions point at.
+    label = 'accounts'
+
+    def ready(self):
+        post_save.connect(forget_missing_user, sender=self.get_model('UserProfile'))
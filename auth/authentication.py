@@ -0,0 +1,45 @@
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from .functions.revocation import is_revoked
+
+class ClaimsUser(TokenUser):
+    """
+    The user an access token was issued to, answered from the token's claims.
+    ``profile`` loads the UserProfile row for views that need more than the id.
+    """
+    @cached_property
+    def profile(self):
+        UserModel = get_user_model()
+        try:
+            user = UserModel.objects.get(**{api_settings.USER_ID_FIELD: self.id})
+        except UserModel.DoesNotExist:
+            raise AuthenticationFailed("User not found", code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed("User is inactive", code="user_inactive")
+        return user
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    Accepts access tokens on their signature, expiry and the revoked-token
+    set alone, without a query; request.user is a ClaimsUser.
+    """
+    def get_validated_token(self, raw_token):
+        token = super().get_validated_token(raw_token)
+        if is_revoked(token):
+            raise InvalidToken("Token has been revoked")
+        return token
+
+    def get_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken("Token contained no recognizable user identification")
+        return ClaimsUser(validated_token)
+
+def get_full_user(request):
+    """request.user as a UserProfile row, loading it if authentication only read the token."""
+    user = request.user
+    return user.profile if isinstance(user, ClaimsUser) else user
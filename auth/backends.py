@@ -1,23 +1,65 @@
+import hashlib
+import time
+from functools import lru_cache
 from django.contrib.auth.backends import ModelBackend
-from django.contrib.auth import get_user_model
+from django.contrib.auth import get_backends, get_user_model
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from MusicPlayer import metrics
+
+metrics.histogram(
+    'auth_password_hash_seconds', (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    "Time spent checking a password against its stored hash.",
+)
+
+def missing_key(identifier):
+    return f'login-missing:{hashlib.sha1(identifier.encode()).hexdigest()}'
+
+def forget_missing(*identifiers):
+    """Drop cached "no such user" answers, e.g. once a user takes the username or email."""
+    caches['login'].delete_many([missing_key(identifier) for identifier in identifiers if identifier])
+
+@lru_cache(maxsize=None)
+def login_backend():
+    """The first of AUTHENTICATION_BACKENDS, instantiated once per process."""
+    return get_backends()[0]
+
+@receiver(setting_changed)
+def clear_login_backend(setting, **kwargs):
+    if setting == 'AUTHENTICATION_BACKENDS':
+        login_backend.cache_clear()
 
 class EmailUsernameBackend(ModelBackend):
     def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None or password is None:
+            return None
         UserModel = get_user_model()
+        cache = caches['login']
+        # Identifiers that matched no user recently skip the query.
+        if cache.get(missing_key(username)):
+            return None
         try:
             if '@' in username:
                 user = UserModel.objects.get(email=username)
             else:
                 user = UserModel.objects.get(username=username)
-                
-            if user.check_password(password):
-                return user
         except UserModel.DoesNotExist:
+            cache.set(missing_key(username), True, settings.LOGIN_NEGATIVE_CACHE_SECONDS)
             return None
+
+        start = time.perf_counter()
+        valid = user.check_password(password)
+        match = getattr(request, 'resolver_match', None)
+        metrics.observe('auth_password_hash_seconds', time.perf_counter() - start,
+                        match.view_name if match else 'authenticate', getattr(request, 'method', ''))
+        if valid:
+            return user
         
     def get_user(self, user_id):
         UserModel = get_user_model()
         try:
             return UserModel.objects.get(pk=user_id)
         except UserModel.DoesNotExist:
-            return None
\ No newline at end of file
+            return None
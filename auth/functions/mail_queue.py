@@ -0,0 +1,64 @@
+import logging
+import smtplib
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from ..models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+def retry_or_fail(message, exc, permanent=False):
+    """Put a message that could not be sent back in the queue with backoff, or give up on it."""
+    message.error = f"{type(exc).__name__}: {exc}"
+    message.status = OutboundEmail.FAILED
+    if not permanent and message.attempts < settings.EMAIL_MAX_ATTEMPTS:
+        message.status = OutboundEmail.PENDING
+        message.run_after = timezone.now() + timedelta(seconds=2 ** message.attempts)
+    message.save(update_fields=['status', 'run_after', 'error', 'updated_at'])
+
+def deliver(provider, messages):
+    """
+    Send claimed messages over ``provider``'s open session and record the
+    outcome of each; return how many were sent. A rejected recipient or
+    message fails alone, a lost connection sends the rest of the batch back
+    to the queue.
+    """
+    sent = []
+    for n, message in enumerate(messages):
+        try:
+            provider.send_email(settings.EMAIL_SENDER, message.recipient, message.subject, message.html)
+        except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as exc:
+            if isinstance(exc, smtplib.SMTPRecipientsRefused):
+                code = min(code for code, _ in exc.recipients.values())
+            else:
+                code = exc.smtp_code
+            logger.warning("Email %s to %s rejected: %s", message.pk, message.recipient, exc)
+            retry_or_fail(message, exc, permanent=code >= 500)
+        except (smtplib.SMTPException, OSError) as exc:
+            logger.exception("SMTP session failed sending email %s", message.pk)
+            provider.close()
+            for unsent in messages[n:]:
+                retry_or_fail(unsent, exc)
+            break
+        else:
+            sent.append(message.pk)
+    if sent:
+        OutboundEmail.objects.filter(pk__in=sent).update(
+            status=OutboundEmail.SENT, error='', sent_at=timezone.now(), updated_at=timezone.now()
+        )
+    return len(sent)
+
+def send_pending(provider, batch_size=None, limit=None):
+    """Claim and send due messages in batches until none are left (or ``limit`` were claimed); return how many were sent."""
+    batch_size = batch_size or settings.EMAIL_BATCH_SIZE
+    claimed = sent = 0
+    while limit is None or claimed < limit:
+        messages = OutboundEmail.objects.claim(batch_size if limit is None else min(batch_size, limit - claimed))
+        if not messages:
+            break
+        claimed += len(messages)
+        sent += deliver(provider, messages)
+    return sent
+
+def prune(older_than=timedelta(days=7)):
+    return OutboundEmail.objects.filter(status=OutboundEmail.SENT, sent_at__lt=timezone.now() - older_than).delete()[0]
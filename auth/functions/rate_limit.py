@@ -0,0 +1,63 @@
+import hashlib
+import math
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+def parse_rate(rate):
+    """'10/60' -> (10, 60.0): at most 10 hits per 60 seconds."""
+    count, seconds = rate.split('/')
+    return int(count), float(seconds)
+
+class SlidingWindow:
+    """
+    Approximate sliding-window counter kept in the "login" cache: the hits
+    in the current fixed window plus the previous window's hits, weighted by
+    how much of it still overlaps the last ``window`` seconds. Each subject
+    costs two cache keys however many hits it makes.
+    """
+    def __init__(self, scope, rate):
+        self.scope = scope
+        self.limit, self.window = parse_rate(rate)
+        self.cache = caches['login']
+
+    def _keys(self, subject, now):
+        digest = hashlib.sha1(subject.encode()).hexdigest()
+        index = int(now // self.window)
+        return f'ratelimit:{self.scope}:{digest}:{index}', f'ratelimit:{self.scope}:{digest}:{index - 1}'
+
+    def retry_after(self, subject, now=None):
+        """Seconds until ``subject`` may hit again, or 0 while it is under the limit."""
+        now = time.time() if now is None else now
+        current_key, previous_key = self._keys(subject, now)
+        counts = self.cache.get_many([current_key, previous_key])
+        current, previous = counts.get(current_key, 0), counts.get(previous_key, 0)
+        elapsed = now % self.window
+        if current + previous * (1 - elapsed / self.window) < self.limit:
+            return 0
+        if current >= self.limit:
+            # Wait out this window, then until this window's weight drops below the limit.
+            wait = self.window - elapsed + self.window * (1 - self.limit / current)
+        else:
+            wait = self.window * (1 - (self.limit - current) / previous) - elapsed
+        return max(1, math.ceil(round(wait, 6)))
+
+    def hit(self, subject, now=None):
+        current_key, _ = self._keys(subject, time.time() if now is None else now)
+        timeout = math.ceil(2 * self.window)
+        if not self.cache.add(current_key, 1, timeout):
+            try:
+                self.cache.incr(current_key)
+            except ValueError:
+                # Expired between add() and incr().
+                self.cache.set(current_key, 1, timeout)
+
+    def reset(self, subject, now=None):
+        self.cache.delete_many(self._keys(subject, time.time() if now is None else now))
+
+def login_limits():
+    """(per client IP, per identifier) limiters for the login endpoint."""
+    return (
+        SlidingWindow('login-ip', settings.LOGIN_RATE_LIMIT_IP),
+        SlidingWindow('login-identifier', settings.LOGIN_RATE_LIMIT_IDENTIFIER),
+    )
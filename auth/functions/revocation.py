@@ -0,0 +1,85 @@
+import heapq
+import logging
+import math
+import threading
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework_simplejwt.settings import api_settings
+
+logger = logging.getLogger(__name__)
+
+_warned_unshared = False
+
+def warn_unshared():
+    """Log once per process that revocations are not shared with other workers."""
+    global _warned_unshared
+    if _warned_unshared or settings.DEBUG:
+        return
+    _warned_unshared = True
+    logger.warning(
+        "TOKEN_REVOCATION_CACHE is not set: revoked tokens are only rejected by the process "
+        "that revoked them. Point it at a shared cache when running more than one worker."
+    )
+
+class RevokedTokens:
+    """
+    IDs (jti) of revoked JWTs, each kept only until its token expires
+    anyway, so the set stays as small as the number of live revoked tokens.
+    Lookups are a dict hit in this process; with TOKEN_REVOCATION_CACHE set,
+    revocations are also shared through that cache.
+    """
+    def __init__(self):
+        self._expiry = {}
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def _cache(self):
+        alias = settings.TOKEN_REVOCATION_CACHE
+        return caches[alias] if alias else None
+
+    def add(self, jti, exp):
+        now = time.time()
+        if exp <= now:
+            return
+        with self._lock:
+            self._evict(now)
+            self._expiry[jti] = exp
+            heapq.heappush(self._heap, (exp, jti))
+        cache = self._cache()
+        if cache is not None:
+            cache.set(f'revoked-jti:{jti}', exp, math.ceil(exp - now))
+        else:
+            warn_unshared()
+
+    def __contains__(self, jti):
+        exp = self._expiry.get(jti)
+        if exp is not None:
+            return exp > time.time()
+        cache = self._cache()
+        return cache is not None and cache.get(f'revoked-jti:{jti}') is not None
+
+    def __len__(self):
+        with self._lock:
+            self._evict(time.time())
+            return len(self._expiry)
+
+    def _evict(self, now):
+        while self._heap and self._heap[0][0] <= now:
+            exp, jti = heapq.heappop(self._heap)
+            if self._expiry.get(jti) == exp:
+                del self._expiry[jti]
+
+    def clear(self):
+        with self._lock:
+            self._expiry.clear()
+            self._heap.clear()
+
+revoked_tokens = RevokedTokens()
+
+def revoke(token):
+    """Reject a validated simplejwt token from now until it expires."""
+    revoked_tokens.add(token[api_settings.JTI_CLAIM], token['exp'])
+
+def is_revoked(token):
+    return token.get(api_settings.JTI_CLAIM) in revoked_tokens
@@ -3,35 +3,95 @@ from email.mime.text import MIMEText
 import ssl
 import smtplib
 import os
+import re
 from pathlib import Path
 from django.conf import settings
+from ..models import OutboundEmail
+
+# The HTML part is always base64 encoded, and "_" is not in the base64
+# alphabet, so a fixed boundary cannot collide with the body. Generating a
+# random one per message (and a regex to check it) costs more than the rest
+# of the message.
+BOUNDARY = "=_prelude_part_="
+
+
+def build_message(sender, recipient, subject, html_content):
+    message = MIMEMultipart(boundary=BOUNDARY)
+    message['From'] = sender
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.attach(MIMEText(html_content, "html", "utf-8"))
+    return message.as_string()
+
 
 class EmailProvider:
-    def __init__(self, host, port, username, password, use_ssl=True):
+    """
+    An SMTP session that stays connected and logged in across send_email()
+    calls until close(), reconnecting once if the server dropped it while idle.
+    Use it as a context manager to close the session afterwards.
+    """
+    def __init__(self, host, port, username, password, use_ssl=True, use_tls=True, timeout=None):
         self.host = host
         self.port = port
         self.username = username
         self.password = password
         self.use_ssl = use_ssl
-
-    def send_email(self, sender, recipient, subject, html_content):
-        message = MIMEMultipart()
-        message['From'] = sender
-        message['To'] = recipient
-        message['Subject'] = subject
-        message.attach(MIMEText(html_content, "html"))
-        email_string = message.as_string()
-
+        self.use_tls = use_tls
+        self.timeout = timeout
+        self.connection = None
+        self.sessions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def open(self):
+        """Connect and log in, unless a session is already open."""
+        if self.connection is not None:
+            return
+        options = {'timeout': self.timeout} if self.timeout else {}
         if self.use_ssl:
             context = ssl.create_default_context()
-            with smtplib.SMTP_SSL(self.host, self.port, context=context) as server:
-                server.login(self.username, self.password)
-                server.sendmail(sender, recipient, email_string)
+            connection = smtplib.SMTP_SSL(self.host, self.port, context=context, **options)
         else:
-            with smtplib.SMTP(self.host, self.port) as server:
-                server.starttls()
-                server.login(self.username, self.password)
-                server.sendmail(sender, recipient, email_string)
+            connection = smtplib.SMTP(self.host, self.port, **options)
+            if self.use_tls:
+                connection.starttls(context=ssl.create_default_context())
+        try:
+            if self.password:
+                connection.login(self.username, self.password)
+        except BaseException:
+            connection.close()
+            raise
+        self.connection = connection
+        self.sessions += 1
+
+    def close(self):
+        if self.connection is None:
+            return
+        try:
+            self.connection.quit()
+        except (smtplib.SMTPException, OSError):
+            self.connection.close()
+        self.connection = None
+
+    def send_email(self, sender, recipient, subject, html_content):
+        email_string = build_message(sender, recipient, subject, html_content)
+
+        reused = self.connection is not None
+        self.open()
+        try:
+            self.connection.sendmail(sender, recipient, email_string)
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            self.connection.close()
+            self.connection = None
+            if not reused:
+                raise
+            # The server timed out the idle session; log in again and retry once.
+            self.open()
+            self.connection.sendmail(sender, recipient, email_string)
 
         return {"success": True}
 
@@ -42,13 +102,19 @@ def get_email_provider():
         port=settings.EMAIL_PORT,
         username=settings.EMAIL_SENDER,
         password=settings.EMAIL_PASSWORD,
-        use_ssl=getattr(settings, 'EMAIL_USE_SSL', True)
+        use_ssl=getattr(settings, 'EMAIL_USE_SSL', True),
+        use_tls=getattr(settings, 'EMAIL_USE_TLS', True),
+        timeout=getattr(settings, 'EMAIL_TIMEOUT', None),
     )
 
 
+TEMPLATE_DIR = Path(__file__).parent / 'emails'
+
+PLACEHOLDER = re.compile(r"\{\{ (\w+) \}\}")
+
+
 def load_template(template_name):
-    current_dir = Path(__file__).parent
-    template_path = current_dir / 'emails' / template_name
+    template_path = TEMPLATE_DIR / template_name
     with open(template_path, 'r') as file:
         return file.read()
 
@@ -59,48 +125,108 @@ def render_template(template_content, context):
     return template_content
 
 
+class CompiledTemplate:
+    """
+    A template split once into its literal text and ``{{ name }}``
+    placeholders, so rendering is a single join. Placeholders missing from
+    the context are left in place, as render_template() leaves them.
+    """
+    def __init__(self, source):
+        parts = PLACEHOLDER.split(source)
+        self.literals = parts[0::2]
+        self.names = parts[1::2]
+
+    def render(self, context):
+        parts = [self.literals[0]]
+        for name, literal in zip(self.names, self.literals[1:]):
+            parts.append(str(context[name]) if name in context else f"{{{{ {name} }}}}")
+            parts.append(literal)
+        return ''.join(parts)
+
+
+# template name -> (file mtime, CompiledTemplate)
+_compiled = {}
+
+
+def get_template(template_name):
+    """The compiled template, recompiled only when its file has changed on disk."""
+    mtime = (TEMPLATE_DIR / template_name).stat().st_mtime_ns
+    cached = _compiled.get(template_name)
+    if cached is None or cached[0] != mtime:
+        cached = _compiled[template_name] = (mtime, CompiledTemplate(load_template(template_name)))
+    return cached[1]
+
+
+TEMPLATE_MAP = {
+    'registration': {
+        'template': 'registration.html',
+        'subject': 'Welcome to Prelude Curation',
+        'link': 'registration_link',
+    },
+    'password_reset': {
+        'template': 'password_reset.html',
+        'subject': 'Prelude Curation Password Reset',
+        'link': 'reset_link',
+    },
+    'email_update': {
+        'template': 'email_update.html',
+        'subject': 'Prelude Curation Email Update Confirmation',
+        'link': 'update_link',
+    },
+}
+
+
+def render_email(template_type, username, link):
+    """Return the (subject, html) of a 'registration', 'password_reset' or 'email_update' email."""
+    template_info = TEMPLATE_MAP[template_type]
+    context = {'username': username, template_info['link']: link}
+    return template_info['subject'], get_template(template_info['template']).render(context)
+
+
+def render_batch(template_name, contexts):
+    """Render one template for each context, e.g. the same announcement to many recipients."""
+    render = get_template(template_name).render
+    return [render(context) for context in contexts]
+
+
 def send_email(template_type, username, recipient_email, link):
     """
     Send an email for one of the template types: 'registration', 'password_reset', or 'email_update'.
     """
-    template_map = {
-        'registration': {
-            'template': 'registration.html',
-            'subject': 'Welcome to Prelude Curation'
-        },
-        'password_reset': {
-            'template': 'password_reset.html',
-            'subject': 'Prelude Curation Password Reset'
-        },
-        'email_update': {
-            'template': 'email_update.html',
-            'subject': 'Prelude Curation Email Update Confirmation'
-        }
-    }
-
-    if template_type not in template_map:
+    if template_type not in TEMPLATE_MAP:
         return {"success": False, "error": f"Unknown email type: {template_type}"}
 
-    template_info = template_map[template_type]
+    subject, html_content = render_email(template_type, username, link)
+    with get_email_provider() as provider:
+        return provider.send_email(
+            sender=settings.EMAIL_SENDER,
+            recipient=recipient_email,
+            subject=subject,
+            html_content=html_content
+        )
+
 
-    context = {'username': username}
-    if template_type == 'registration':
-        context['registration_link'] = link
-    elif template_type == 'password_reset':
-        context['reset_link'] = link
-    elif template_type == 'email_update':
-        context['update_link'] = link
+def send_verification_email(username, recipient_email, link, email_type='registration'):
+    """
+    Queue an email of ``email_type`` for the send_queued_mail worker and
+    return without waiting on the SMTP server.
+    """
+    if email_type not in TEMPLATE_MAP:
+        return {"success": False, "error": f"Unknown email type: {email_type}"}
+
+    subject, html_content = render_email(email_type, username, link)
+    OutboundEmail.objects.enqueue(recipient_email, subject, html_content)
+    return {"success": True, "queued": True}
 
-    html_content = render_template(
-        load_template(template_info['template']),
-        context
+
+def send_batch_email(template_name, subject, recipients):
+    """
+    Queue ``template_name`` rendered for every (email, context) pair in
+    ``recipients``, e.g. an announcement to all users; return how many were queued.
+    """
+    recipients = list(recipients)
+    bodies = render_batch(template_name, [context for _, context in recipients])
+    OutboundEmail.objects.enqueue_many(
+        (email, subject, html_content) for (email, _), html_content in zip(recipients, bodies)
     )
-    subject = template_info['subject']
-
-    provider = get_email_provider()
-    return provider.send_email(
-        sender=settings.EMAIL_SENDER,
-        recipient=recipient_email,
-        subject=subject,
-        html_content=html_content
-    )
\ No newline at end of file
+    return len(recipients)
@@ -0,0 +1,42 @@
+import time
+from django.apps import apps
+from django.utils import timezone
+from ..models import VerificationToken
+
+def delete_in_batches(queryset, batch_size=1000, pause=0):
+    """
+    Delete the rows of ``queryset`` ``batch_size`` at a time, so no single
+    statement holds locks for long, pausing ``pause`` seconds between
+    batches; return how many rows of its model were deleted.
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += model.objects.filter(pk__in=ids).delete()[1].get(model._meta.label, 0)
+        if pause:
+            time.sleep(pause)
+
+def delete_expired_tokens(batch_size=1000, pause=0):
+    """
+    Delete expired verification tokens and, with simplejwt's token_blacklist
+    app installed, the outstanding and blacklisted rows of expired JWTs.
+    Return the number deleted per table.
+    """
+    now = timezone.now()
+    counts = {
+        'verification tokens': delete_in_batches(
+            VerificationToken.objects.filter(expires_at__lte=now), batch_size, pause
+        ),
+    }
+    if apps.is_installed('rest_framework_simplejwt.token_blacklist'):
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+        counts['blacklisted JWTs'] = delete_in_batches(
+            BlacklistedToken.objects.filter(token__expires_at__lte=now), batch_size, pause
+        )
+        counts['outstanding JWTs'] = delete_in_batches(
+            OutstandingToken.objects.filter(expires_at__lte=now), batch_size, pause
+        )
+    return counts
@@ -0,0 +1,55 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+from django.urls import resolve, reverse
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+from auth.authentication import StatelessJWTAuthentication
+from auth.models import UserProfile
+
+AUTHENTICATION = {
+    'database': JWTAuthentication,
+    'stateless': StatelessJWTAuthentication,
+}
+
+class Command(BaseCommand):
+    help = (
+        "Measure authenticated requests per second with simplejwt's JWTAuthentication (user loaded from the "
+        "database) and StatelessJWTAuthentication (claims only) on /songs/ and /auth/profile/. Nothing is committed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        paths = [reverse('song-list-create'), reverse('get_user_profile')]
+        views = [resolve(path).func.cls for path in paths]
+        original = [view.authentication_classes for view in views]
+        results = {'requests': options['requests'], 'requests_per_second': {}}
+        with transaction.atomic():
+            user = UserProfile.objects.create_user(username='bench-auth', email='bench-auth@example.com',
+                                                   name='Bench', is_verified=True)
+            client = Client(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+            try:
+                for name, authentication in AUTHENTICATION.items():
+                    for view in views:
+                        view.authentication_classes = [authentication]
+                    results['requests_per_second'][name] = {
+                        path: self._rate(client, path, options['requests']) for path in paths
+                    }
+            finally:
+                for view, classes in zip(views, original):
+                    view.authentication_classes = classes
+            transaction.set_rollback(True)
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def _rate(self, client, path, requests):
+        client.get(path)
+        start = time.perf_counter()
+        for _ in range(requests):
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f"GET {path} returned {response.status_code}")
+        return round(requests / (time.perf_counter() - start), 1)
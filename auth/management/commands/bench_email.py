@@ -0,0 +1,61 @@
+import json
+import statistics
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from django.core.management.base import BaseCommand, CommandError
+from auth.functions.send_mail import (
+    TEMPLATE_MAP, build_message, get_template, load_template, render_batch, render_email, render_template,
+)
+from Player.functions.benchmark import time_runs
+
+def legacy_message(sender, recipient, subject, html_content):
+    message = MIMEMultipart()
+    message['From'] = sender
+    message['To'] = recipient
+    message['Subject'] = subject
+    message.attach(MIMEText(html_content, "html"))
+    return message.as_string()
+
+class Command(BaseCommand):
+    help = (
+        "Check compiled email templates render like render_template() and time the per-message cost "
+        "of rendering (file read + replace vs cached compiled template vs batch) and MIME message building."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=1000, help="Messages per timed run.")
+        parser.add_argument('--runs', type=int, default=10)
+
+    def handle(self, *args, **options):
+        messages, runs = options['messages'], options['runs']
+
+        def per_message(func):
+            return round(statistics.median(time_runs(func, runs)) / messages * 1e6, 2)
+
+        results = {'messages': messages, 'runs': runs, 'templates': {}}
+        for template_type, info in TEMPLATE_MAP.items():
+            contexts = [{'username': f'user{n}', info['link']: f'https://example.com/verify/?token={n:032d}'}
+                        for n in range(messages)]
+            name = info['template']
+            legacy = [render_template(load_template(name), context) for context in contexts]
+            if render_batch(name, contexts) != legacy:
+                raise CommandError(f"Compiled {name} renders differently from render_template()")
+            subject, html_content = render_email(template_type, 'user0', contexts[0][info['link']])
+
+            timings = {
+                'render_template_us': per_message(
+                    lambda: [render_template(load_template(name), context) for context in contexts]),
+                'compiled_render_us': per_message(
+                    lambda: [get_template(name).render(context) for context in contexts]),
+                'render_batch_us': per_message(lambda: render_batch(name, contexts)),
+                'legacy_message_us': per_message(
+                    lambda: [legacy_message('sender@example.com', f'user{n}@example.com', subject, html_content)
+                             for n in range(messages)]),
+                'build_message_us': per_message(
+                    lambda: [build_message('sender@example.com', f'user{n}@example.com', subject, html_content)
+                             for n in range(messages)]),
+            }
+            timings['render_speedup'] = round(timings['render_template_us'] / timings['render_batch_us'], 1)
+            timings['message_speedup'] = round(timings['legacy_message_us'] / timings['build_message_us'], 1)
+            results['templates'][template_type] = timings
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from auth.functions.token_cleanup import delete_expired_tokens
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired email verification, password reset and email change tokens, and expired JWT "
+        "outstanding/blacklist rows, in batches. Run it periodically, e.g. hourly from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help="Rows deleted per statement.")
+        parser.add_argument('--pause', type=float, default=0, help="Seconds to sleep between batches.")
+
+    def handle(self, *args, **options):
+        counts = delete_expired_tokens(options['batch_size'], options['pause'])
+        for table, deleted in counts.items():
+            self.stdout.write(f"Deleted {deleted} expired {table}")
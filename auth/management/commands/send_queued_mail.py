@@ -0,0 +1,40 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from auth.functions.mail_queue import prune, send_pending
+from auth.functions.send_mail import get_email_provider
+from auth.models import OutboundEmail
+
+class Command(BaseCommand):
+    help = (
+        "Send queued emails over one authenticated SMTP session, kept open while mail keeps "
+        "arriving and closed after EMAIL_IDLE_TIMEOUT idle seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Send the emails due now and exit.")
+        parser.add_argument('--poll', type=float, default=1.0, help="Seconds between polls when idle.")
+        parser.add_argument('--batch-size', type=int, help="Emails claimed per batch (default EMAIL_BATCH_SIZE).")
+
+    def handle(self, *args, **options):
+        provider = get_email_provider()
+        try:
+            if options['once']:
+                OutboundEmail.objects.requeue_stale()
+                self.stdout.write(f"Sent {send_pending(provider, options['batch_size'])} emails")
+                return
+            pruned_at = 0
+            idle_since = time.monotonic()
+            while True:
+                if time.monotonic() - pruned_at > 3600:
+                    OutboundEmail.objects.requeue_stale()
+                    prune()
+                    pruned_at = time.monotonic()
+                if send_pending(provider, options['batch_size']):
+                    idle_since = time.monotonic()
+                    continue
+                if provider.connection is not None and time.monotonic() - idle_since > settings.EMAIL_IDLE_TIMEOUT:
+                    provider.close()
+                time.sleep(options['poll'])
+        finally:
+            provider.close()
@@ -1,6 +1,10 @@
-from django.db import models
+from datetime import timedelta
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin
+from .functions.generate_verification import generate_verification_token
 
 class UserProfileManager(BaseUserManager):
     def create_user(self, username, email, password=None, **extra_fields):
@@ -26,7 +30,6 @@ class UserProfile(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=100)
     username = models.CharField(max_length=50, unique=True)
     email = models.EmailField(unique=True)
-    verification_token = models.CharField(max_length=100, blank=True, null=True)
     is_verified = models.BooleanField(default=False)
     date_created = models.DateTimeField(default=timezone.now)
     is_active = models.BooleanField(default=True)
@@ -49,4 +52,115 @@ class UserProfile(AbstractBaseUser, PermissionsMixin):
     )
 
     def __str__(self):
-        return self.username
\ No newline at end of file
+        return self.username
+
+class VerificationTokenManager(models.Manager):
+    def issue(self, user, type, email='', replace=True):
+        """
+        Create a token of ``type`` for ``user``, valid for its
+        VERIFICATION_TOKEN_LIFETIMES entry. Earlier tokens of that type stop
+        working unless ``replace`` is False (e.g. for a user created just now).
+        """
+        if replace:
+            self.filter(user=user, type=type).delete()
+        return self.create(
+            user=user,
+            type=type,
+            email=email,
+            token=generate_verification_token(),
+            expires_at=timezone.now() + settings.VERIFICATION_TOKEN_LIFETIMES[type],
+        )
+
+    def consume(self, token, type):
+        """
+        Delete an unexpired token of ``type`` and return it with its user, or
+        None. Of concurrent requests presenting the same token only one gets it.
+        """
+        found = self.select_related('user').filter(token=token, type=type, expires_at__gt=timezone.now()).first()
+        if found is None or not self.filter(pk=found.pk).delete()[0]:
+            return None
+        return found
+
+class VerificationToken(models.Model):
+    """A single-use token emailed to confirm a registration, password reset or email change."""
+    REGISTRATION, PASSWORD_RESET, EMAIL_UPDATE = 'registration', 'password_reset', 'email_update'
+
+    token = models.CharField(max_length=100, unique=True)
+    user = models.ForeignKey(UserProfile, on_delete=models.CASCADE, related_name='verification_tokens')
+    type = models.CharField(
+        max_length=16,
+        choices=[(t, t) for t in (REGISTRATION, PASSWORD_RESET, EMAIL_UPDATE)],
+    )
+    # The new address for an email change.
+    email = models.EmailField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    expires_at = models.DateTimeField(db_index=True)
+
+    objects = VerificationTokenManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'type'])]
+
+    def __str__(self):
+        return f"{self.type} token for {self.user_id}"
+
+class OutboundEmailManager(models.Manager):
+    def enqueue(self, recipient, subject, html):
+        return self.create(recipient=recipient, subject=subject, html=html)
+
+    def enqueue_many(self, messages, batch_size=500):
+        """Queue (recipient, subject, html) tuples with one INSERT per ``batch_size``."""
+        return self.bulk_create(
+            (OutboundEmail(recipient=recipient, subject=subject, html=html) for recipient, subject, html in messages),
+            batch_size=batch_size,
+        )
+
+    def claim(self, limit):
+        """Mark up to ``limit`` due pending messages as sending and return them, oldest first."""
+        with transaction.atomic():
+            messages = list(
+                self.select_for_update(skip_locked=True)
+                .filter(status=OutboundEmail.PENDING, run_after__lte=timezone.now())
+                .order_by('run_after', 'id')[:limit]
+            )
+            if messages:
+                self.filter(pk__in=[message.pk for message in messages]).update(
+                    status=OutboundEmail.SENDING, attempts=F('attempts') + 1, updated_at=timezone.now()
+                )
+                for message in messages:
+                    message.status = OutboundEmail.SENDING
+                    message.attempts += 1
+            return messages
+
+    def requeue_stale(self, older_than=timedelta(minutes=10)):
+        """Return messages left sending by a worker that died mid-batch to the queue."""
+        return self.filter(
+            status=OutboundEmail.SENDING, updated_at__lt=timezone.now() - older_than
+        ).update(status=OutboundEmail.PENDING, updated_at=timezone.now())
+
+class OutboundEmail(models.Model):
+    """A rendered email waiting for the send_queued_mail worker."""
+    PENDING, SENDING, SENT, FAILED = 'pending', 'sending', 'sent', 'failed'
+
+    recipient = models.EmailField()
+    subject = models.CharField(max_length=255)
+    html = models.TextField()
+    status = models.CharField(
+        max_length=16,
+        choices=[(s, s) for s in (PENDING, SENDING, SENT, FAILED)],
+        default=PENDING,
+    )
+    run_after = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    updated_at = models.DateTimeField(auto_now=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    objects = OutboundEmailManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"{self.subject} to {self.recipient} ({self.status})"
@@ -1,3 +1,550 @@
-from django.test import TestCase
+import email
+import os
+import socket
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+from django.contrib.auth.hashers import identify_hasher
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+from MusicPlayer import metrics
+from MusicPlayer.testing import QueryBudgetAssertions, print_budget_report
+from . import views
+from .functions.mail_queue import send_pending
+from .functions.rate_limit import SlidingWindow
+from .functions import revocation
+from .functions.revocation import RevokedTokens, revoked_tokens
+from .functions import send_mail
+from .functions.send_mail import get_email_provider, send_verification_email
+from .models import OutboundEmail, UserProfile, VerificationToken
 
-# Create your tests here.
+try:
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.smtp import AuthResult
+except ImportError:
+    Controller = None
+
+BUDGET_REPORT = []
+
+def setUpModule():
+    # Every test shares this process; the warning has its own test.
+    revocation._warned_unshared = True
+
+def tearDownModule():
+    print_budget_report('auth query budgets', BUDGET_REPORT)
+
+class QueryBudgetMixin(QueryBudgetAssertions):
+    """auth endpoints with ``fixture_size`` other users registered, each holding a token of every type."""
+    budget_report = BUDGET_REPORT
+
+    @classmethod
+    def setUpTestData(cls):
+        expires_at = timezone.now() + timedelta(hours=1)
+        for n in range(cls.fixture_size):
+            user = UserProfile.objects.create_user(username=f'user{n}', email=f'user{n}@example.com', name=f'User {n}',
+                                                   is_verified=True)
+            VerificationToken.objects.bulk_create(
+                VerificationToken(user=user, type=type, token=f'{type}-{n}', expires_at=expires_at)
+                for type, _ in VerificationToken._meta.get_field('type').choices
+            )
+        cls.user = UserProfile.objects.create_user(username='listener', email='listener@example.com', name='Listener',
+                                                   password='correct horse', is_verified=True)
+        VerificationToken.objects.bulk_create([
+            VerificationToken(user=cls.user, type=VerificationToken.REGISTRATION, token='token-1', expires_at=expires_at),
+            VerificationToken(user=cls.user, type=VerificationToken.PASSWORD_RESET, token='token-2', expires_at=expires_at),
+            VerificationToken(user=cls.user, type=VerificationToken.EMAIL_UPDATE, token='token-3',
+                              email='moved@example.com', expires_at=expires_at),
+        ])
+
+    def post_json(self, name, data):
+        return self.client.post(reverse(name), data, content_type='application/json')
+
+    def authorization(self):
+        return {'HTTP_AUTHORIZATION': f'Bearer {RefreshToken.for_user(self.user).access_token}'}
+
+    def test_login(self):
+        self.assertQueryBudget(views.login, 'post', 'username',
+                               lambda: self.post_json('login', {'identifier': 'listener', 'password': 'correct horse'}))
+        self.assertQueryBudget(views.login, 'post', 'email',
+                               lambda: self.post_json('login', {'identifier': 'listener@example.com', 'password': 'correct horse'}))
+
+    def test_profile(self):
+        headers = self.authorization()
+        self.assertQueryBudget(views.get_user_profile, 'get', 'own profile',
+                               lambda: self.client.get(reverse('get_user_profile'), **headers))
+
+    def test_update_profile(self):
+        headers = self.authorization()
+        self.assertQueryBudget(views.update_profile, 'put', 'name',
+                               lambda: self.client.put(reverse('update_profile'), {'name': 'Renamed'},
+                                                       content_type='application/json', **headers))
+
+    def test_delete_profile(self):
+        headers = self.authorization()
+        refresh = str(RefreshToken.for_user(self.user))
+        self.assertQueryBudget(views.delete_profile, 'delete', 'own profile',
+                               lambda: self.client.delete(reverse('delete_profile'), {'refresh_token': refresh},
+                                                          content_type='application/json', **headers))
+
+    def test_logout(self):
+        refresh = str(RefreshToken.for_user(self.user))
+        self.assertQueryBudget(views.logout, 'post', 'refresh token',
+                               lambda: self.post_json('logout', {'refresh_token': refresh}))
+
+    def test_register(self):
+        self.assertQueryBudget(views.register, 'post', 'new user', lambda: self.post_json('register', {
+            'username': 'newcomer', 'name': 'Newcomer', 'email': 'newcomer@example.com', 'password': 'correct horse',
+        }))
+
+    def test_verify_email(self):
+        self.assertQueryBudget(views.verify_email, 'get', 'token',
+                               lambda: self.client.get(reverse('verify_email'), {'token': 'token-1'}))
+
+    def test_forgot_password(self):
+        self.assertQueryBudget(views.forgot_password, 'post', 'username',
+                               lambda: self.post_json('forgot_password', {'identifier': 'listener'}))
+
+    def test_reset_password(self):
+        self.assertQueryBudget(views.reset_password, 'post', 'token',
+                               lambda: self.post_json('reset_password', {'token': 'token-2', 'password': 'battery staple'}))
+
+    def test_verify_email_update(self):
+        self.assertQueryBudget(views.verify_email_update, 'get', 'token', lambda: self.client.get(
+            reverse('verify_email_update'), {'token': 'token-3', 'email': 'moved@example.com'},
+        ))
+
+    def test_tokens(self):
+        refresh = RefreshToken.for_user(self.user)
+        self.assertQueryBudget(views.verify_token, 'post', 'access token',
+                               lambda: self.post_json('verify_token', {'access_token': str(refresh.access_token)}))
+        self.assertQueryBudget(views.refresh_token, 'post', 'refresh token',
+                               lambda: self.post_json('refresh_token', {'refresh_token': str(refresh)}))
+
+class FewUsersQueryBudgetTests(QueryBudgetMixin, TestCase):
+    fixture_size = 1
+
+class ManyUsersQueryBudgetTests(QueryBudgetMixin, TestCase):
+    fixture_size = 100
+
+class SlidingWindowTests(TestCase):
+    def setUp(self):
+        caches['login'].clear()
+
+    def test_previous_window_counts_by_overlap(self):
+        limit = SlidingWindow('test', '10/60')
+        for _ in range(10):
+            limit.hit('subject', now=600)
+        self.assertEqual(limit.retry_after('subject', now=630), 30)
+        self.assertEqual(limit.retry_after('subject', now=659), 1)
+        # A quarter into the next window, three quarters of the previous one still count.
+        self.assertEqual(limit.retry_after('subject', now=675), 0)
+        for _ in range(3):
+            limit.hit('subject', now=675)
+        self.assertEqual(limit.retry_after('subject', now=675), 3)
+        self.assertEqual(limit.retry_after('subject', now=679), 0)
+
+    def test_subjects_and_scopes_are_separate(self):
+        limit = SlidingWindow('test', '1/60')
+        limit.hit('subject', now=600)
+        self.assertTrue(limit.retry_after('subject', now=600))
+        self.assertFalse(limit.retry_after('other', now=600))
+        self.assertFalse(SlidingWindow('other', '1/60').retry_after('subject', now=600))
+        limit.reset('subject', now=600)
+        self.assertFalse(limit.retry_after('subject', now=600))
+
+@override_settings(LOGIN_RATE_LIMIT_IP='100/60', LOGIN_RATE_LIMIT_IDENTIFIER='3/300', PASSWORD_HASH_ITERATIONS=1000)
+class LoginTests(TestCase):
+    def setUp(self):
+        caches['login'].clear()
+        self.user = UserProfile.objects.create_user(username='listener', email='listener@example.com', name='Listener',
+                                                    password='correct horse', is_verified=True)
+
+    def login(self, identifier, password='correct horse', **extra):
+        return self.client.post(reverse('login'), {'identifier': identifier, 'password': password},
+                                content_type='application/json', **extra)
+
+    def test_unknown_identifiers_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.login('nobody').status_code, 401)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.login('nobody').status_code, 401)
+
+    def test_new_users_replace_cached_misses(self):
+        self.assertEqual(self.login('newcomer').status_code, 401)
+        self.assertEqual(self.login('newcomer@example.com').status_code, 401)
+        UserProfile.objects.create_user(username='newcomer', email='newcomer@example.com', name='Newcomer',
+                                        password='correct horse', is_verified=True)
+        self.assertEqual(self.login('newcomer').status_code, 200)
+        self.assertEqual(self.login('newcomer@example.com').status_code, 200)
+
+    def test_failures_per_identifier_are_limited(self):
+        for _ in range(3):
+            self.assertEqual(self.login('listener', 'wrong').status_code, 401)
+        with self.assertNumQueries(0):
+            response = self.login('listener')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.login('listener@example.com').status_code, 200)
+
+    def test_success_clears_identifier_failures(self):
+        for _ in range(2):
+            self.login('listener', 'wrong')
+        self.assertEqual(self.login('listener').status_code, 200)
+        for _ in range(2):
+            self.login('listener', 'wrong')
+        self.assertEqual(self.login('listener').status_code, 200)
+
+    @override_settings(LOGIN_RATE_LIMIT_IP='2/60')
+    def test_attempts_per_ip_are_limited(self):
+        self.assertEqual(self.login('listener').status_code, 200)
+        self.assertEqual(self.login('nobody').status_code, 401)
+        self.assertEqual(self.login('listener').status_code, 429)
+        self.assertEqual(self.login('listener', REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    @override_settings(LOGIN_RATE_LIMIT_IP='1/60', TRUSTED_PROXY_COUNT=1)
+    def test_ip_is_read_behind_trusted_proxies(self):
+        self.assertEqual(self.login('listener', HTTP_X_FORWARDED_FOR='10.0.0.2').status_code, 200)
+        self.assertEqual(self.login('listener', HTTP_X_FORWARDED_FOR='10.0.0.3').status_code, 200)
+        # A client can prepend addresses but not change the one the proxy appended.
+        response = self.login('listener', HTTP_X_FORWARDED_FOR='10.0.0.9, 10.0.0.2')
+        self.assertEqual(response.status_code, 429)
+        with override_settings(TRUSTED_PROXY_COUNT=0):
+            self.assertEqual(self.login('listener', HTTP_X_FORWARDED_FOR='10.0.0.4').status_code, 200)
+            self.assertEqual(self.login('listener', HTTP_X_FORWARDED_FOR='10.0.0.5').status_code, 429)
+
+    def test_rehashes_with_the_configured_cost(self):
+        with override_settings(PASSWORD_HASH_ITERATIONS=1200):
+            self.assertEqual(self.login('listener').status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(identify_hasher(self.user.password).decode(self.user.password)['iterations'], 1200)
+
+    def test_records_hash_time(self):
+        metrics.reset()
+        self.login('listener')
+        self.login('nobody')
+        self.assertIn('auth_password_hash_seconds_count{view="login",method="POST"} 1', metrics.prometheus_text())
+
+class VerificationTokenTests(TestCase):
+    def setUp(self):
+        self.user = UserProfile.objects.create_user(username='listener', email='listener@example.com', name='Listener')
+
+    def test_tokens_are_single_use_and_typed(self):
+        token = VerificationToken.objects.issue(self.user, VerificationToken.PASSWORD_RESET).token
+        self.assertIsNone(VerificationToken.objects.consume(token, VerificationToken.REGISTRATION))
+        self.assertEqual(VerificationToken.objects.consume(token, VerificationToken.PASSWORD_RESET).user, self.user)
+        self.assertIsNone(VerificationToken.objects.consume(token, VerificationToken.PASSWORD_RESET))
+
+    def test_issuing_replaces_earlier_tokens_of_the_type(self):
+        first = VerificationToken.objects.issue(self.user, VerificationToken.PASSWORD_RESET).token
+        registration = VerificationToken.objects.issue(self.user, VerificationToken.REGISTRATION).token
+        VerificationToken.objects.issue(self.user, VerificationToken.PASSWORD_RESET)
+        self.assertIsNone(VerificationToken.objects.consume(first, VerificationToken.PASSWORD_RESET))
+        self.assertIsNotNone(VerificationToken.objects.consume(registration, VerificationToken.REGISTRATION))
+
+    def test_expired_tokens_are_rejected(self):
+        with override_settings(VERIFICATION_TOKEN_LIFETIMES={VerificationToken.REGISTRATION: timedelta(0)}):
+            token = VerificationToken.objects.issue(self.user, VerificationToken.REGISTRATION).token
+        response = self.client.get(reverse('verify_email'), {'token': token})
+        self.assertEqual(response.status_code, 400)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_verified)
+
+    def test_email_update_applies_the_requested_address(self):
+        token = VerificationToken.objects.issue(self.user, VerificationToken.EMAIL_UPDATE, email='moved@example.com').token
+        response = self.client.get(reverse('verify_email_update'), {'token': token, 'email': 'other@example.com'})
+        self.assertEqual(response.status_code, 400)
+        token = VerificationToken.objects.issue(self.user, VerificationToken.EMAIL_UPDATE, email='moved@example.com').token
+        response = self.client.get(reverse('verify_email_update'), {'token': token, 'email': 'moved@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email, 'moved@example.com')
+
+    def test_cleanup_deletes_expired_tokens_in_batches(self):
+        from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+        past = timezone.now() - timedelta(minutes=1)
+        VerificationToken.objects.bulk_create(
+            VerificationToken(user=self.user, type=VerificationToken.REGISTRATION, token=f'expired-{n}', expires_at=past)
+            for n in range(5)
+        )
+        live = VerificationToken.objects.issue(self.user, VerificationToken.PASSWORD_RESET)
+        for n in range(3):
+            RefreshToken.for_user(self.user).blacklist()
+        live_jwt = RefreshToken.for_user(self.user)
+        OutstandingToken.objects.exclude(jti=live_jwt['jti']).update(expires_at=past)
+
+        out = StringIO()
+        call_command('cleanup_tokens', '--batch-size', '2', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), [
+            'Deleted 5 expired verification tokens', 'Deleted 3 expired blacklisted JWTs', 'Deleted 3 expired outstanding JWTs',
+        ])
+        self.assertEqual(list(VerificationToken.objects.all()), [live])
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [live_jwt['jti']])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+class RevokedTokensTests(TestCase):
+    @mock.patch('auth.functions.revocation.time.time', return_value=1000)
+    def test_entries_expire_with_their_token(self, now):
+        revoked = RevokedTokens()
+        revoked.add('expired', 999)
+        revoked.add('short', 1010)
+        revoked.add('long', 2000)
+        self.assertEqual(len(revoked), 2)
+        self.assertIn('short', revoked)
+        now.return_value = 1010
+        self.assertNotIn('short', revoked)
+        self.assertIn('long', revoked)
+        self.assertEqual(len(revoked), 1)
+
+    @override_settings(TOKEN_REVOCATION_CACHE='default')
+    def test_shared_through_the_cache(self):
+        caches['default'].clear()
+        RevokedTokens().add('jti-1', time.time() + 60)
+        self.assertIn('jti-1', RevokedTokens())
+        self.assertNotIn('jti-2', RevokedTokens())
+
+class StatelessAuthenticationTests(TestCase):
+    def setUp(self):
+        revoked_tokens.clear()
+        self.user = UserProfile.objects.create_user(username='listener', email='listener@example.com', name='Listener',
+                                                    is_verified=True)
+        self.refresh = RefreshToken.for_user(self.user)
+        self.access = str(self.refresh.access_token)
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {self.access}'}
+
+    def test_authenticated_requests_do_not_load_the_user(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('song-list-create'), **self.headers).status_code, 200)
+        self.assertFalse([query for query in queries if UserProfile._meta.db_table in query['sql']])
+
+    def test_views_load_the_user_when_needed(self):
+        response = self.client.get(reverse('get_user_profile'), **self.headers)
+        self.assertEqual(response.json()['username'], 'listener')
+        self.user.delete()
+        self.assertEqual(self.client.get(reverse('get_user_profile'), **self.headers).status_code, 401)
+
+    def test_logout_revokes_both_tokens(self):
+        response = self.client.post(reverse('logout'), {'refresh_token': str(self.refresh)},
+                                    content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(reverse('get_user_profile'), **self.headers).status_code, 401)
+        self.assertEqual(self.client.post(reverse('verify_token'), {'access_token': self.access},
+                                          content_type='application/json').status_code, 401)
+        self.assertEqual(self.client.post(reverse('refresh_token'), {'refresh_token': str(self.refresh)},
+                                          content_type='application/json').status_code, 400)
+
+    def refresh_access(self, token):
+        return self.client.post(reverse('refresh_token'), {'refresh_token': str(token)}, content_type='application/json')
+
+    def test_refresh_requires_an_active_user(self):
+        self.assertEqual(self.refresh_access(self.refresh).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.refresh_access(self.refresh).status_code, 400)
+        self.user.delete()
+        self.assertEqual(self.refresh_access(self.refresh).status_code, 400)
+
+    def test_delete_profile_revokes_the_refresh_token(self):
+        other = UserProfile.objects.create_user(username='other', email='other@example.com', name='Other')
+        response = self.client.delete(reverse('delete_profile'), {'refresh_token': str(RefreshToken.for_user(other))},
+                                      content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue(UserProfile.objects.filter(pk=self.user.pk).exists())
+
+        response = self.client.delete(reverse('delete_profile'), {'refresh_token': str(self.refresh)},
+                                      content_type='application/json', **self.headers)
+        self.assertEqual(response.status_code, 204)
+        self.assertIn(self.refresh['jti'], revoked_tokens)
+        self.assertEqual(self.client.post(reverse('verify_token'), {'access_token': self.access},
+                                          content_type='application/json').status_code, 401)
+
+    @mock.patch('auth.functions.revocation._warned_unshared', False)
+    def test_warns_without_a_shared_revocation_cache(self):
+        revoked = RevokedTokens()
+        with self.assertLogs('auth.functions.revocation', 'WARNING') as logs:
+            revoked.add('jti-1', time.time() + 60)
+            revoked.add('jti-2', time.time() + 60)
+        self.assertEqual(len(logs.records), 1)
+        with override_settings(TOKEN_REVOCATION_CACHE='default'), self.assertNoLogs('auth.functions.revocation'):
+            RevokedTokens().add('jti-3', time.time() + 60)
+
+class EmailTemplateTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.template_dir = Path(directory.name)
+        for patch in (mock.patch.object(send_mail, 'TEMPLATE_DIR', self.template_dir),
+                      mock.patch.object(send_mail, '_compiled', {})):
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def write(self, name, source, mtime):
+        path = self.template_dir / name
+        path.write_text(source)
+        os.utime(path, ns=(mtime, mtime))
+
+    def test_compiled_templates_render_like_render_template(self):
+        context = {'username': 'Listener', 'registration_link': 'https://example.com/verify/?token=abc'}
+        for info in send_mail.TEMPLATE_MAP.values():
+            with mock.patch.object(send_mail, 'TEMPLATE_DIR', Path(send_mail.__file__).parent / 'emails'):
+                source = send_mail.load_template(info['template'])
+                self.assertEqual(send_mail.get_template(info['template']).render(context),
+                                 send_mail.render_template(source, context))
+
+    def test_missing_placeholders_are_left_in_place(self):
+        self.write('notice.html', '{{ greeting }}, {{ username }}!', 1)
+        self.assertEqual(send_mail.get_template('notice.html').render({'username': 'Listener'}),
+                         '{{ greeting }}, Listener!')
+
+    def test_recompiles_when_the_file_changes(self):
+        self.write('notice.html', 'Hello {{ username }}', 1_000_000_000)
+        template = send_mail.get_template('notice.html')
+        with mock.patch.object(send_mail, 'load_template') as load:
+            self.assertIs(send_mail.get_template('notice.html'), template)
+            load.assert_not_called()
+        self.write('notice.html', 'Bye {{ username }}', 2_000_000_000)
+        self.assertEqual(send_mail.get_template('notice.html').render({'username': 'Listener'}), 'Bye Listener')
+
+    def test_send_batch_email_queues_every_recipient_in_one_insert(self):
+        self.write('notice.html', '<p>Hi {{ username }}, {{ news }}</p>', 1)
+        recipients = [(f'user{n}@example.com', {'username': f'User {n}', 'news': 'new releases are up'})
+                      for n in range(50)]
+        with self.assertNumQueries(1):
+            self.assertEqual(send_mail.send_batch_email('notice.html', 'News', recipients), 50)
+        email_49 = OutboundEmail.objects.get(recipient='user49@example.com')
+        self.assertEqual((email_49.subject, email_49.html), ('News', '<p>Hi User 49, new releases are up</p>'))
+
+    def test_build_message(self):
+        html = '<p>Hello Zoë, ==============</p>'
+        message = email.message_from_string(
+            send_mail.build_message('sender@example.com', 'listener@example.com', 'Welcome', html))
+        self.assertEqual((message['To'], message['Subject']), ('listener@example.com', 'Welcome'))
+        [part] = message.get_payload()
+        self.assertEqual(part.get_content_type(), 'text/html')
+        self.assertEqual(part.get_payload(decode=True).decode('utf-8'), html)
+
+class RecordingSMTPHandler:
+    """aiosmtpd handler keeping every accepted message with the session it arrived on."""
+    def __init__(self):
+        self.logins = 0
+        self.messages = []
+        self.refuse = set()
+
+    def authenticate(self, server, session, envelope, mechanism, auth_data):
+        self.logins += 1
+        return AuthResult(success=auth_data.login == b'sender@example.com' and auth_data.password == b'secret')
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.refuse:
+            return '550 Mailbox unavailable'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append((id(session), envelope.rcpt_tos[0]))
+        return '250 Message accepted for delivery'
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+class LocalSMTPMixin:
+    """Runs a local aiosmtpd server standing in for the SMTP relay, closing sessions idle ``idle_timeout`` seconds."""
+    idle_timeout = 300
+
+    def setUp(self):
+        self.handler = RecordingSMTPHandler()
+        self.port = free_port()
+        self.smtp = Controller(self.handler, hostname='127.0.0.1', port=self.port, timeout=self.idle_timeout,
+                               authenticator=self.handler.authenticate, auth_require_tls=False)
+        self.smtp.start()
+        self.addCleanup(self.smtp.stop)
+        settings = override_settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.port, EMAIL_USE_SSL=False,
+                                     EMAIL_USE_TLS=False, EMAIL_SENDER='sender@example.com', EMAIL_PASSWORD='secret',
+                                     EMAIL_TIMEOUT=5)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def queue(self, *recipients):
+        for recipient in recipients:
+            send_verification_email('Listener', recipient, 'http://testserver/verify-email/?token=t')
+
+@skipUnless(Controller, "aiosmtpd is not installed")
+class OutboundEmailTests(LocalSMTPMixin, TestCase):
+    def test_register_queues_instead_of_sending(self):
+        response = self.client.post(reverse('register'), {
+            'username': 'newcomer', 'name': 'Newcomer', 'email': 'newcomer@example.com', 'password': 'correct horse',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.recipient, email.status), ('newcomer@example.com', OutboundEmail.PENDING))
+        self.assertIn('/verify-email/?token=', email.html)
+        self.assertEqual(self.handler.messages, [])
+
+    def test_worker_sends_batches_over_one_session(self):
+        recipients = [f'user{n}@example.com' for n in range(25)]
+        self.queue(*recipients)
+        out = StringIO()
+        call_command('send_queued_mail', '--once', '--batch-size', '10', stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Sent 25 emails")
+        self.assertEqual([recipient for _, recipient in self.handler.messages], recipients)
+        self.assertEqual(len({session for session, _ in self.handler.messages}), 1)
+        self.assertEqual(self.handler.logins, 1)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists())
+
+    def test_refused_recipient_fails_alone(self):
+        self.handler.refuse.add('gone@example.com')
+        self.queue('first@example.com', 'gone@example.com', 'last@example.com')
+        with self.assertLogs('auth.functions.mail_queue', 'WARNING'), get_email_provider() as provider:
+            self.assertEqual(send_pending(provider), 2)
+        self.assertEqual([recipient for _, recipient in self.handler.messages], ['first@example.com', 'last@example.com'])
+        self.assertEqual(len({session for session, _ in self.handler.messages}), 1)
+        failed = OutboundEmail.objects.get(status=OutboundEmail.FAILED)
+        self.assertEqual((failed.recipient, failed.attempts), ('gone@example.com', 1))
+        self.assertIn('550', failed.error)
+
+    def test_unreachable_server_retries_with_backoff(self):
+        self.queue('first@example.com', 'last@example.com')
+        with self.assertLogs('auth.functions.mail_queue', 'ERROR'), override_settings(EMAIL_PORT=free_port()), \
+                get_email_provider() as provider:
+            self.assertEqual(send_pending(provider), 0)
+        for email in OutboundEmail.objects.all():
+            self.assertEqual((email.status, email.attempts), (OutboundEmail.PENDING, 1))
+            self.assertGreater(email.run_after, timezone.now())
+        OutboundEmail.objects.update(run_after=timezone.now())
+        with get_email_provider() as provider:
+            self.assertEqual(send_pending(provider), 2)
+
+    def test_gives_up_after_max_attempts(self):
+        self.queue('first@example.com')
+        OutboundEmail.objects.update(attempts=4)
+        with self.assertLogs('auth.functions.mail_queue', 'ERROR'), \
+                override_settings(EMAIL_PORT=free_port(), EMAIL_MAX_ATTEMPTS=5), get_email_provider() as provider:
+            send_pending(provider)
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.FAILED, 5))
+
+@skipUnless(Controller, "aiosmtpd is not installed")
+class OutboundEmailIdleTests(LocalSMTPMixin, TestCase):
+    """The server drops idle sessions after a second; the provider logs in again."""
+    idle_timeout = 1
+
+    def test_reconnects_after_idle_disconnect(self):
+        self.queue('first@example.com')
+        with get_email_provider() as provider:
+            send_pending(provider)
+            time.sleep(1.5)
+            self.queue('last@example.com')
+            self.assertEqual(send_pending(provider), 1)
+            self.assertEqual(provider.sessions, 2)
+        self.assertEqual(len({session for session, _ in self.handler.messages}), 2)
+        self.assertFalse(OutboundEmail.objects.exclude(status=OutboundEmail.SENT).exists())
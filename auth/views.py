@@ -1,3 +1,4 @@
+from django.apps import apps
 from django.conf import settings
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
@@ -5,11 +6,18 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken, UntypedToken
 from rest_framework_simplejwt.exceptions import TokenError, InvalidToken
-from .models import UserProfile
+from rest_framework_simplejwt.settings import api_settings
+from MusicPlayer.metrics import query_budget
+from MusicPlayer.proxies import client_ip
+from .authentication import get_full_user
+from .backends import login_backend
+from .models import UserProfile, VerificationToken
 from .serializers import UserProfileSerializer, UserProfileUpdateSerializer, UserRegistrationSerializer
-from .functions.generate_verification import generate_verification_token
+from .functions.rate_limit import login_limits
+from .functions.revocation import is_revoked, revoke
 from .functions.send_mail import send_verification_email
 
+@query_budget(POST=2)
 @api_view(['POST'])
 def login(request):
     identifier = request.data.get('identifier', '').strip()
@@ -20,9 +28,20 @@ def login(request):
             "message": "Username/email and password are required"
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    from django.contrib.auth import get_backends
-    backend = get_backends()[0]  
-    user = backend.authenticate(request, username=identifier, password=password)
+    ip_limit, identifier_limit = login_limits()
+    ip = client_ip(request)
+    retry_after = max(ip_limit.retry_after(ip), identifier_limit.retry_after(identifier))
+    if retry_after:
+        return Response({
+            "message": "Too many login attempts, please try again later"
+        }, status=status.HTTP_429_TOO_MANY_REQUESTS, headers={'Retry-After': str(retry_after)})
+    ip_limit.hit(ip)
+
+    user = login_backend().authenticate(request, username=identifier, password=password)
+    if user is None:
+        identifier_limit.hit(identifier)
+    else:
+        identifier_limit.reset(identifier)
     
     if user is not None:
         if not user.is_verified:
@@ -45,12 +64,14 @@ def login(request):
             "message": "Invalid credentials"
         }, status=status.HTTP_401_UNAUTHORIZED)
 
+@query_budget(GET=1)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_profile(request):
-    serializer = UserProfileSerializer(request.user)
+    serializer = UserProfileSerializer(get_full_user(request))
     return Response(serializer.data, status=status.HTTP_200_OK)
     
+@query_budget(POST=7)
 @api_view(['POST'])
 def logout(request):
     try:
@@ -61,7 +82,11 @@ def logout(request):
             }, status=status.HTTP_400_BAD_REQUEST)
             
         token = RefreshToken(refresh_token)
-        token.blacklist()  
+        revoke(token)
+        if apps.is_installed('rest_framework_simplejwt.token_blacklist'):
+            token.blacklist()
+        if request.auth is not None:
+            revoke(request.auth)
         return Response({
             'message': 'Logout successful'
         }, status=status.HTTP_200_OK)
@@ -70,20 +95,19 @@ def logout(request):
             'message': 'Invalid refresh token'
         }, status=status.HTTP_400_BAD_REQUEST)
 
+@query_budget(POST=7)
 @api_view(['POST'])
 def register(request):
     serializer = UserRegistrationSerializer(data=request.data)
     
     if serializer.is_valid():
-        verification_token = generate_verification_token()
-        
         user = UserProfile.objects.create_user(
             username=serializer.validated_data['username'],
             name=serializer.validated_data['name'],
             email=serializer.validated_data['email'],
             password=serializer.validated_data['password'],
-            verification_token=verification_token
         )
+        verification_token = VerificationToken.objects.issue(user, VerificationToken.REGISTRATION, replace=False).token
         
         verification_link = f"{settings.BASE_URL}/verify-email/?token={verification_token}"
         send_verification_email(user.name, user.email, verification_link)
@@ -94,6 +118,7 @@ def register(request):
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@query_budget(GET=3)
 @api_view(['GET'])
 def verify_email(request):
     token = request.query_params.get('token')
@@ -103,12 +128,12 @@ def verify_email(request):
             'message': 'Verification token is required'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    user = UserProfile.objects.filter(verification_token=token).first()
+    verification = VerificationToken.objects.consume(token, VerificationToken.REGISTRATION)
     
-    if user:
+    if verification:
+        user = verification.user
         user.is_verified = True
-        user.verification_token = None
-        user.save()
+        user.save(update_fields=['is_verified'])
         return Response({
             'message': 'Email verified successfully'
         }, status=status.HTTP_200_OK)
@@ -117,6 +142,7 @@ def verify_email(request):
             'message': 'Invalid verification token'
         }, status=status.HTTP_400_BAD_REQUEST)
 
+@query_budget(POST=4)
 @api_view(['POST'])
 def forgot_password(request):
     identifier = request.data.get('identifier', '').strip()
@@ -136,9 +162,7 @@ def forgot_password(request):
             'message': 'User not found'
         }, status=status.HTTP_404_NOT_FOUND)
     
-    verification_token = generate_verification_token()
-    user.verification_token = verification_token
-    user.save()
+    verification_token = VerificationToken.objects.issue(user, VerificationToken.PASSWORD_RESET).token
     
     reset_link = f"{settings.BASE_URL}/reset-password/?token={verification_token}"
     send_verification_email(user.name, user.email, reset_link, email_type="password_reset")
@@ -147,6 +171,7 @@ def forgot_password(request):
         'message': 'Password reset link sent to your email'
     }, status=status.HTTP_200_OK)
 
+@query_budget(POST=3)
 @api_view(['POST'])
 def reset_password(request):
     token = request.data.get('token')
@@ -157,12 +182,12 @@ def reset_password(request):
             'message': 'Token and new password are required'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    user = UserProfile.objects.filter(verification_token=token).first()
+    verification = VerificationToken.objects.consume(token, VerificationToken.PASSWORD_RESET)
     
-    if user:
+    if verification:
+        user = verification.user
         user.set_password(new_password)
-        user.verification_token = None
-        user.save()
+        user.save(update_fields=['password'])
         return Response({
             'message': 'Password reset successful'
         }, status=status.HTTP_200_OK)
@@ -171,27 +196,29 @@ def reset_password(request):
             'message': 'Invalid token'
         }, status=status.HTTP_400_BAD_REQUEST)
     
+@query_budget(PUT=2)
 @api_view(['PUT'])
 @permission_classes([IsAuthenticated])
 def update_profile(request):
-    serializer = UserProfileUpdateSerializer(request.user, data=request.data, partial=True)
+    user = get_full_user(request)
+    serializer = UserProfileUpdateSerializer(user, data=request.data, partial=True)
     
     if serializer.is_valid():
-        old_email = request.user.email
+        old_email = user.email
         new_email = serializer.validated_data.get('email')
         
         if new_email and new_email != old_email:
-            if UserProfile.objects.filter(email=new_email).exclude(id=request.user.id).exists():
+            if UserProfile.objects.filter(email=new_email).exclude(id=user.id).exists():
                 return Response({
                     'message': 'Email already exists'
                 }, status=status.HTTP_400_BAD_REQUEST)
             
-            verification_token = generate_verification_token()
-            request.user.verification_token = verification_token
-            request.user.save()
+            verification_token = VerificationToken.objects.issue(
+                user, VerificationToken.EMAIL_UPDATE, email=new_email
+            ).token
             
             verification_link = f"{settings.BASE_URL}/verify-email-update/?token={verification_token}&email={new_email}"
-            send_verification_email(request.user.name, new_email, verification_link, email_type="email_update")
+            send_verification_email(user.name, new_email, verification_link, email_type="email_update")
             
             return Response({
                 'message': 'Verification email sent to new email address'
@@ -200,11 +227,12 @@ def update_profile(request):
         serializer.save()
         return Response({
             'message': 'Profile updated successfully',
-            'user': UserProfileSerializer(request.user).data
+            'user': UserProfileSerializer(user).data
         }, status=status.HTTP_200_OK)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+@query_budget(GET=3)
 @api_view(['GET'])
 def verify_email_update(request):
     token = request.query_params.get('token')
@@ -215,12 +243,12 @@ def verify_email_update(request):
             'message': 'Token and email are required'
         }, status=status.HTTP_400_BAD_REQUEST)
     
-    user = UserProfile.objects.filter(verification_token=token).first()
+    verification = VerificationToken.objects.consume(token, VerificationToken.EMAIL_UPDATE)
     
-    if user:
+    if verification and verification.email == new_email:
+        user = verification.user
         user.email = new_email
-        user.verification_token = None
-        user.save()
+        user.save(update_fields=['email'])
         return Response({
             'message': 'Email updated successfully'
         }, status=status.HTTP_200_OK)
@@ -229,14 +257,30 @@ def verify_email_update(request):
             'message': 'Invalid token'
         }, status=status.HTTP_400_BAD_REQUEST)
 
+@query_budget(DELETE=8)
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def delete_profile(request):
-    request.user.delete()
+    user = get_full_user(request)
+    refresh = None
+    if request.data.get('refresh_token'):
+        try:
+            refresh = RefreshToken(request.data['refresh_token'])
+        except TokenError:
+            refresh = None
+        if refresh is None or str(refresh.get(api_settings.USER_ID_CLAIM)) != str(getattr(user, api_settings.USER_ID_FIELD)):
+            return Response({
+                'message': 'Invalid refresh token'
+            }, status=status.HTTP_400_BAD_REQUEST)
+    user.delete()
+    revoke(request.auth)
+    if refresh is not None:
+        revoke(refresh)
     return Response({
         'message': 'Account deleted successfully'
     }, status=status.HTTP_204_NO_CONTENT)
 
+@query_budget(POST=0)
 @api_view(['POST'])
 def verify_token(request):
     token = request.data.get('access_token')
@@ -248,7 +292,8 @@ def verify_token(request):
         }, status=status.HTTP_400_BAD_REQUEST)
 
     try:
-        UntypedToken(token)
+        if is_revoked(UntypedToken(token)):
+            raise InvalidToken("Token has been revoked")
         return Response({
             "success": True,
             "message": "Token is valid"
@@ -259,6 +304,7 @@ def verify_token(request):
             "message": "Token is invalid or expired"
         }, status=status.HTTP_401_UNAUTHORIZED)
 
+@query_budget(POST=2)
 @api_view(['POST'])
 def refresh_token(request):
     refresh_token = request.data.get('refresh_token')
@@ -271,6 +317,15 @@ def refresh_token(request):
 
     try:
         token = RefreshToken(refresh_token)
+        if is_revoked(token):
+            raise TokenError("Token has been revoked")
+        # Access tokens are trusted without a lookup until they expire, so
+        # stop minting them for accounts deleted or deactivated since.
+        user = UserProfile.objects.filter(
+            **{api_settings.USER_ID_FIELD: token.get(api_settings.USER_ID_CLAIM)}
+        ).first()
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise TokenError("User is inactive or no longer exists")
         new_access_token = str(token.access_token)
         
         return Response({